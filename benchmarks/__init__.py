@@ -0,0 +1,24 @@
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Performance benchmarks for binplist.
+
+Each module can be run on its own, e.g.:
+
+  python -m benchmarks.offset_table
+
+benchmarks.run runs the parsers over a synthetic corpus generated by
+benchmarks.corpus and writes the results as JSON, to be compared across
+commits.
+"""
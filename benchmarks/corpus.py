@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generates a deterministic corpus of synthetic plists.
+
+Each plist is described by a profile, a set of parameters that control its
+shape (see DEFAULTS). The same profile and seed always produce the same plist,
+so results can be compared across commits. Every plist is written both as a
+binary plist, <profile>.bplist, and as an XML plist, <profile>.xml.
+
+  python -m benchmarks.corpus -d /tmp/corpus -p flat,nested --scale 0.1
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import plistlib
+import random
+
+from binplist import binplist
+
+
+# The parameters of a plist:
+#   seed: The seed of the random generator.
+#   object_count: The amount of objects to generate, before any sharing.
+#   depth: The nesting depth. Leaves are at this depth.
+#   width: The amount of elements of the nested containers. The top level
+#     array holds as many containers as needed to reach object_count.
+#   string_size, utf16_size, data_size: The size of ASCII strings, UTF-16
+#     strings and data objects. 0 means none of that kind.
+#   date_density: The ratio of leaves that are dates.
+#   sharing_ratio: The ratio of leaves that reuse an already generated leaf.
+#   object_ref_size, offset_int_size: The size of object references and
+#     offsets, or None to use the smallest one that fits.
+DEFAULTS = {
+    "seed": 0,
+    "object_count": 100000,
+    "depth": 3,
+    "width": 16,
+    "string_size": 16,
+    "utf16_size": 0,
+    "data_size": 0,
+    "date_density": 0.05,
+    "sharing_ratio": 0.0,
+    "object_ref_size": None,
+    "offset_int_size": None,
+}
+
+# The parameters that differ from DEFAULTS in each profile
+PROFILES = {
+    "flat": {"depth": 1},
+    "nested": {"depth": 6, "width": 6},
+    "deep": {"object_count": 20000, "depth": 250, "width": 1},
+    "wide": {"depth": 2, "width": 1000},
+    "strings": {"object_count": 50000, "string_size": 256, "utf16_size": 64},
+    "data": {"object_count": 20000, "string_size": 0, "data_size": 4096},
+    "dates": {"date_density": 0.9},
+    "wide_refs": {"object_ref_size": 8, "offset_int_size": 8},
+    "shared": {"sharing_ratio": 0.5},
+}
+
+_EPOCH = datetime.datetime(2001, 1, 1)
+
+# plistlib.Data and writePlist are gone in python 3
+_PlistlibData = getattr(plistlib, "Data", bytes)
+_WriteXmlPlist = getattr(plistlib, "dump", None) or plistlib.writePlist
+
+
+def GetParameters(profile, scale=1.0):
+  """Returns the parameters of a profile.
+
+  Args:
+    profile: The name of a profile in PROFILES.
+    scale: A factor for the object count.
+
+  Returns:
+    A dictionary with all the parameters of DEFAULTS.
+  """
+  parameters = dict(DEFAULTS)
+  parameters.update(PROFILES[profile])
+  parameters["object_count"] = max(1, int(parameters["object_count"] * scale))
+  return parameters
+
+
+class PlistGenerator(object):
+  """Generates a plist from its parameters. See DEFAULTS."""
+
+  def __init__(self, **parameters):
+    self.parameters = dict(DEFAULTS)
+    self.parameters.update(parameters)
+    self._random = random.Random(self.parameters["seed"])
+    self._remaining = 0
+    self._leaves = []
+    self._leaf_kinds = [kind for kind, size in [
+        ("string", self.parameters["string_size"]),
+        ("utf16", self.parameters["utf16_size"]),
+        ("data", self.parameters["data_size"])] if size]
+    self._leaf_kinds.extend(["integer", "real", "boolean"])
+
+  def Generate(self):
+    """Returns the top level array of the plist."""
+    self._remaining = self.parameters["object_count"] - 1
+    top_level_object = []
+    while self._remaining > 0:
+      top_level_object.append(self._Generate(1))
+    return top_level_object
+
+  def _Generate(self, level):
+    self._remaining -= 1
+    if level >= self.parameters["depth"]:
+      return self._GenerateLeaf()
+    width = self.parameters["width"]
+    if level % 2:
+      container = []
+      while len(container) < width and self._remaining > 0:
+        container.append(self._Generate(level + 1))
+    else:
+      container = {}
+      while len(container) < width and self._remaining > 0:
+        # Keys are shared among dictionaries, as in most real plists
+        self._remaining -= 1
+        container["key%d" % len(container)] = self._Generate(level + 1)
+    return container
+
+  def _GenerateLeaf(self):
+    if self._leaves and self._random.random() < self.parameters[
+        "sharing_ratio"]:
+      return self._random.choice(self._leaves)
+    if self._random.random() < self.parameters["date_density"]:
+      leaf = _EPOCH + datetime.timedelta(
+          seconds=self._random.randint(0, 1 << 30))
+    else:
+      kind = self._random.choice(self._leaf_kinds)
+      if kind == "string":
+        leaf = self._RandomString(self.parameters["string_size"])
+      elif kind == "utf16":
+        leaf = u"%s\xe9\u4e2d" % self._RandomString(
+            self.parameters["utf16_size"])
+      elif kind == "data":
+        leaf = _PlistlibData(bytes(bytearray(
+            self._random.getrandbits(8)
+            for _ in range(self.parameters["data_size"]))))
+      elif kind == "integer":
+        leaf = self._random.randint(-(1 << 40), 1 << 40)
+      elif kind == "real":
+        leaf = self._random.random()
+      else:
+        leaf = bool(self._random.getrandbits(1))
+    self._leaves.append(leaf)
+    return leaf
+
+  def _RandomString(self, size):
+    # A counter keeps strings unique despite the small alphabet
+    prefix = "%d:" % len(self._leaves)
+    return prefix + "".join(self._random.choice("abcdefghijklmnopqrstuvwxyz")
+                            for _ in range(max(0, size - len(prefix))))
+
+
+def WritePlists(profile, directory, scale=1.0):
+  """Writes the binary and XML plists of a profile to directory.
+
+  Returns:
+    A tuple with the paths of the binary and XML plists.
+  """
+  parameters = GetParameters(profile, scale)
+  top_level_object = PlistGenerator(**parameters).Generate()
+  writer = binplist.BinaryPlistWriter(
+      object_ref_size=parameters["object_ref_size"],
+      offset_int_size=parameters["offset_int_size"])
+  binary_path = os.path.join(directory, "%s.bplist" % profile)
+  with open(binary_path, "wb") as file_obj:
+    writer.Write(top_level_object, file_obj)
+  xml_path = os.path.join(directory, "%s.xml" % profile)
+  with open(xml_path, "wb") as file_obj:
+    _WriteXmlPlist(top_level_object, file_obj)
+  return binary_path, xml_path
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-d", "--directory", default=".",
+                      help="The directory to write the plists to.")
+  parser.add_argument("-p", "--profiles", default=",".join(sorted(PROFILES)),
+                      help="Comma separated profiles to generate.")
+  parser.add_argument("-s", "--scale", default=1.0, type=float,
+                      help="A factor for the object count of the profiles.")
+  options = parser.parse_args()
+
+  for profile in options.profiles.split(","):
+    for path in WritePlists(profile, options.directory, options.scale):
+      print("%s: %d bytes" % (path, os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+  main()
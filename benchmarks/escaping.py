@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks escaping binary strings for PlistToUnicode.
+
+Compares the table driven escaping against the former per byte loops, for
+the safeascii representation and for the hex representation used by
+RawValue and strings that can't be decoded. Blobs are random bytes.
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import random
+import string
+import timeit
+
+from binplist import binplist
+
+_PRINTABLE = string.printable.encode("ascii")
+
+
+def LegacySafeAsciiEscape(data):
+  """The per byte safeascii escaping PlistToUnicode used to do."""
+  safeascii = []
+  for index in range(len(data)):
+    c = data[index:index + 1]
+    if c in _PRINTABLE:
+      safeascii.append(c)
+    else:
+      safeascii.append(b"\\x" + binascii.hexlify(c))
+  return b"".join(safeascii)
+
+
+def LegacyHexEscape(data):
+  """The per byte hex escaping PlistToUnicode used to do."""
+  return b"".join([b"\\x" + binascii.hexlify(data[index:index + 1])
+                   for index in range(len(data))])
+
+
+def ParseSize(size):
+  """Returns the amount of bytes of a size such as 1K, 10M or 512."""
+  units = {"K": 1 << 10, "M": 1 << 20}
+  if size[-1].upper() in units:
+    return int(size[:-1]) * units[size[-1].upper()]
+  return int(size)
+
+
+def TimeEscape(escape_function, data, repeat):
+  """Returns the best time of escape_function over data."""
+  return min(timeit.repeat(lambda: escape_function(data), number=1,
+                           repeat=repeat))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-s", "--sizes", default="1K,100K,1M,10M,100M",
+                      help="Comma separated blob sizes to benchmark.")
+  parser.add_argument("-l", "--legacy-limit", default="10M",
+                      help="Largest blob size the legacy loops are timed on.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  options = parser.parse_args()
+  legacy_limit = ParseSize(options.legacy_limit)
+
+  # Larger blobs repeat this block
+  randomizer = random.Random(0)
+  block = bytes(bytearray(randomizer.getrandbits(8) for _ in range(1 << 20)))
+  print("%10s %9s %12s %12s %8s" % ("size", "escaping", "legacy (s)",
+                                    "table (s)", "speedup"))
+  for size in [ParseSize(size) for size in options.sizes.split(",")]:
+    data = (block * (size // len(block) + 1))[:size]
+    for name, legacy_function, table_function in (
+        ("safeascii", LegacySafeAsciiEscape, binplist._SafeAsciiEscape),
+        ("hex", LegacyHexEscape, binplist._HexEscape)):
+      table = TimeEscape(table_function, data, options.repeat)
+      if size > legacy_limit:
+        print("%10d %9s %12s %12.4f %8s" % (size, name, "-", table, "-"))
+        continue
+      legacy = TimeEscape(legacy_function, data, options.repeat)
+      print("%10d %9s %12.4f %12.4f %7.1fx" % (size, name, legacy, table,
+                                               legacy / table))
+
+
+if __name__ == "__main__":
+  main()
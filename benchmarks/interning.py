@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks parsing many similar plists with and without an InternPool.
+
+Plists resemble application Info.plist files: the same keys with values drawn
+from a small set, plus a few unique ones. All the parsed plists are kept, as an
+indexer would, and the growth of the resident set size is reported along with
+the time to parse them. Each policy is measured in its own process.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import timeit
+
+from binplist import binplist
+from benchmarks.run import _GetRss
+
+
+# Keys found in most application bundles
+_KEYS = ["CFBundleDevelopmentRegion", "CFBundleExecutable",
+         "CFBundleIdentifier", "CFBundleInfoDictionaryVersion",
+         "CFBundleName", "CFBundlePackageType", "CFBundleShortVersionString",
+         "CFBundleSignature", "CFBundleVersion", "LSMinimumSystemVersion",
+         "NSHumanReadableCopyright", "NSMainNibFile", "NSPrincipalClass",
+         "NSHighResolutionCapable", "LSApplicationCategoryType"]
+_SHARED_VALUES = ["English", "APPL", "????", "6.0", "NSApplication",
+                  "MainMenu", "10.6", "1.0", "public.app-category.utilities"]
+
+# Policy name to the InternPool arguments, None for no pool
+POLICIES = {
+    "none": None,
+    "keys": {"policy": binplist.InternPool.KEYS},
+    "keys_and_values": {"policy": binplist.InternPool.KEYS_AND_VALUES},
+}
+
+
+def BuildPlists(count, seed=0):
+  """Returns count binary plists resembling application Info.plist files."""
+  generator = random.Random(seed)
+  plists = []
+  for index in range(count):
+    root = dict((key, generator.choice(_SHARED_VALUES)) for key in _KEYS)
+    root["CFBundleIdentifier"] = "com.example.app%d" % index
+    root["CFBundleDocumentTypes"] = [
+        {"CFBundleTypeName": "Document %d" % type_index,
+         "CFBundleTypeRole": generator.choice(["Editor", "Viewer"]),
+         "LSHandlerRank": generator.choice(["Owner", "Default", "Alternate"])}
+        for type_index in range(generator.randint(0, 8))]
+    plists.append(binplist.writePlistToString(root))
+  return plists
+
+
+def Measure(policy, count, repeat):
+  """Parses count plists keeping them all, and returns the measurements."""
+  plists = BuildPlists(count)
+  pool_arguments = POLICIES[policy]
+
+  def ParseAll():
+    pool = None
+    if pool_arguments is not None:
+      pool = binplist.InternPool(**pool_arguments)
+    return [binplist.BufferBinaryPlist(data, intern_pool=pool).Parse()
+            for data in plists]
+
+  baseline_rss = _GetRss("VmRSS")
+  parsed = ParseAll()
+  rss = _GetRss("VmRSS")
+  del parsed
+  parse_time = min(timeit.repeat(ParseAll, number=1, repeat=repeat))
+  return {"parse_seconds": parse_time, "rss_kib": rss - baseline_rss}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-c", "--count", default=20000, type=int,
+                      help="The amount of plists to parse.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  parser.add_argument("--measure", choices=sorted(POLICIES),
+                      help=argparse.SUPPRESS)
+  options = parser.parse_args()
+
+  if options.measure:
+    json.dump(Measure(options.measure, options.count, options.repeat),
+              sys.stdout)
+    return
+
+  print("%-16s %10s %10s" % ("policy", "parse (s)", "kept MiB"))
+  for policy in ("none", "keys", "keys_and_values"):
+    result = json.loads(subprocess.check_output([
+        sys.executable, "-m", "benchmarks.interning", "--measure", policy,
+        "--count", str(options.count), "--repeat", str(options.repeat)]))
+    print("%-16s %10.4f %10.1f" % (policy, result["parse_seconds"],
+                                   result["rss_kib"] / 1024.0))
+
+
+if __name__ == "__main__":
+  main()
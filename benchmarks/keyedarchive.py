@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the decoding of keyed archives.
+
+Compares KeyedArchive against a recursive resolver without memoization, as
+found in scripts that decode keyed archives by hand, which decodes shared
+objects once per reference. The archive is an array of records, all sharing
+their keys, their class descriptions and a tags array.
+
+Also times reading a single record from the archive file with
+readKeyedArchive, eagerly and lazily.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import io
+import timeit
+
+from binplist import binplist
+from binplist import keyedarchive
+
+U = binplist.Uid
+
+
+def BuildArchive(record_count):
+  """Returns the data of an archive with an array of record_count records."""
+  objects = ["$null", None]
+  def Add(obj):
+    objects.append(obj)
+    return U(len(objects) - 1)
+  array_class = Add({"$classname": "NSMutableArray",
+                     "$classes": ["NSMutableArray", "NSArray", "NSObject"]})
+  dictionary_class = Add({"$classname": "NSDictionary",
+                          "$classes": ["NSDictionary", "NSObject"]})
+  date_class = Add({"$classname": "NSDate", "$classes": ["NSDate", "NSObject"]})
+  keys = [Add(key) for key in ("name", "size", "modified", "tags")]
+  tags = Add({"$class": array_class,
+              "NS.objects": [Add("tag%d" % index) for index in range(8)]})
+  records = []
+  for index in range(record_count):
+    values = [Add("file%d.txt" % index), index * 512,
+              Add({"$class": date_class, "NS.time": 4e8 + index}), tags]
+    records.append(Add({"$class": dictionary_class, "NS.keys": keys,
+                        "NS.objects": values}))
+  objects[1] = {"$class": array_class, "NS.objects": records}
+  return binplist.writePlistToString({
+      "$archiver": "NSKeyedArchiver", "$version": 100000,
+      "$top": {"root": U(1)}, "$objects": objects})
+
+
+def NaiveResolve(objects, value):
+  """Decodes value recursively, resolving UIDs every time they're found."""
+  if isinstance(value, binplist.Uid):
+    value = objects[value]
+    if value == "$null":
+      return None
+  if not isinstance(value, dict) or "$class" not in value:
+    return value
+  classname = objects[value["$class"]]["$classname"]
+  if classname in ("NSArray", "NSMutableArray"):
+    return [NaiveResolve(objects, element) for element in value["NS.objects"]]
+  if classname in ("NSDictionary", "NSMutableDictionary"):
+    return dict((NaiveResolve(objects, key), NaiveResolve(objects, element))
+                for key, element in zip(value["NS.keys"],
+                                        value["NS.objects"]))
+  if classname == "NSDate":
+    return binplist.BinaryPlist.plist_epoch + datetime.timedelta(
+        seconds=value["NS.time"])
+  return value
+
+
+def Best(function, repeat):
+  return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-c", "--counts", default="10000,50000",
+                      help="Comma separated record counts to benchmark. "
+                      "Each record takes 3 objects.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  options = parser.parse_args()
+
+  print("%8s %10s %10s %10s %12s %12s %12s" % (
+      "objects", "naive (s)", "memo (s)", "objects/s", "lazy (s)",
+      "read (s)", "read lazy (s)"))
+  for record_count in [int(count) for count in options.counts.split(",")]:
+    data = BuildArchive(record_count)
+    archive = binplist.readPlistFromString(data)
+    object_count = len(archive["$objects"])
+    naive = Best(lambda: NaiveResolve(archive["$objects"],
+                                      archive["$top"]["root"]),
+                 options.repeat)
+    memo = Best(lambda: keyedarchive.KeyedArchive(archive).top,
+                options.repeat)
+    lazy = Best(lambda: keyedarchive.KeyedArchive(
+        archive, lazy=True).top["root"][record_count // 2], options.repeat)
+    read = Best(lambda: keyedarchive.readKeyedArchive(
+        io.BytesIO(data))["root"][record_count // 2], options.repeat)
+    read_lazy = Best(lambda: keyedarchive.readKeyedArchive(
+        io.BytesIO(data), lazy=True)["root"][record_count // 2],
+                     options.repeat)
+    print("%8d %10.3f %10.3f %10d %12.4f %12.3f %12.4f" % (
+        object_count, naive, memo, object_count / memo, lazy, read, read_lazy))
+
+
+if __name__ == "__main__":
+  main()
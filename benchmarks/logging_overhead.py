@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the per-object cost of logging while logging is disabled.
+
+The unguarded parser emulates the parser before log calls were guarded: every
+log call goes all the way to the logging module, which then discards it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import logging
+import struct
+import timeit
+
+from binplist import binplist
+
+
+class UnguardedBinaryPlist(binplist.BinaryPlist):
+  """A BinaryPlist that always calls the logging functions."""
+
+  def _UpdateLogLevels(self):
+    self._log_debug = True
+    self._log_ultra_verbose = True
+
+
+def BuildArrayPlist(object_count):
+  """Returns a plist with an array of alternating integers and strings."""
+  objects = [b"\xAF\x12" + struct.pack(">L", object_count) +
+             struct.pack(">%dL" % object_count, *range(1, object_count + 1))]
+  for index in range(object_count):
+    if index % 2:
+      objects.append(b"\x11" + struct.pack(">H", index & 0xFFFF))
+    else:
+      objects.append(b"\x53abc")
+  offsets = []
+  offset = 8
+  for obj in objects:
+    offsets.append(offset)
+    offset += len(obj)
+  offset_table = struct.pack(">%dL" % len(offsets), *offsets)
+  trailer = struct.pack(">5xBBBQQQ", 1, 4, 4, len(objects), 0, offset)
+  return b"bplist00" + b"".join(objects) + offset_table + trailer
+
+
+def TimeParse(plist_class, data, repeat):
+  """Returns the best time to parse data with plist_class."""
+  def Parse():
+    plist_class(io.BytesIO(data)).Parse()
+  return min(timeit.repeat(Parse, number=1, repeat=repeat))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-c", "--counts", default="10000,100000",
+                      help="Comma separated object counts to benchmark.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  options = parser.parse_args()
+  logging.getLogger().setLevel(logging.WARNING)
+
+  print("%10s %16s %16s %8s" % ("objects", "unguarded (us)", "guarded (us)",
+                                "speedup"))
+  for object_count in [int(count) for count in options.counts.split(",")]:
+    data = BuildArrayPlist(object_count)
+    # Per object times, in microseconds
+    unguarded = TimeParse(UnguardedBinaryPlist, data,
+                          options.repeat) * 1e6 / (object_count + 1)
+    guarded = TimeParse(binplist.BinaryPlist, data,
+                        options.repeat) * 1e6 / (object_count + 1)
+    print("%10d %16.2f %16.2f %7.1fx" % (object_count, unguarded, guarded,
+                                         unguarded / guarded))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the recursive parser against the iterative one.
+
+Nested plists are arrays of a single array, as deep as requested. Depths above
+python's recursion limit can only be parsed by the iterative parser.
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import logging
+import struct
+import timeit
+
+from binplist import binplist
+from benchmarks.logging_overhead import BuildArrayPlist
+
+
+def BuildNestedPlist(depth):
+  """Returns a plist with arrays nested depth levels deep."""
+  objects = [b"\xA1" + struct.pack(">L", index + 1) for index in range(depth)]
+  objects.append(b"\x10\x01")
+  offsets = [8 + 5 * index for index in range(len(objects))]
+  offset_table = struct.pack(">%dL" % len(offsets), *offsets)
+  trailer = struct.pack(">5xBBBQQQ", 1, 4, 4, len(objects), 0,
+                        8 + len(b"".join(objects)))
+  return b"bplist00" + b"".join(objects) + offset_table + trailer
+
+
+def TimeParse(plist_class, data, repeat):
+  """Returns the best time to parse data with plist_class, None if it fails."""
+  def Parse():
+    plist_class(io.BytesIO(data)).Parse()
+  try:
+    return min(timeit.repeat(Parse, number=1, repeat=repeat))
+  except RuntimeError:
+    return None
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-c", "--counts", default="100000",
+                      help="Comma separated object counts of flat plists.")
+  parser.add_argument("-d", "--depths", default="100,500,100000",
+                      help="Comma separated depths of nested plists.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  options = parser.parse_args()
+  logging.getLogger().setLevel(logging.WARNING)
+
+  plists = [("flat %s" % count, BuildArrayPlist(int(count)))
+            for count in options.counts.split(",")]
+  plists.extend(("nested %s" % depth, BuildNestedPlist(int(depth)))
+                for depth in options.depths.split(","))
+  print("%-16s %14s %14s" % ("plist", "recursive (s)", "iterative (s)"))
+  for name, data in plists:
+    times = [TimeParse(plist_class, data, options.repeat)
+             for plist_class in (binplist.BinaryPlist,
+                                 binplist.IterativeBinaryPlist)]
+    print("%-16s %14s %14s" % ((name,) + tuple(
+        "too deep" if time is None else "%.4f" % time for time in times)))
+
+
+if __name__ == "__main__":
+  main()
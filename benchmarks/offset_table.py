@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the decoding of the offset table.
+
+Compares BinaryPlist._ReadOffsetTable against the former implementation,
+which read and decoded one offset at a time.
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import io
+import struct
+import timeit
+
+from binplist import binplist
+
+
+def BuildOffsetTablePlist(object_count, offset_int_size):
+  """Returns a file-like object with a plist made of just an offset table."""
+  offset_mask = (1 << (8 * offset_int_size)) - 1
+  offsets = b"".join(
+      binascii.unhexlify("%0*x" % (offset_int_size * 2,
+                                   (8 + index) & offset_mask))
+      for index in range(object_count))
+  trailer = struct.pack(">5xBBBQQQ", 1, offset_int_size, 8, object_count, 0, 8)
+  return io.BytesIO(b"bplist00" + offsets + trailer)
+
+
+def LegacyReadOffsetTable(plist):
+  """The per-offset implementation _ReadOffsetTable used to have."""
+  plist.object_offsets = []
+  plist.fd.seek(plist._bplist_start_offset + plist.offtable_offset)
+  for object_index in range(plist.object_count):
+    offset = plist._ReadArbitraryLengthInteger(plist.offset_int_size)
+    plist._LogDebug("Object %d offset = %ld.", object_index, offset)
+    plist.object_offsets.append(offset)
+
+
+def TimeOffsetTable(read_function, fd, repeat):
+  """Returns the best time of read_function over the plist at fd."""
+  fd.seek(0)
+  plist = binplist.BinaryPlist(fd)
+  plist._ReadTrailer()
+  return min(timeit.repeat(lambda: read_function(plist), number=1,
+                           repeat=repeat))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-c", "--counts", default="10000,100000,1000000",
+                      help="Comma separated object counts to benchmark.")
+  parser.add_argument("-s", "--sizes", default="1,2,3,4,8",
+                      help="Comma separated offset sizes to benchmark.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  options = parser.parse_args()
+
+  print("%10s %5s %12s %12s %8s" % ("objects", "size", "legacy (s)", "bulk (s)",
+                                    "speedup"))
+  for object_count in [int(count) for count in options.counts.split(",")]:
+    for offset_int_size in [int(size) for size in options.sizes.split(",")]:
+      fd = BuildOffsetTablePlist(object_count, offset_int_size)
+      legacy = TimeOffsetTable(LegacyReadOffsetTable, fd, options.repeat)
+      bulk = TimeOffsetTable(binplist.BinaryPlist._ReadOffsetTable, fd,
+                             options.repeat)
+      print("%10d %5d %12.4f %12.4f %7.1fx" % (object_count, offset_int_size,
+                                               legacy, bulk, legacy / bulk))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the parsers over the synthetic corpus and reports the results as JSON.
+
+For each profile of benchmarks.corpus and each engine, reports the best parse
+time, the objects parsed per second, the time to render the parsed plist with
+PlistToUnicode and how much the peak resident set size grows while parsing.
+Each measurement runs in its own process, so peak memory isn't inflated by
+previous measurements.
+
+  python -m benchmarks.run -o before.json
+  (apply a change)
+  python -m benchmarks.run -o after.json --compare before.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import json
+import os
+import platform
+import plistlib
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from benchmarks import corpus
+from binplist import binplist
+
+# plistlib.readPlist is gone in python 3
+_ReadXmlPlist = getattr(plistlib, "load", None) or plistlib.readPlist
+
+
+def _ParseWithBinaryPlist(binary_path, unused_xml_path):
+  with open(binary_path, "rb") as file_obj:
+    return binplist.BinaryPlist(file_obj).Parse()
+
+
+def _ParseWithBufferBinaryPlist(binary_path, unused_xml_path):
+  with open(binary_path, "rb") as file_obj:
+    return binplist.BufferBinaryPlist(file_obj.read()).Parse()
+
+
+def _ParseWithCompactBinaryPlist(binary_path, unused_xml_path):
+  with open(binary_path, "rb") as file_obj:
+    return binplist.BinaryPlist(file_obj, compact=True).Parse()
+
+
+def _ParseWithCompactBufferBinaryPlist(binary_path, unused_xml_path):
+  with open(binary_path, "rb") as file_obj:
+    return binplist.BufferBinaryPlist(file_obj.read(), compact=True).Parse()
+
+
+def _ParseWithStreamingBinaryPlist(binary_path, unused_xml_path):
+  # The file is left open for the data streams
+  file_obj = open(binary_path, "rb")
+  return binplist.BinaryPlist(file_obj, data_stream_size=1024).Parse()
+
+
+def _ParseWithReadPlist(binary_path, unused_xml_path):
+  with open(binary_path, "rb") as file_obj:
+    return binplist.readPlist(file_obj)
+
+
+def _ParseWithReadPlistMapped(binary_path, unused_xml_path):
+  return binplist.readPlistMapped(binary_path)
+
+
+def _ParseWithReadPlistMappedDataViews(binary_path, unused_xml_path):
+  return binplist.readPlistMapped(binary_path, data_views=True)
+
+
+def _ParseWithPlistlib(unused_binary_path, xml_path):
+  with open(xml_path, "rb") as file_obj:
+    return _ReadXmlPlist(file_obj)
+
+
+# Engine name to function parsing the binary or the XML plist of a profile
+ENGINES = {
+    "BinaryPlist": _ParseWithBinaryPlist,
+    "BufferBinaryPlist": _ParseWithBufferBinaryPlist,
+    "CompactBinaryPlist": _ParseWithCompactBinaryPlist,
+    "CompactBufferBinaryPlist": _ParseWithCompactBufferBinaryPlist,
+    "StreamingBinaryPlist": _ParseWithStreamingBinaryPlist,
+    "readPlist": _ParseWithReadPlist,
+    "readPlistMapped": _ParseWithReadPlistMapped,
+    "readPlistMappedDataViews": _ParseWithReadPlistMappedDataViews,
+    "plistlib": _ParseWithPlistlib,
+}
+
+
+def _GetRss(field="VmHWM"):
+  """Returns the peak or the current resident set size, in KiB.
+
+  Args:
+    field: VmHWM for the peak resident set size of this process, VmRSS for
+      the current one. Where there's no /proc, the peak is always returned.
+  """
+  # On Linux, ru_maxrss includes the peak of the parent process, which is
+  # inherited on fork, while VmHWM is reset on exec.
+  try:
+    with open("/proc/self/status") as status:
+      for line in status:
+        if line.startswith(field + ":"):
+          return int(line.split()[1])
+  except IOError:
+    pass
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == "darwin":
+    # Reported in bytes rather than KiB
+    peak_rss //= 1024
+  return peak_rss
+
+
+def Measure(engine, binary_path, xml_path, repeat):
+  """Measures an engine on a plist in this process.
+
+  Returns:
+    A dictionary with the measurements.
+  """
+  parse = ENGINES[engine]
+  baseline_rss = _GetRss("VmRSS")
+  top_level_object = parse(binary_path, xml_path)
+  peak_rss = _GetRss()
+  render = functools.partial(binplist.PlistToUnicode, top_level_object)
+  render_time = min(timeit.repeat(render, number=1, repeat=repeat))
+  del render, top_level_object
+  parse_time = min(timeit.repeat(lambda: parse(binary_path, xml_path),
+                                 number=1, repeat=repeat))
+  return {
+      "parse_seconds": parse_time,
+      "render_seconds": render_time,
+      "baseline_rss_kib": baseline_rss,
+      "peak_rss_kib": peak_rss,
+  }
+
+
+def MeasureInSubprocess(engine, binary_path, xml_path, repeat):
+  """Runs Measure in a new process and returns its result."""
+  output = subprocess.check_output([
+      sys.executable, "-m", "benchmarks.run", "--measure", engine,
+      binary_path, xml_path, "--repeat", str(repeat)])
+  return json.loads(output)
+
+
+def CountObjects(binary_path):
+  """Returns the amount of objects in the binary plist at binary_path."""
+  with open(binary_path, "rb") as file_obj:
+    plist = binplist.BinaryPlist(file_obj)
+    plist.Parse()
+    return plist.object_count
+
+
+def _GetCommit():
+  """Returns the git commit of the working copy, if there's one."""
+  try:
+    with open(os.devnull, "w") as devnull:
+      return subprocess.check_output(
+          ["git", "rev-parse", "HEAD"], stderr=devnull,
+          cwd=os.path.dirname(os.path.abspath(__file__)),
+          universal_newlines=True).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def Run(profiles, engines, scale, repeat):
+  """Runs the benchmarks.
+
+  Returns:
+    A dictionary with the environment and a list with the result of each
+    profile and engine.
+  """
+  results = []
+  directory = tempfile.mkdtemp(prefix="binplist-corpus-")
+  try:
+    for profile in profiles:
+      binary_path, xml_path = corpus.WritePlists(profile, directory, scale)
+      object_count = CountObjects(binary_path)
+      for engine in engines:
+        result = {
+            "profile": profile,
+            "parameters": corpus.GetParameters(profile, scale),
+            "engine": engine,
+            "objects": object_count,
+            "binary_bytes": os.path.getsize(binary_path),
+            "xml_bytes": os.path.getsize(xml_path),
+        }
+        result.update(MeasureInSubprocess(engine, binary_path, xml_path,
+                                          repeat))
+        result["objects_per_second"] = object_count / result["parse_seconds"]
+        results.append(result)
+  finally:
+    shutil.rmtree(directory)
+  return {
+      "commit": _GetCommit(),
+      "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "scale": scale,
+      "repeat": repeat,
+      "results": results,
+  }
+
+
+def PrintResults(report, baseline=None):
+  """Prints a summary of a report, compared to a baseline report if given."""
+  baseline_results = {}
+  if baseline:
+    baseline_results = dict(((result["profile"], result["engine"]), result)
+                            for result in baseline["results"])
+  print("%-10s %-24s %9s %10s %10s %10s %9s" % (
+      "profile", "engine", "objects", "parse (s)", "objects/s", "render (s)",
+      "peak MiB"), file=sys.stderr)
+  for result in report["results"]:
+    line = "%-10s %-24s %9d %10.4f %10d %10.4f %9.1f" % (
+        result["profile"], result["engine"], result["objects"],
+        result["parse_seconds"], result["objects_per_second"],
+        result["render_seconds"],
+        (result["peak_rss_kib"] - result["baseline_rss_kib"]) / 1024.0)
+    old_result = baseline_results.get((result["profile"], result["engine"]))
+    if old_result:
+      line += "  parse %.2fx, render %.2fx" % (
+          old_result["parse_seconds"] / result["parse_seconds"],
+          old_result["render_seconds"] / result["render_seconds"])
+    print(line, file=sys.stderr)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-p", "--profiles",
+                      default=",".join(sorted(corpus.PROFILES)),
+                      help="Comma separated corpus profiles to benchmark.")
+  parser.add_argument("-e", "--engines", default=",".join(sorted(ENGINES)),
+                      help="Comma separated engines to benchmark.")
+  parser.add_argument("-s", "--scale", default=1.0, type=float,
+                      help="A factor for the object count of the profiles.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  parser.add_argument("-o", "--output",
+                      help="The file to write the JSON report to. Defaults to "
+                      "stdout.")
+  parser.add_argument("-c", "--compare",
+                      help="A previous JSON report to compare the results to.")
+  parser.add_argument("--measure", nargs=3,
+                      metavar=("ENGINE", "BINARY_PLIST", "XML_PLIST"),
+                      help=argparse.SUPPRESS)
+  options = parser.parse_args()
+
+  if options.measure:
+    json.dump(Measure(*options.measure, repeat=options.repeat), sys.stdout)
+    return
+
+  report = Run(options.profiles.split(","), options.engines.split(","),
+               options.scale, options.repeat)
+  baseline = None
+  if options.compare:
+    with open(options.compare) as file_obj:
+      baseline = json.load(file_obj)
+  PrintResults(report, baseline)
+  if options.output:
+    with open(options.output, "w") as file_obj:
+      json.dump(report, file_obj, indent=2, sort_keys=True)
+  else:
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks writing binary plists against writing XML plists with plistlib.
+
+The plists written are arrays of records with a few repeated values, as found
+in most real world plists.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import plistlib
+import timeit
+
+from binplist import binplist
+
+# plistlib.writePlistToString is gone in python 3
+_WriteXmlPlist = getattr(plistlib, "dumps", None) or plistlib.writePlistToString
+
+
+def BuildRecords(record_count):
+  """Returns a list of record_count dictionaries."""
+  return [{"Name": "record %d" % index,
+           "Index": index,
+           "Enabled": bool(index % 2),
+           "Score": index / 3.0,
+           "Created": datetime.datetime(2013, 1, 1 + index % 28),
+           "Tags": ["tag%d" % (index % 10), "common"]}
+          for index in range(record_count)]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("-c", "--counts", default="1000,10000,100000",
+                      help="Comma separated record counts to benchmark.")
+  parser.add_argument("-r", "--repeat", default=3, type=int,
+                      help="Times each measurement is repeated.")
+  options = parser.parse_args()
+
+  print("%10s %12s %12s %12s %12s %8s" % (
+      "records", "xml (s)", "xml (bytes)", "binary (s)", "binary (bytes)",
+      "speedup"))
+  for record_count in [int(count) for count in options.counts.split(",")]:
+    records = BuildRecords(record_count)
+    xml_time = min(timeit.repeat(lambda: _WriteXmlPlist(records),
+                                 number=1, repeat=options.repeat))
+    binary_time = min(timeit.repeat(
+        lambda: binplist.writePlistToString(records), number=1,
+        repeat=options.repeat))
+    print("%10d %12.4f %12d %12.4f %14d %7.1fx" % (
+        record_count, xml_time, len(_WriteXmlPlist(records)),
+        binary_time, len(binplist.writePlistToString(records)),
+        xml_time / binary_time))
+
+
+if __name__ == "__main__":
+  main()
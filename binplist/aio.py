@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads plists from asyncio streams and other asynchronous sources.
+
+  from binplist import aio
+  top_level_object = await aio.readPlist(reader)
+
+readPlist reads a plist from a stream, such as an asyncio.StreamReader.
+The header is read first, and the rest of the plist with a single read after
+it. Streams can't seek to the trailer, so it's checked once the data is in
+memory, before parsing.
+
+readPlistFromRanges reads a plist from a source with random access, such as
+ranged HTTP requests or object storage. The header and the trailer are fetched
+first, concurrently, so that data that isn't a binary plist is rejected before
+reading the rest of it. The objects and the offset table are then fetched with
+a single read.
+
+Parsing is CPU bound. Plists of offload_size bytes or more are parsed in an
+executor, so long parses never block the event loop.
+
+This module requires python 3.7 or later.
+"""
+
+import asyncio
+import struct
+
+from . import binplist
+
+
+# Plists of this size or bigger are parsed in an executor by default
+OFFLOAD_SIZE = 64 << 10
+
+_HEADER_SIZE = 8
+_TRAILER_STRUCT = struct.Struct(">5xBBBQQQ")
+
+
+async def readPlist(reader, executor=None, offload_size=OFFLOAD_SIZE):
+  """Returns the top level object of the plist read from reader.
+
+  Args:
+    reader: An asyncio.StreamReader, or any object with a read(size)
+      coroutine returning up to size bytes, or all the data up to the end of
+      the stream when size is -1.
+    executor: The concurrent.futures executor to parse big plists in. The
+      default executor of the event loop is used when None.
+    offload_size: Plists of this size or bigger are parsed in the executor.
+      None to always parse them in the event loop.
+
+  Returns:
+    The top level object of the plist.
+
+  Raises:
+    binplist.FormatError: When the data is not a plist, its version is unknown
+    or, for binary plists, its trailer is invalid.
+  """
+  header = b""
+  while len(header) < _HEADER_SIZE:
+    chunk = await reader.read(_HEADER_SIZE - len(header))
+    if not chunk:
+      break
+    header += chunk
+  data = header + await reader.read(-1)
+  trailer_size = _TRAILER_STRUCT.size
+  if header.startswith(b"bplist") and len(data) >= _HEADER_SIZE + trailer_size:
+    _CheckTrailer(data[-trailer_size:], len(data))
+  return await _Parse(data, executor, offload_size)
+
+
+async def readPlistFromRanges(read_range, size, executor=None,
+                              offload_size=OFFLOAD_SIZE):
+  """Returns the top level object of the plist read by ranges.
+
+  Args:
+    read_range: A coroutine function taking an offset and a size, that returns
+      the size bytes at offset.
+    size: The size of the plist.
+    executor: See readPlist.
+    offload_size: See readPlist.
+
+  Returns:
+    The top level object of the plist.
+
+  Raises:
+    binplist.FormatError: When the data is not a plist, its version is unknown
+    or, for binary plists, its trailer is invalid.
+  """
+  trailer_size = _TRAILER_STRUCT.size
+  if size < _HEADER_SIZE + trailer_size:
+    # Too small for a binary plist, but could be an XML one
+    return await _Parse(await read_range(0, size), executor, offload_size)
+
+  header, trailer = await asyncio.gather(
+      read_range(0, _HEADER_SIZE), read_range(size - trailer_size,
+                                                trailer_size))
+  if not header.startswith(b"bplist"):
+    body = await read_range(_HEADER_SIZE, size - _HEADER_SIZE)
+    return await _Parse(header + body, executor, offload_size)
+
+  _CheckTrailer(trailer, size)
+  body = await read_range(_HEADER_SIZE, size - _HEADER_SIZE - trailer_size)
+  return await _Parse(b"".join([header, body, trailer]), executor,
+                      offload_size)
+
+
+def _CheckTrailer(trailer, size):
+  """Rejects trailers the parser would reject, before the body is read.
+
+  Raises:
+    binplist.FormatError: When the offset table doesn't fit in the plist.
+  """
+  (_, offset_int_size, _, object_count, _,
+   offtable_offset) = _TRAILER_STRUCT.unpack(trailer)
+  if offtable_offset >= size:
+    raise binplist.FormatError("Offset table offset past the file end.")
+  data_size = object_count * offset_int_size
+  if data_size == 0:
+    raise binplist.FormatError("Length of offsets table is 0.")
+  if data_size > size - offtable_offset:
+    raise binplist.FormatError(
+        "Length of offsets table larger than the data available in the file "
+        "(%d vs %d)." % (data_size, size))
+
+
+async def _Parse(data, executor, offload_size):
+  """Parses data in the executor if it's big, in the event loop otherwise."""
+  if offload_size is None or len(data) < offload_size:
+    return binplist.readPlistFromString(data)
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(executor, binplist.readPlistFromString,
+                                    data)
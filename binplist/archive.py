@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parses the plists inside zip and tar archives, without extracting them.
+
+  for archived_plist in ReadArchivePlists("backup.tar.gz"):
+    print(archived_plist.name, archived_plist.is_corrupt)
+
+Members are told apart by their first bytes: binary plists start with the
+"bplist" magic, and XML plists have a plist element or doctype near their
+start. Other members are skipped without being read in full. Plists are parsed
+from the member data in memory.
+
+Zip archives need random access, so they must be paths or seekable files. Tar
+archives, compressed or not, can also be read from streams such as pipes.
+
+With jobs, members are parsed by a pool of processes and yielded as they're
+parsed. Only a few members per process are read ahead of the parsing, so
+memory stays bounded however big the archive is.
+"""
+
+import collections
+import logging
+import multiprocessing
+import pickle
+import sys
+import tarfile
+import zipfile
+
+try:
+  import queue
+except ImportError:
+  # Python 2
+  import Queue as queue  # pylint: disable=import-error
+
+from . import binplist
+
+
+# A plist found by ReadArchivePlists. top_level_object is CorruptReference
+# when a member looks like a plist but can't be parsed.
+ArchivedPlist = collections.namedtuple(
+    "ArchivedPlist", ["name", "top_level_object", "is_corrupt"])
+
+BINARY_MAGIC = b"bplist"
+
+# The amount of bytes read to tell plists from other members
+_SNIFF_SIZE = 1024
+# Any of these near the start of a member makes it an XML plist
+_XML_MARKERS = (b"<plist", b"<!DOCTYPE plist")
+_XML_LEADING_BYTES = b"\xef\xbb\xbf \t\r\n"
+
+# Members parsed by the pool, or waiting to be, per process
+_PENDING_PER_JOB = 4
+# Failed pool tasks are also yielded as corrupt, but python 2 pools have no
+# callback for them
+_HAS_ERROR_CALLBACK = sys.version_info[0] >= 3
+
+
+def ReadArchivePlists(pathOrFile, jobs=1, max_member_size=64 << 20):
+  """Yields the plists in a zip or tar archive.
+
+  Args:
+    pathOrFile: A path or a file-like object to the archive. File-like
+      objects are read from their current position.
+    jobs: The amount of processes parsing members. None for one per CPU. With
+      1, members are parsed in this process.
+    max_member_size: Members bigger than this are skipped.
+
+  Yields:
+    An ArchivedPlist for each plist in the archive. With a single job, they
+    are in archive order. Otherwise, they are yielded as they're parsed.
+
+  Raises:
+    tarfile.TarError: When the archive is neither a zip nor a tar archive.
+  """
+  members = _IterPlistMembers(pathOrFile, max_member_size)
+  if jobs == 1:
+    for member in members:
+      yield _ParseMember(member)
+    return
+  for archived_plist in _ParseInPool(members, jobs):
+    yield archived_plist
+
+
+def IsPlist(head):
+  """Returns whether data starting with head looks like a plist.
+
+  Args:
+    head: The first bytes of the data. About a KiB is enough to find the plist
+      element of XML plists.
+  """
+  if head.startswith(BINARY_MAGIC):
+    return True
+  return (head.lstrip(_XML_LEADING_BYTES).startswith(b"<") and
+          any(marker in head for marker in _XML_MARKERS))
+
+
+def _IterPlistMembers(pathOrFile, max_member_size):
+  """Yields the name and the data of the archive members that are plists."""
+  if _IsZipFile(pathOrFile):
+    members = _IterZipMembers(pathOrFile)
+  else:
+    members = _IterTarMembers(pathOrFile)
+  for name, size, member_file in members:
+    if size > max_member_size:
+      logging.warning("Skipping member %s of %d bytes.", name, size)
+      continue
+    head = member_file.read(_SNIFF_SIZE)
+    if IsPlist(head):
+      yield name, head + member_file.read()
+
+
+def _IsZipFile(pathOrFile):
+  """Returns whether pathOrFile is a zip archive, without moving files."""
+  try:
+    pathOrFile.read
+  except AttributeError:
+    # Must be a path then
+    return zipfile.is_zipfile(pathOrFile)
+  try:
+    position = pathOrFile.tell()
+  except (AttributeError, IOError, OSError):
+    # Streams can't be zip archives, which have their directory at the end
+    return False
+  try:
+    return zipfile.is_zipfile(pathOrFile)
+  finally:
+    pathOrFile.seek(position)
+
+
+def _IterZipMembers(pathOrFile):
+  """Yields the name, the size and a file object of each zip archive file."""
+  with zipfile.ZipFile(pathOrFile) as zip_file:
+    for info in zip_file.infolist():
+      if info.filename.endswith("/"):
+        # A directory
+        continue
+      member_file = zip_file.open(info)
+      try:
+        yield info.filename, info.file_size, member_file
+      finally:
+        member_file.close()
+
+
+def _IterTarMembers(pathOrFile):
+  """Yields the name, the size and a file object of each tar archive file."""
+  try:
+    pathOrFile.read
+  except AttributeError:
+    tar_file = tarfile.open(pathOrFile, "r:*")
+  else:
+    # Stream mode reads members in order, which works with any file object
+    tar_file = tarfile.open(fileobj=pathOrFile, mode="r|*")
+  with tar_file:
+    for info in tar_file:
+      if info.isfile():
+        yield info.name, info.size, tar_file.extractfile(info)
+
+
+def _ParseMember(member):
+  """Parses the data of an archive member.
+
+  Args:
+    member: A tuple with the name and the data of the member.
+
+  Returns:
+    An ArchivedPlist.
+  """
+  name, data = member
+  try:
+    if data.startswith(BINARY_MAGIC):
+      plist = binplist.IterativeBufferBinaryPlist(data)
+      return ArchivedPlist(name, plist.Parse(), plist.is_corrupt)
+    return ArchivedPlist(name, binplist.readPlistFromString(data), False)
+  except Exception:  # pylint: disable=broad-except
+    # Not a plist after all, or too corrupt to be parsed. Raising in a pool
+    # process would lose the other members.
+    return _Unparsed(name)
+
+
+def _ParseMemberToPickle(member):
+  """Parses the data of an archive member and pickles the ArchivedPlist.
+
+  Pool processes die when they can't send a result back, such as a plist
+  nested too deep to be pickled, and the member is lost. Pickling it here lets
+  it be marked as corrupt instead.
+  """
+  archived_plist = _ParseMember(member)
+  try:
+    return pickle.dumps(archived_plist, pickle.HIGHEST_PROTOCOL)
+  except Exception:  # pylint: disable=broad-except
+    return pickle.dumps(_Unparsed(member[0]), pickle.HIGHEST_PROTOCOL)
+
+
+def _Unparsed(name):
+  """Returns the ArchivedPlist of a member that couldn't be parsed."""
+  return ArchivedPlist(name, binplist.CorruptReference, True)
+
+
+def _ParseInPool(members, jobs):
+  """Yields the members parsed by a pool of processes, as they're parsed.
+
+  Members whose parsed plist can't be sent back from the pool, such as ones
+  nested too deep to be pickled, are yielded as corrupt.
+  """
+  pool = multiprocessing.Pool(jobs)
+  parsed = queue.Queue()
+  put_pickled = lambda data: parsed.put(pickle.loads(data))
+  max_pending = _PENDING_PER_JOB * (jobs or multiprocessing.cpu_count())
+  pending = 0
+  try:
+    for member in members:
+      if pending >= max_pending:
+        yield parsed.get()
+        pending -= 1
+      callbacks = {"callback": put_pickled}
+      if _HAS_ERROR_CALLBACK:
+        callbacks["error_callback"] = (
+            lambda _, name=member[0]: parsed.put(_Unparsed(name)))
+      pool.apply_async(_ParseMemberToPickle, (member,), **callbacks)
+      pending += 1
+    while pending:
+      yield parsed.get()
+      pending -= 1
+  finally:
+    pool.terminate()
@@ -50,23 +50,123 @@ value. BinaryPlist.objects will contain 3 entries as well, one for each object.
 You have a mapping of object index to offset at BinaryPlist.object_offsets.
 And the top_level_element index is available ad BinaryPlist.top_level_index.
 
+Parsing from memory
+
+If the plist is already in memory or can be memory mapped, BufferBinaryPlist
+parses it straight from the buffer, which is much faster than going through a
+file object. readPlistFromString(data) and readPlistMapped(pathOrFile) are the
+readPlist counterparts that use it.
+
+Buffer parsers created with data_views=True return data objects as DataView
+objects, which reference the buffer instead of copying their contents out of
+it. readPlistMapped(pathOrFile, data_views=True) keeps the file mapped for as
+long as they're used, so big embedded blobs are only read when accessed.
+
+Big data objects
+
+File parsers created with data_stream_size=N return data objects of N bytes or
+more as DataStream objects, file-like objects that read their contents from
+the plist file on demand. Their size and offset are known without reading
+them, and they can be hashed or copied in chunks with constant memory.
+
+Deeply nested plists
+
+BinaryPlist parses nested containers recursively and may exceed python's
+recursion limit with deeply nested plists. IterativeBinaryPlist (and
+IterativeBufferBinaryPlist) produce the same results without recursion.
+
+Lazy parsing
+
+LazyBinaryPlist (and LazyBufferBinaryPlist) only parse objects when they're
+accessed. Arrays and dictionaries are returned as LazyList and LazyDict
+proxies, which can be fully parsed on request with their Materialize() method.
+
+To pull a few values out of a plist, query(pathOrFile, "root.Items[3].Name")
+only parses the objects along the given path.
+
+Writing
+
+writePlist(rootObject, pathOrFile) and writePlistToString(rootObject) write
+binary plists. Equal objects are only written once. See BinaryPlistWriter.
+
+WritePlistToJson(o, file_obj) and WritePlistToNdjson(o, file_obj) stream a
+parsed plist as JSON. See IterPlistToJson for how objects are represented.
+
+Memory usage
+
+Pass compact=True to a parser to keep BinaryPlist.objects as a list with an
+item for each object instead of a dictionary, which takes a fraction of the
+memory for plists with millions of objects. Objects not parsed (yet) are
+NotParsed in that list. Once Parse() returns, DropObjects() releases the
+objects the parser holds, so only those the caller keeps stay in memory.
+
+When parsing many similar plists, pass the same InternPool to all the parsers
+so that equal dictionary keys, and optionally short string values, are shared
+among all the parsed plists instead of allocated again for each of them.
+
+Statistics
+
+Pass a ParseStats object to a parser to find out where the parsing time goes:
+the time spent in each parsing phase, the objects decoded by type, cache hits
+and the reads and seeks on the file object.
+
+Resource budgets
+
+Pass a ParseBudget to a parser to bound the objects, bytes, nesting and time a
+single parse may take. Objects over budget are replaced by CorruptReference, so
+hostile plists produce partial results instead of stalling the parser.
+
+Python 3
+
+The same code runs on python 2.7 and python 3. On python 3, ASCII string
+objects are parsed as str, just as UTF-16 ones, and data objects as bytes,
+which is what plistlib returns too. String objects that aren't ASCII, which
+only corrupt plists have, are returned as bytes. The writer writes bytes as
+data objects and str as strings.
+
 Happy bplisting!
 """
 
 from . import __version__
 from . import __feedback_email__
 
+import array
+import base64
+import binascii
+import codecs
+import contextlib
 import datetime
+import io
+import itertools
+import json
 import logging
 import math
+import mmap
 import os
 import plistlib
+import re
 import string
 import struct
+import sys
+import time
 import xml.parsers.expat
 
 import pytz
 
+try:
+  from collections import abc as collections_abc
+except ImportError:
+  # Python 2
+  import collections as collections_abc
+
+if sys.version_info[0] >= 3:
+  _PY3 = True
+  # The python 2 names the module is written against
+  unicode = str  # pylint: disable=redefined-builtin,invalid-name
+  long = int  # pylint: disable=redefined-builtin,invalid-name
+else:
+  _PY3 = False
+
 
 LOG_ULTRA_VERBOSE = -10
 
@@ -78,9 +178,15 @@ class NullValue(object):
 class RawValue(object):
   """Used when objects are corrupt and no sensible value can be extracted."""
 
+  __slots__ = ("value",)
+
   def __init__(self, value):
     self.value = value
 
+  def __reduce__(self):
+    # Objects with __slots__ can't be pickled with protocols 0 and 1 otherwise
+    return RawValue, (self.value,)
+
   def __str__(self):
     return self.value
 
@@ -91,17 +197,164 @@ class RawValue(object):
     return self.value == other
 
   def __unicode__(self):
-    return u"'%s'" % ''.join([u"\\x%s" % c.encode('hex') for c in self.value])
+    return u"'%s'" % _HexEscape(self.value)
+
+  if _PY3:
+    __bytes__ = __str__
+    __str__ = __unicode__
+
+
+class Uid(int):
+  """A UID object, as found in keyed archives.
+
+  It behaves as the integer it holds, but it's written back as a UID by
+  writePlist.
+  """
+
+  __slots__ = ()
 
 
 class CorruptReference(object):
   """Marks references to objects that are corrupt."""
 
 
+# The key of dictionary entries whose key reference is cut short by the end of
+# the data, instead of "corrupt:<reference>"
+_TRUNCATED_KEY = "corrupt:truncated"
+
+
 class UnknownObject(object):
   """Marks objects that we don't know how to parse."""
 
 
+class DataView(object):
+  """A data object that references the buffer it was parsed from.
+
+  Buffer parsers return data objects as DataView when asked to, so that their
+  contents aren't copied. ToBytes() copies them out of the buffer, while
+  MemoryView() gives access to them without copying, e.g. to hash them or to
+  write them to a file. DataView objects compare and hash as their contents.
+
+  Attributes:
+    data: The buffer, a string, memoryview or mmap object.
+    offset: The offset of the contents in data.
+    length: The length of the contents.
+  """
+
+  __slots__ = ("data", "offset", "length")
+
+  def __init__(self, data, offset, length):
+    self.data = data
+    self.offset = offset
+    self.length = length
+
+  def ToBytes(self):
+    """Returns a copy of the contents."""
+    return _Bytes(self.data[self.offset:self.offset + self.length])
+
+  def MemoryView(self):
+    """Returns a memoryview of the contents, without copying them."""
+    try:
+      view = memoryview(self.data)
+    except TypeError:
+      # mmap objects only have the old buffer interface in python 2
+      return memoryview(buffer(  # pylint: disable=undefined-variable
+          self.data, self.offset, self.length))
+    return view[self.offset:self.offset + self.length]
+
+  def __len__(self):
+    return self.length
+
+  def __bytes__(self):
+    return self.ToBytes()
+
+  if not _PY3:
+    __str__ = __bytes__
+
+  def __eq__(self, other):
+    if isinstance(other, DataView):
+      other = other.ToBytes()
+    return self.ToBytes() == other
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self.ToBytes())
+
+  def __repr__(self):
+    return "<DataView of %d bytes at offset %d>" % (self.length, self.offset)
+
+  def __reduce__(self):
+    # Buffers such as mmap objects can't be pickled, the contents are
+    return DataView, (self.ToBytes(), 0, self.length)
+
+
+class DataStream(object):
+  """A data object read on demand from the file it was parsed from.
+
+  File parsers return big data objects as DataStream when asked to, so that
+  their contents aren't read along with the plist. It's a read-only file-like
+  object over the contents, which reads them from the plist file object with
+  each read(). The file object must stay open while it's in use.
+
+  The same DataStream is returned for all the references to a data object, so
+  seek(0) before reading it in full if it may have been read already.
+
+  Attributes:
+    file_obj: The file object the plist was parsed from.
+    offset: The offset of the contents in file_obj.
+    length: The length of the contents.
+  """
+
+  def __init__(self, file_obj, offset, length):
+    self.file_obj = file_obj
+    self.offset = offset
+    self.length = length
+    self._position = 0
+
+  def read(self, size=-1):
+    """Reads up to size bytes, or up to the end of the contents if negative."""
+    remaining = self.length - self._position
+    if size is None or size < 0 or size > remaining:
+      size = remaining
+    if size <= 0:
+      return b""
+    self.file_obj.seek(self.offset + self._position)
+    data = self.file_obj.read(size)
+    self._position += len(data)
+    return data
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self._position
+    elif whence == os.SEEK_END:
+      offset += self.length
+    elif whence != os.SEEK_SET:
+      raise IOError("Invalid whence (%r)." % whence)
+    if offset < 0:
+      raise IOError("Negative seek position %d." % offset)
+    self._position = offset
+
+  def tell(self):
+    return self._position
+
+  def ToBytes(self):
+    """Returns the whole contents, without moving the current position."""
+    self.file_obj.seek(self.offset)
+    return self.file_obj.read(self.length)
+
+  def __len__(self):
+    return self.length
+
+  def __repr__(self):
+    return "<DataStream of %d bytes at offset %d>" % (self.length, self.offset)
+
+
+class NotParsed(object):
+  """Marks objects not parsed yet in BinaryPlist.objects, in compact mode."""
+
+
 class Error(Exception):
   """Base exception."""
 
@@ -124,7 +377,7 @@ class BinaryPlist(object):
       0x2: ("REAL", "_ParseReal"),
       0x3: ("DATE", "_ParseDate"),
       0x4: ("DATA", "_ParseData"),
-      0x5: ("STRING", "_ParseString"),
+      0x5: ("STRING", "_ParseAsciiString"),
       0x6: ("UTF16", "_ParseUtf16"),
       0x8: ("UID", "_ParseUid"),
       0xA: ("ARRAY", "_ParseArray"),
@@ -145,7 +398,8 @@ class BinaryPlist(object):
   debug_object_preview_length = 48
 
   def __init__(self, file_obj=None, discovery_mode=False,
-               ultra_verbosity=False):
+               ultra_verbosity=False, stats=None, compact=False,
+               intern_pool=None, budget=None, data_stream_size=None):
     """Constructor.
 
     Args:
@@ -153,9 +407,33 @@ class BinaryPlist(object):
       discovery_mode: When activated, it will inform the user when one of the
       uncommon objects has been found. It's expected to be used while we finish
       validating the parser against real binary plists. Disabled by default.
+      stats: A ParseStats object to collect parsing statistics into. Disabled
+      by default.
+      compact: When activated, BinaryPlist.objects is a list with an item for
+      each object, NotParsed for those not parsed yet, instead of a
+      dictionary. It takes much less memory with big plists. Looking up an
+      object not parsed yet raises KeyError in both cases. Disabled by
+      default.
+      intern_pool: An InternPool to share dictionary keys and strings with
+      other parsers. Disabled by default.
+      budget: A ParseBudget limiting the resources parsing may consume.
+      Disabled by default.
+      data_stream_size: Data objects of this size or bigger are returned as
+      DataStream objects instead of strings. Not supported by buffer parsers,
+      see BufferBinaryPlist's data_views instead. Disabled by default.
     """
     self.discovery_mode = discovery_mode
+    self.data_stream_size = data_stream_size
     self.ultra_verbosity = ultra_verbosity
+    self.stats = stats
+    self.compact = compact
+    self.intern_pool = intern_pool
+    self.budget = budget
+    if budget is not None:
+      budget.Attach(self)
+    if stats is not None:
+      stats.Attach(self)
+    self._UpdateLogLevels()
     self._Initialize()
     self.fd = None
     if file_obj:
@@ -170,7 +448,7 @@ class BinaryPlist(object):
     self.objects = {}
     self.is_corrupt = False
     # Header attributes
-    self.version = ""
+    self.version = b""
     # Trailer attributes
     self.sort_version = 0
     self.offset_int_size = 0
@@ -201,18 +479,35 @@ class BinaryPlist(object):
   def Parse(self):
     """Parses the file descriptor at file_obj."""
     self._Initialize()
-    if not self.fd:
+    self._UpdateLogLevels()
+    if not self._HasData():
       raise IOError("No data available to parse. Did you call Open() ?")
     # Each of these functions will raise if an unrecoverable error is found
     self._ReadHeader()
     self._ReadTrailer()
     self._ReadOffsetTable()
+    self._AllocateObjects()
     self._ParseObjects()
     return self._ParseObjectByIndex(self.top_level_index, self.object_offsets)
 
+  def DropObjects(self):
+    """Releases the parsed objects and the offset table.
+
+    Objects returned by Parse() are not affected, but the parser no longer
+    keeps them alive. BinaryPlist.objects is empty and top_level_object is None
+    until the plist is parsed again.
+    """
+    self.objects = {}
+    self.object_offsets = []
+    self.top_level_index = None
+
   def Close(self):
     self.fd = None
 
+  def _HasData(self):
+    """Returns whether there's something to parse."""
+    return bool(self.fd)
+
   def _ReadHeader(self):
     """Parses the bplist header.
 
@@ -232,11 +527,11 @@ class BinaryPlist(object):
       raise FormatError("Wrong header length (got %d, expected %ld)." %
                         (len(data), header_struct.size))
     magic, self.version = header_struct.unpack(data)
-    if magic != "bplist":
-      raise FormatError("Wrong magic '%s', expecting 'bplist'." % magic)
-    self._LogDebug("MAGIC = %s", magic)
-    self._LogDebug("VERSION = %s", self.version)
-    if self.version[0] != "0":
+    if magic != b"bplist":
+      raise FormatError("Wrong magic %r, expecting 'bplist'." % magic)
+    self._LogDebug("MAGIC = %r", magic)
+    self._LogDebug("VERSION = %r", self.version)
+    if self.version[:1] != b"0":
       self._LogWarn("Unknown version. Proceeding anyway...")
 
   def _ReadTrailer(self):
@@ -307,38 +602,62 @@ class BinaryPlist(object):
                         "in the file (%d vs %ld)." %
                         (data_size, self._file_size))
 
-    for object_index in range(self.object_count):
-      # We can have offsets of sizes 1 to 8 bytes so we can't just use struct
-      offset = self._ReadArbitraryLengthInteger(self.offset_int_size)
-      self._LogDebug("Object %d offset = %ld.", object_index, offset)
-      self.object_offsets.append(offset)
+    self._DecodeOffsetTable(self.fd.read(data_size))
+
+  def _DecodeOffsetTable(self, data):
+    """Decodes the offset table data into self.object_offsets.
+
+    The whole table is decoded in bulk into an array of integers.
+
+    Args:
+      data: The offset table contents.
+    """
+    offsets = _UnpackIntegers(data, self.offset_int_size)
+    if len(offsets) < self.object_count:
+      # We got less data than declared. As with short reads of single
+      # offsets, the last offset is made of whatever bytes are left and the
+      # missing ones are 0.
+      offsets.append(_BigEndianToInteger(
+          data[len(offsets) * self.offset_int_size:]))
+      offsets.extend([0] * (self.object_count - len(offsets)))
+    self._LogDebug("Read %d object offsets.", len(offsets))
+    self.object_offsets = offsets
+
+  def _AllocateObjects(self):
+    """Preallocates BinaryPlist.objects in compact mode."""
+    if self.compact:
+      self.objects = _CompactObjectCache(self.object_count)
+
+  def _ReadAtMost(self, size):
+    """Reads up to size bytes from self.fd, stopping at the end of the plist.
+
+    Corrupt lengths can be bigger than what a single read() accepts, so reads
+    of declared lengths are cut short here, as buffer slices are.
+    """
+    end = self._bplist_start_offset + self._file_size
+    return self.fd.read(max(0, min(size, end - self.fd.tell())))
 
   def _ReadArbitraryLengthInteger(self, length=0, endianness=BIG_ENDIAN):
     """Returns an integer from self.fd of the given length and endianness."""
-    self._LogUltraVerbose("read arbitrary length integer length %d", length)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("read arbitrary length integer length %d", length)
     data = self.fd.read(length)
     if len(data) < length:
       length = len(data)
-      self._LogUltraVerbose("Not enough data, reading %d instead.", length)
-    integer = 0
+      if self._log_ultra_verbose:
+        self._LogUltraVerbose("Not enough data, reading %d instead.", length)
     if endianness is BIG_ENDIAN:
-      for data_index in range(0, length, 1):
-        integer <<= 8
-        integer |= ord(data[data_index])
+      return _BigEndianToInteger(data)
     elif endianness is LITTLE_ENDIAN:
-      for data_index in range(length-1, -1, -1):
-        integer <<= 8
-        integer |= ord(data[data_index])
-    else:
-      raise ValueError("Unknown endianness requested: %d" % endianness)
-    return integer
+      return _BigEndianToInteger(data[::-1])
+    raise ValueError("Unknown endianness requested: %d" % endianness)
 
   def _ParseObjects(self):
     """Parses the objects at file offsets contained in object_offsets."""
-    self.objects = {}
     for object_index, offset in enumerate(self.object_offsets):
-      self._LogDebug(">>> PARSING OBJECT %d AT OFFSET %ld",
-                    object_index, offset)
+      if self._log_debug:
+        self._LogDebug(">>> PARSING OBJECT %d AT OFFSET %ld",
+                       object_index, offset)
       self._ParseObjectByIndex(object_index, self.object_offsets)
 
   def _ParseObjectByIndex(self, index, offset_list):
@@ -362,28 +681,36 @@ class BinaryPlist(object):
     # Add the object to the list of traversed objects
     self.objects_traversed.add(index)
     offset = offset_list[index]
-    self._LogDebug("Parsing object at index %d", index)
+    if self._log_debug:
+      self._LogDebug("Parsing object at index %d", index)
     try:
       obj = self.objects[index]
-      self._LogDebug("Skipping: Object had already been parsed.")
+      if self._log_debug:
+        self._LogDebug("Skipping: Object had already been parsed.")
     except KeyError:
       if offset > self._file_size:
         # This only happens when the offset in the offset table is wrong
         obj = CorruptReference
       else:
-        self.fd.seek(self._bplist_start_offset + offset)
-        obj = self._ParseObject()
+        obj = self._ParseObjectAt(offset)
         self.objects[index] = obj
     finally:
       # Remove the index from the list of traversed objects
       self.objects_traversed.remove(index)
-    output_string = ToDebugString(obj)
-    fmt = "Object %d = %s"
-    if len(output_string) > self.debug_object_preview_length:
-      fmt = "Object %%d ~= %%.%ds ..." % self.debug_object_preview_length
-    self._LogUltraVerbose(fmt, index, output_string)
+    if self._log_ultra_verbose:
+      # Only stringify the object when it's going to be logged
+      output_string = ToDebugString(obj)
+      fmt = "Object %d = %s"
+      if len(output_string) > self.debug_object_preview_length:
+        fmt = "Object %%d ~= %%.%ds ..." % self.debug_object_preview_length
+      self._LogUltraVerbose(fmt, index, output_string)
     return obj
 
+  def _ParseObjectAt(self, offset):
+    """Parses the object at the given offset from the start of the bplist."""
+    self.fd.seek(self._bplist_start_offset + offset)
+    return self._ParseObject()
+
   def _ParseObject(self):
     """Parses the binary plist object available in self.fd.
 
@@ -398,19 +725,23 @@ class BinaryPlist(object):
       IOError: When there's not enough data in self.fd to read a new object.
     """
 
-    self._LogUltraVerbose("At offset %d", self.fd.tell())
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("At offset %d", self.fd.tell())
     marker_string = self.fd.read(1)
     if len(marker_string) < 1:
       raise IOError("Not enough data available to read a new object.")
-    marker = ord(marker_string[0])
-    self._LogUltraVerbose(">> MARKER: 0x%02lx", marker)
+    marker = ord(marker_string)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose(">> MARKER: 0x%02lx", marker)
     marker_lo = (marker & 0x0F)
     marker_hi = (marker & 0xF0) >> 4
-    self._LogUltraVerbose(">> MARKER HI: %lx", marker_hi)
-    self._LogUltraVerbose(">> MARKER LO: %lx", marker_lo)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose(">> MARKER HI: %lx", marker_hi)
+      self._LogUltraVerbose(">> MARKER LO: %lx", marker_lo)
     try:
       (marker_name, parsing_function_name) = self.KNOWN_MARKERS[marker_hi]
-      self._LogDebug("DATA TYPE: %s", marker_name)
+      if self._log_debug:
+        self._LogDebug("DATA TYPE: %s", marker_name)
       return getattr(self, parsing_function_name)(marker_lo)
     except KeyError:
       self._LogWarn("UNKNOWN MARKER %lx", marker)
@@ -444,24 +775,27 @@ class BinaryPlist(object):
       The integer value or RawValue when it's corrupt.
     """
     int_bytes = 1 << marker_lo
-    self._LogUltraVerbose("Integer size %d", int_bytes)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("Integer size %d", int_bytes)
     # SANITY CHECK: The only allowed integer lengths by OSX seem to be 1, 2, 4,
     # 8 or 16 bytes.
     # XXX: Revisit this and decide if we should instead accept any length.
     if marker_lo not in [0, 1, 2, 3, 4]:
       self._LogWarn("Non-standard integer length (%d).", marker_lo)
-      data = self.fd.read(int_bytes)
+      data = self._ReadAtMost(int_bytes)
       return RawValue(data)
 
-    if int_bytes == 8 and self.version == "00":
+    if int_bytes == 8 and self.version == b"00":
       # 8-byte integers in version 00 are always signed
-      self._LogUltraVerbose("Signed integer")
+      if self._log_ultra_verbose:
+        self._LogUltraVerbose("Signed integer")
       int_struct = struct.Struct(">q")
     elif int_bytes == 16:
-      if self.version == "00":
+      if self.version == b"00":
         # 16-bytes signed integer
-        self._LogUltraVerbose("Signed integer")
-        int_struct = struct.Struct(">qq")
+        if self._log_ultra_verbose:
+          self._LogUltraVerbose("Signed integer")
+        int_struct = struct.Struct(">qQ")
       else:
         # 16-bytes unsigned integer? That's what the documentation seems to hint
         # Sadly, I haven't been able to reproduce this yet as neither plutil nor
@@ -470,8 +804,9 @@ class BinaryPlist(object):
         int_struct = struct.Struct(">QQ")
       data = self.fd.read(int_struct.size)
       (high, low) = int_struct.unpack(data)
-      self._LogUltraVerbose("High 8byte: %lx", high)
-      self._LogUltraVerbose("Low 8byte: %lx", low)
+      if self._log_ultra_verbose:
+        self._LogUltraVerbose("High 8byte: %lx", high)
+        self._LogUltraVerbose("Low 8byte: %lx", low)
       return (high << 64) | low
     else:
       # All other sizes are unsigned
@@ -479,7 +814,8 @@ class BinaryPlist(object):
     data = self.fd.read(int_struct.size)
     if len(data) < int_struct.size:
       return RawValue(data)
-    self._LogUltraVerbose("Raw integer: %r", data)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("Raw integer: %r", data)
     (value,) = int_struct.unpack(data)
     return value
 
@@ -495,12 +831,13 @@ class BinaryPlist(object):
     Returns:
       A float or double object representing the object.
     """
-    self._LogUltraVerbose("Real size %d", marker_lo)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("Real size %d", marker_lo)
     # SANITY CHECK: Real size must be 4 or 8 bytes on disk
     if marker_lo not in [2, 3]:
       real_length = 1 << marker_lo
       self._LogWarn("Non-standard real number length (%d).", real_length)
-      data = self.fd.read(real_length)
+      data = self._ReadAtMost(real_length)
       return RawValue(data)
 
     if marker_lo == 2:
@@ -542,9 +879,11 @@ class BinaryPlist(object):
     data = self.fd.read(date_struct.size)
     if len(data) < date_struct.size:
       return RawValue(data)
-    self._LogUltraVerbose("Raw date: %r.", data)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("Raw date: %r.", data)
     (float_date,) = date_struct.unpack(data)
-    self._LogUltraVerbose("Date decoded as: %s.", float_date)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("Date decoded as: %s.", float_date)
     fraction, integer = math.modf(float_date)
     try:
       date_offset = datetime.timedelta(seconds=int(integer),
@@ -556,16 +895,25 @@ class BinaryPlist(object):
   def _ParseData(self, marker_lo):
     """Parses a data object.
 
-    Data objects are stored as plain byte dumps. As in python 2.7 there's no
-    distinction between bytes and strings, the same function is used.
+    Data objects are stored as plain byte dumps, just as strings.
 
     Args:
       marker_lo: The lower nibble of the marker.
 
     Returns:
-      A byte string containing the data.
+      A byte string containing the data, or a DataStream if it's at least
+      data_stream_size bytes long.
     """
-    return self._ParseString(marker_lo)
+    if self.data_stream_size is None:
+      return self._ParseString(marker_lo)
+    length = self._GetSizedIntFromFd(marker_lo)
+    if length < self.data_stream_size:
+      return self._ReadAtMost(length)
+    offset = self.fd.tell()
+    # As when reading them, data objects are cut short at the end of the file
+    end = self._bplist_start_offset + self._file_size
+    length = max(0, min(length, end - offset))
+    return DataStream(self.fd, offset, length)
 
   def _ParseString(self, marker_lo, char_size=1):
     """Parses a binary object stored like a string/unicode/data object.
@@ -588,8 +936,24 @@ class BinaryPlist(object):
       A byte string with the data contained in the object.
     """
     strlen = self._GetSizedIntFromFd(marker_lo)
-    self._LogUltraVerbose("String of size %d", strlen)
-    return self.fd.read(strlen*char_size)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("String of size %d", strlen)
+    return self._ReadAtMost(strlen*char_size)
+
+  def _ParseAsciiString(self, marker_lo):
+    """Parses an ASCII string object.
+
+    Args:
+      marker_lo: The lower nibble of the marker.
+
+    Returns:
+      A string. On python 3, bytes if it's not ASCII.
+    """
+    return _DecodeAscii(self._ParseString(marker_lo))
+
+  if not _PY3:
+    # Python 2 strings are bytes already
+    _ParseAsciiString = _ParseString
 
   def _ReadStructFromFd(self, file_obj, structure):
     """Reads the given structure from file_obj and returns the unpacked data.
@@ -638,7 +1002,8 @@ class BinaryPlist(object):
     """
 
     if marker_lo == 0xF:
-      self._LogUltraVerbose("marker_lo is 0xF, fetching real size")
+      if self._log_ultra_verbose:
+        self._LogUltraVerbose("marker_lo is 0xF, fetching real size")
       # First comes the byte count
       size_len_struct = struct.Struct(">B")
       (size,) = self._ReadStructFromFd(self.fd, size_len_struct)
@@ -655,7 +1020,8 @@ class BinaryPlist(object):
       strlen_struct = struct.Struct(">%c" % struct_char)
       (strlen,) = self._ReadStructFromFd(self.fd, strlen_struct)
       return strlen
-    self._LogUltraVerbose("Found size %s", marker_lo)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("Found size %s", marker_lo)
     return marker_lo
 
   def _ParseUtf16(self, marker_lo):
@@ -674,7 +1040,8 @@ class BinaryPlist(object):
       returned will not have a unicode string but raw bytes.
     """
     utf16 = self._ParseString(marker_lo, char_size=2)
-    self._LogUltraVerbose("RAW UTF16 = %s...", utf16[:min(len(utf16), 10)])
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("RAW UTF16 = %s...", utf16[:min(len(utf16), 10)])
     try:
       return utf16.decode("utf-16-be")
     except UnicodeDecodeError:
@@ -695,7 +1062,8 @@ class BinaryPlist(object):
       marker_lo: The lower nibble of the marker.
 
     Returns:
-      An integer representing the UID.
+      A Uid with the value of the UID, or a plain integer if it doesn't fit in
+      a Uid.
 
     See:
       http://developer.apple.com/library/mac/#documentation/
@@ -707,7 +1075,7 @@ class BinaryPlist(object):
     if uid_size not in [1, 2, 4, 8]:
       self._LogWarn("Uncommon UID size %d (expected 1, 2, 4 or 8)", uid_size)
     self._LogDiscovery("FOUND A UID!")
-    return self._ReadArbitraryLengthInteger(uid_size)
+    return _MakeUid(self._ReadArbitraryLengthInteger(uid_size))
 
   def _ParseArray(self, marker_lo):
     """Parses an array object.
@@ -727,10 +1095,33 @@ class BinaryPlist(object):
     Returns:
       A list of objects.
     """
-    array = []
     arraylen = self._GetSizedIntFromFd(marker_lo)
     references = self._GetObjectReferences(arraylen)
-    self._LogUltraVerbose(references)
+    return self._ResolveArray(references)
+
+  def _ResolveArray(self, references):
+    """Resolves the object references of an array.
+
+    Args:
+      references: A list of object references, as returned by
+      _GetObjectReferences.
+
+    Returns:
+      A list of objects.
+    """
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose(references)
+    if self._AreValidReferences(references):
+      # Fast path for the common case with no circular or invalid references
+      offsets = self.object_offsets
+      array = [self._ParseObjectByIndex(reference, offsets)
+               for reference in references]
+      if self._log_ultra_verbose:
+        self._LogUltraVerbose(array)
+      if self.intern_pool is not None:
+        self.intern_pool.InternList(array)
+      return array
+    array = []
     for reference in references:
       # We need to avoid circular references...
       if reference is CorruptReference:
@@ -747,7 +1138,10 @@ class BinaryPlist(object):
         array.append(CorruptReference)
         continue
       array.append(self._ParseObjectByIndex(reference, self.object_offsets))
-    self._LogUltraVerbose(array)
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose(array)
+    if self.intern_pool is not None:
+      self.intern_pool.InternList(array)
     return array
 
   def _GetObjectReferences(self, length):
@@ -760,20 +1154,51 @@ class BinaryPlist(object):
       length: The amount of object references.
 
     Returns:
-      A list of references.
+      A list of references. See _UnpackObjectReferences.
+    """
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose("object_ref_size is %d", self.object_ref_size)
+    data = self.fd.read(length * self.object_ref_size)
+    return self._UnpackObjectReferences(data, length)
+
+  def _UnpackObjectReferences(self, data, length):
+    """Decodes a list of object references in bulk.
+
+    Args:
+      data: A string with the object references.
+      length: The amount of object references.
+
+    Returns:
+      A list of references. If data is too short, the references that don't
+      fit in it are returned as CorruptReference, always at the end of the
+      list.
     """
-    references = []
-    self._LogUltraVerbose("object_ref_size is %d", self.object_ref_size)
     struct_char = self.bytesize_to_uchar[self.object_ref_size]
-    objref_struct = struct.Struct(">%c" % struct_char)
-    for _ in range(length):
-      try:
-        (ref,) = self._ReadStructFromFd(self.fd, objref_struct)
-      except IOError:
-        ref = CorruptReference
-      references.append(ref)
+    count = min(length, len(data) // self.object_ref_size)
+    references = list(struct.unpack(
+        ">%d%c" % (count, struct_char), data[:count * self.object_ref_size]))
+    if count < length:
+      references.extend([CorruptReference] * (length - count))
     return references
 
+  def _AreValidReferences(self, references):
+    """Checks a list of object references all at once.
+
+    Args:
+      references: A list of object references, as returned by
+      _UnpackObjectReferences.
+
+    Returns:
+      True if none of the references is corrupt, circular or out of bounds.
+      In that case, references can be resolved without further checks.
+    """
+    if not references:
+      return True
+    if references[-1] is CorruptReference:
+      return False
+    return (max(references) < self.object_count and
+            self.objects_traversed.isdisjoint(references))
+
   def _ParseSet(self, marker_lo):
     """Parses a set object.
 
@@ -806,22 +1231,55 @@ class BinaryPlist(object):
     Returns:
       A dictionary representing the stored dictionary object at self.fd.
     """
-    the_dict = {}
     dictlen = self._GetSizedIntFromFd(marker_lo)
-    self._LogDebug("Fetching key references.")
+    if self._log_debug:
+      self._LogDebug("Fetching key references.")
     keys = self._GetObjectReferences(dictlen)
-    self._LogDebug("Fetching value references.")
+    if self._log_debug:
+      self._LogDebug("Fetching value references.")
     values = self._GetObjectReferences(dictlen)
-    self._LogUltraVerbose(zip(keys, values))
+    return self._ResolveDict(keys, values)
+
+  def _ResolveDict(self, keys, values):
+    """Resolves the key and value references of a dictionary.
+
+    Args:
+      keys: A list of object references to the keys.
+      values: A list of object references to the values.
+
+    Returns:
+      A dictionary.
+    """
+    the_dict = {}
+    if self._log_ultra_verbose:
+      self._LogUltraVerbose(zip(keys, values))
+    if self._AreValidReferences(keys) and self._AreValidReferences(values):
+      # Fast path for the common case with no circular or invalid references
+      offsets = self.object_offsets
+      for k_ref, v_ref in zip(keys, values):
+        key = self._ParseObjectByIndex(k_ref, offsets)
+        value = self._ParseObjectByIndex(v_ref, offsets)
+        try:
+          the_dict[key] = value
+        except TypeError:
+          self._LogDebug("Key %s not hashable... marking as corrupt.", k_ref)
+          the_dict["corrupt:%d" % k_ref] = value
+          self.is_corrupt = True
+      if self.intern_pool is not None:
+        the_dict = self.intern_pool.InternDict(the_dict)
+      return the_dict
     for k_ref, v_ref in zip(keys, values):
-      if k_ref in self.objects_traversed or k_ref >= self.object_count:
+      if k_ref is CorruptReference:
+        key = self._TruncatedKey()
+      elif k_ref in self.objects_traversed or k_ref >= self.object_count:
         # Circular reference at the key or key pointing to a nonexisting object
         self._LogWarn("Circular reference key or invalid object key.")
         key = "corrupt:%d" % k_ref
         self.is_corrupt = True
       else:
         key = self._ParseObjectByIndex(k_ref, self.object_offsets)
-      if v_ref in self.objects_traversed or v_ref >= self.object_count:
+      if (v_ref is CorruptReference or v_ref in self.objects_traversed or
+          v_ref >= self.object_count):
         # Circular reference at value or value pointing to a nonexisting object
         self._LogWarn("Circular reference value or invalid object value.")
         value = CorruptReference
@@ -835,6 +1293,8 @@ class BinaryPlist(object):
         self._LogDebug("Key %s not hashable... marking as corrupt.", k_ref)
         the_dict["corrupt:%d" % k_ref] = value
         self.is_corrupt = True
+    if self.intern_pool is not None:
+      the_dict = self.intern_pool.InternDict(the_dict)
     return the_dict
 
   def _LogDiscovery(self, msg, *args, **kwargs):
@@ -844,6 +1304,29 @@ class BinaryPlist(object):
       self._LogInfo("DISCOVERY FOUND: %s\nPlease inform %s.",
                    msg, __feedback_email__, *args, **kwargs)
 
+  def _UpdateLogLevels(self):
+    """Finds out which of the parser's log levels are enabled.
+
+    Logging from the parsing functions is guarded by these flags, so that no
+    time is spent logging, or preparing what to log, when it's disabled.
+    The flags are updated every time Parse() is called.
+    """
+    root_logger = logging.getLogger()
+    self._log_debug = root_logger.isEnabledFor(logging.DEBUG)
+    self._log_ultra_verbose = (
+        root_logger.isEnabledFor(LOG_ULTRA_VERBOSE) or
+        (self.ultra_verbosity and self._log_debug))
+
+  def _TruncatedKey(self):
+    """Returns the key of a dictionary key reference cut short by the data.
+
+    References past the end of the data are padded with CorruptReference,
+    which can't be compared with the object count or formatted as a number.
+    """
+    self._LogWarn("Truncated object key.")
+    self.is_corrupt = True
+    return _TRUNCATED_KEY
+
   def _Log(self, level=logging.INFO, *args, **kwargs):
     if level == LOG_ULTRA_VERBOSE and self.ultra_verbosity:
       self._LogDebug(*args, **kwargs)
@@ -865,113 +1348,2479 @@ class BinaryPlist(object):
     self._Log(LOG_ULTRA_VERBOSE, *args, **kwargs)
 
 
-# Named readPlist so that binplist resembles the plistlib standard python module
-def readPlist(pathOrFile):
-  """Returns the top level object of the plist at pathOrFile.
+class BufferBinaryPlist(BinaryPlist):
+  """Represents a binary plist held in a memory buffer.
 
-  Args:
-    pathOrFile: A path or a file-like object to the plist.
+  This is an alternative parsing engine to BinaryPlist for data that's already
+  in memory or that can be memory mapped. Instead of seeking and reading from a
+  file object, markers, sizes and references are decoded straight from the
+  buffer by offset arithmetic, so there's no file position state at all.
 
-  Returns:
-    The top level object of the plist.
+  The parsed objects, BinaryPlist.objects and the corruption markers
+  (is_corrupt, CorruptReference, RawValue...) are the same you would obtain by
+  parsing the same data with BinaryPlist.
 
-  Raises:
-    FormatError: When the given file is not a binary plist or its version
-    is unknown.
+    with open("myfile.plist", "rb") as fd:
+      bplist = BufferBinaryPlist(fd.read())
+      top_level_object = bplist.Parse()
   """
-  try:
-    # See if it's a file-like object.
-    bplist_start_offset = pathOrFile.tell()
-    file_obj = pathOrFile
-  except AttributeError:
-    # Must be a path then
-    file_obj = open(pathOrFile, "rb")
-    bplist_start_offset = file_obj.tell()
 
-  magicversion = file_obj.read(8)
-  if magicversion.startswith("bplist15"):
-    logging.info("Binary plist version 1.5 found. Please, inform %s.",
-                 __feedback_email__)
-    raise FormatError("Binary plist version 1.5 found. Not supported yet.")
+  # Maps the high nibble of markers to the buffer decoding functions. Object
+  # types match those at BinaryPlist.KNOWN_MARKERS.
+  KNOWN_DECODERS = {
+      0x0: "_DecodeBoolFill",
+      0x1: "_DecodeInt",
+      0x2: "_DecodeReal",
+      0x3: "_DecodeDate",
+      0x4: "_DecodeData",
+      0x5: "_DecodeAsciiString",
+      0x6: "_DecodeUtf16",
+      0x8: "_DecodeUid",
+      0xA: "_DecodeArray",
+      0xC: "_DecodeSet",
+      0xD: "_DecodeDict",
+  }
 
-  try:
-    file_obj.seek(bplist_start_offset)
-    bplist = BinaryPlist(file_obj)
-    return bplist.Parse()
-  except FormatError:
-    try:
-      file_obj.seek(bplist_start_offset)
-      return plistlib.readPlist(file_obj)
-    except xml.parsers.expat.ExpatError:
-      raise FormatError("Invalid plist file.")
+  def __init__(self, data=None, offset=0, discovery_mode=False,
+               ultra_verbosity=False, stats=None, compact=False,
+               intern_pool=None, budget=None, data_views=False):
+    """Constructor.
 
+    Args:
+      data: A string, memoryview or mmap object holding the binary plist.
+      offset: The offset in data where the binary plist starts.
+      discovery_mode: See BinaryPlist.
+      ultra_verbosity: See BinaryPlist.
+      stats: See BinaryPlist. There's no file object, so no reads or seeks
+        are counted.
+      compact: See BinaryPlist.
+      intern_pool: See BinaryPlist.
+      budget: See BinaryPlist.
+      data_views: When activated, data objects are returned as DataView
+        objects referencing data instead of strings. data must not be modified
+        or closed while they're in use. Disabled by default.
+    """
+    super(BufferBinaryPlist, self).__init__(discovery_mode=discovery_mode,
+                                            ultra_verbosity=ultra_verbosity,
+                                            stats=stats, compact=compact,
+                                            intern_pool=intern_pool,
+                                            budget=budget)
+    self.data_views = data_views
+    self.data = None
+    if data is not None:
+      self.Open(data, offset=offset)
+
+  def Open(self, data, offset=0):
+    """Sets the buffer to parse.
 
-def ToDebugString(string):
-  try:
-    return str(string)
-  except UnicodeEncodeError:
-    return unicode(string).encode('unicode_escape')
+    Args:
+      data: A string, memoryview or mmap object holding the binary plist.
+      offset: The offset in data where the binary plist starts.
+    """
+    # memoryview slices aren't strings. They're kept as views where the
+    # decoding works on any buffer, and copied with _Bytes where it doesn't.
+    self.data = data
+    self._bplist_start_offset = offset
+    self._file_size = len(data) - offset
 
+  def Close(self):
+    self.data = None
 
+  def _HasData(self):
+    return self.data is not None
 
-def PlistToUnicode(o, string_encoding='safeascii', encoding_options="strict",
-                   indent=4, previous_indent=0):
-  """Returns the Unicode representation of a plist object.
+  def _ReadHeader(self):
+    """Parses the bplist header.
 
-  This is mostly just to handle displaying unicode keys or values in
-  dictionaries as the default dict implementation escapes them, and to try to
-  represent byte strings in a more human-readable form.
+    Raises:
+      FormatError: When the header is too short or the magic value is invalid.
+    """
+    header_struct = struct.Struct(">6s2s")
+    start = self._bplist_start_offset
+    data = self.data[start:start + header_struct.size]
+    if len(data) != header_struct.size:
+      raise FormatError("Wrong header length (got %d, expected %ld)." %
+                        (len(data), header_struct.size))
+    magic, self.version = header_struct.unpack(data)
+    if magic != b"bplist":
+      raise FormatError("Wrong magic %r, expecting 'bplist'." % magic)
+    if self.version[:1] != b"0":
+      self._LogWarn("Unknown version. Proceeding anyway...")
+
+  def _ReadTrailer(self):
+    """Parses the trailer.
 
-  Not very proud of the implementation but it is what it is.
-  """
-  if isinstance(o, dict):
-    indentation = u' '*(previous_indent+indent)
-    indentation_join = u',\n%s' % indentation
-    opening_bracket = u"{\n%s" % indentation
-    closing_bracket = u"\n%s}" % (u' '*previous_indent)
-    pieces = []
-    for k, v in o.iteritems():
-      key = PlistToUnicode(k, string_encoding=string_encoding,
-                      encoding_options=encoding_options, indent=indent,
-                      previous_indent=previous_indent+indent)
-      value = PlistToUnicode(v, string_encoding=string_encoding,
-                        encoding_options=encoding_options, indent=indent,
-                        previous_indent=previous_indent+indent)
-      pieces.append(u"%s: %s" % (key, value))
-    if not pieces:
-      return '{}'
-    return ''.join([opening_bracket,
-                    indentation_join.join(pieces),
-                    closing_bracket])
-  elif isinstance(o, str):
+    Raises:
+      IOError: When there is not enough data for the trailer.
+    """
+    trailer_struct = struct.Struct(">5xBBBQQQ")
+    trailer_start = len(self.data) - trailer_struct.size
+    if trailer_start < 0:
+      raise IOError("Wrong trailer length (got %d, expected %ld." %
+                    (len(self.data), trailer_struct.size))
+    (self.sort_version,
+     self.offset_int_size,
+     self.object_ref_size,
+     self.object_count,
+     self.top_level_index,
+     self.offtable_offset) = trailer_struct.unpack_from(self.data,
+                                                        trailer_start)
+
+  def _ReadOffsetTable(self):
+    """Parses the bplist offset table.
+
+    Raises:
+      FormatError: When the offset to the offset table is invalid or the
+      offset table overflows the file contents.
+    """
+    self.object_offsets = []
+    if self.offtable_offset >= self._file_size:
+      raise FormatError("Offset table offset past the file end.")
+
+    data_size = self.object_count * self.offset_int_size
+    if data_size == 0:
+      raise FormatError("Length of offsets table is 0.")
+    if data_size > (self._file_size - self.offtable_offset):
+      raise FormatError("Length of offsets table larger than the data available"
+                        "in the file (%d vs %ld)." %
+                        (data_size, self._file_size))
+
+    position = self._bplist_start_offset + self.offtable_offset
+    self._DecodeOffsetTable(_Bytes(self.data[position:position + data_size]))
+
+  def _ParseObjectAt(self, offset):
+    return self._DecodeObject(self._bplist_start_offset + offset)
+
+  def _DecodeObject(self, position):
+    """Decodes the binary plist object at the given buffer position.
+
+    Args:
+      position: The absolute position of the object marker in the buffer.
+
+    Returns:
+      A python object representing the plist object.
+
+    Raises:
+      IOError: When there's not enough data in the buffer to read a new object.
+    """
     try:
-      if string_encoding == "safeascii":
-        safeascii = []
-        for c in o:
-          if c in string.printable:
-            safeascii.append(c)
-          else:
-            safeascii.append("\\x" + c.encode("hex"))
-        return u"'%s'" % (''.join(safeascii)).decode("ascii", "strict")
-      return u"'%s'" % o.decode(string_encoding, encoding_options)
-    except (UnicodeEncodeError, UnicodeDecodeError):
-      return u"'%s'" % ''.join([u"\\x%s" % c.encode('hex') for c in o])
-  elif isinstance(o, unicode):
-    # Return a quote-enclosed string
-    return u"'%s'" % o
-  elif o is NullValue:
-    return u"NULL"
-  elif o is CorruptReference:
-    return u"##CORRUPT_REFERENCE##"
-  elif o is UnknownObject:
-    return u"##UNKNOWN_OBJECT##"
-  else:
+      (marker,) = _BYTE_STRUCT.unpack_from(self.data, position)
+    except struct.error:
+      raise IOError("Not enough data available to read a new object.")
     try:
-      return u'[%s]' % u', '.join([PlistToUnicode(piece,
-                                                  string_encoding,
-                                                  encoding_options,
-                                                  indent,
-                                                  previous_indent)
-                                   for piece in o])
-    except TypeError:
-      return unicode(o)
+      decoding_function_name = self.KNOWN_DECODERS[marker >> 4]
+      return getattr(self, decoding_function_name)(marker & 0x0F, position + 1)
+    except KeyError:
+      self._LogWarn("UNKNOWN MARKER %lx", marker)
+      return UnknownObject
+
+  def _DecodeBoolFill(self, marker_lo, unused_position):
+    return self._ParseBoolFill(marker_lo)
+
+  def _DecodeInt(self, marker_lo, position):
+    """Decodes an integer object. See BinaryPlist._ParseInt."""
+    int_bytes = 1 << marker_lo
+    if marker_lo not in [0, 1, 2, 3, 4]:
+      self._LogWarn("Non-standard integer length (%d).", marker_lo)
+      return RawValue(_Bytes(self.data[position:position + int_bytes]))
+
+    if int_bytes == 8 and self.version == b"00":
+      int_struct = struct.Struct(">q")
+    elif int_bytes == 16:
+      if self.version == b"00":
+        int_struct = struct.Struct(">qQ")
+      else:
+        int_struct = struct.Struct(">QQ")
+      data = self.data[position:position + int_struct.size]
+      (high, low) = int_struct.unpack(data)
+      return (high << 64) | low
+    else:
+      int_struct = struct.Struct(">%c" % self.bytesize_to_uchar[int_bytes])
+    data = self.data[position:position + int_struct.size]
+    if len(data) < int_struct.size:
+      return RawValue(_Bytes(data))
+    (value,) = int_struct.unpack(data)
+    return value
+
+  def _DecodeReal(self, marker_lo, position):
+    """Decodes a real object. See BinaryPlist._ParseReal."""
+    if marker_lo not in [2, 3]:
+      real_length = 1 << marker_lo
+      self._LogWarn("Non-standard real number length (%d).", real_length)
+      return RawValue(_Bytes(self.data[position:position + real_length]))
+
+    if marker_lo == 2:
+      float_struct = struct.Struct(">f")
+    else:
+      float_struct = struct.Struct(">d")
+    (value,) = float_struct.unpack(
+        self.data[position:position + float_struct.size])
+    return value
+
+  def _DecodeDate(self, marker_lo, position):
+    """Decodes a date object. See BinaryPlist._ParseDate."""
+    if marker_lo != 3:
+      self._LogWarn("Non-standard (8) date length (%d).", 1 << marker_lo)
+      self.is_corrupt = True
+    date_struct = struct.Struct(">d")
+    data = self.data[position:position + date_struct.size]
+    if len(data) < date_struct.size:
+      return RawValue(_Bytes(data))
+    (float_date,) = date_struct.unpack(data)
+    fraction, integer = math.modf(float_date)
+    try:
+      date_offset = datetime.timedelta(seconds=int(integer),
+                                       microseconds=int(fraction*1000000))
+    except OverflowError:
+      return RawValue(_Bytes(data))
+    return self.plist_epoch + date_offset
+
+  def _DecodeData(self, marker_lo, position):
+    if not self.data_views:
+      return self._DecodeString(marker_lo, position)
+    length, position = self._DecodeSizedInt(marker_lo, position)
+    # As when slicing, data objects are cut short at the end of the buffer
+    length = max(0, min(length, len(self.data) - position))
+    return DataView(self.data, position, length)
+
+  def _DecodeString(self, marker_lo, position, char_size=1):
+    """Decodes a string-like object. See BinaryPlist._ParseString."""
+    strlen, position = self._DecodeSizedInt(marker_lo, position)
+    return _Bytes(self.data[position:position + strlen*char_size])
+
+  def _DecodeAsciiString(self, marker_lo, position):
+    """Decodes an ASCII string object. See BinaryPlist._ParseAsciiString."""
+    return _DecodeAscii(self._DecodeString(marker_lo, position))
+
+  if not _PY3:
+    _DecodeAsciiString = _DecodeString
+
+  def _DecodeSizedInt(self, marker_lo, position):
+    """Decodes a sized integer. See BinaryPlist._GetSizedIntFromFd.
+
+    Args:
+      marker_lo: The lower nibble of the marker.
+      position: The buffer position right after the marker.
+
+    Returns:
+      A tuple with the integer value and the buffer position right after it.
+
+    Raises:
+      IOError: When the sized integer is truncated.
+    """
+    if marker_lo != 0xF:
+      return marker_lo, position
+    try:
+      (size_marker,) = _BYTE_STRUCT.unpack_from(self.data, position)
+    except struct.error:
+      raise IOError
+    size_byte_count = 1 << (size_marker & 0xF)
+    try:
+      struct_char = self.bytesize_to_uchar[size_byte_count]
+    except KeyError:
+      self._LogWarn("unknown size found %d, defaulting to 2", size_byte_count)
+      struct_char = self.bytesize_to_uchar.get(2)
+      self.is_corrupt = True
+    strlen_struct = struct.Struct(">%c" % struct_char)
+    position += 1
+    data = self.data[position:position + strlen_struct.size]
+    if len(data) < strlen_struct.size:
+      raise IOError
+    (strlen,) = strlen_struct.unpack(data)
+    return strlen, position + strlen_struct.size
+
+  def _DecodeUtf16(self, marker_lo, position):
+    """Decodes a Unicode object. See BinaryPlist._ParseUtf16."""
+    utf16 = self._DecodeString(marker_lo, position, char_size=2)
+    try:
+      return utf16.decode("utf-16-be")
+    except UnicodeDecodeError:
+      self._LogWarn("Invalid UTF-16 data")
+      return RawValue(utf16)
+
+  def _DecodeUid(self, marker_lo, position):
+    """Decodes a UID object. See BinaryPlist._ParseUid."""
+    uid_size = marker_lo + 1
+    if uid_size not in [1, 2, 4, 8]:
+      self._LogWarn("Uncommon UID size %d (expected 1, 2, 4 or 8)", uid_size)
+    self._LogDiscovery("FOUND A UID!")
+    return _MakeUid(
+        _BigEndianToInteger(_Bytes(self.data[position:position + uid_size])))
+
+  def _DecodeArray(self, marker_lo, position):
+    """Decodes an array object. See BinaryPlist._ParseArray."""
+    arraylen, position = self._DecodeSizedInt(marker_lo, position)
+    references = self._DecodeObjectReferences(position, arraylen)
+    return self._ResolveArray(references)
+
+  def _DecodeSet(self, marker_lo, position):
+    self._LogDiscovery("FOUND A SET!!!")
+    return self._DecodeArray(marker_lo, position)
+
+  def _DecodeDict(self, marker_lo, position):
+    """Decodes a dict object. See BinaryPlist._ParseDict."""
+    dictlen, position = self._DecodeSizedInt(marker_lo, position)
+    keys = self._DecodeObjectReferences(position, dictlen)
+    values = self._DecodeObjectReferences(
+        position + dictlen * self.object_ref_size, dictlen)
+    return self._ResolveDict(keys, values)
+
+  def _DecodeObjectReferences(self, position, length):
+    """Decodes a list of object references.
+
+    Args:
+      position: The buffer position of the first reference.
+      length: The amount of object references.
+
+    Returns:
+      A list of references. See BinaryPlist._UnpackObjectReferences.
+    """
+    return self._UnpackObjectReferences(
+        self.data[position:position + length * self.object_ref_size], length)
+
+
+class IterativeBinaryPlist(BinaryPlist):
+  """Represents a binary plist parsed without recursion.
+
+  BinaryPlist parses nested arrays and dictionaries recursively, so a deeply
+  nested (or maliciously crafted) plist can hit python's recursion limit. This
+  parser resolves containers with an explicit stack instead, so it handles
+  plists of any depth. Results and corruption markers are the same as
+  BinaryPlist's.
+
+  Circular references are detected with a state byte for each object index,
+  objects_traversed isn't used.
+  """
+
+  # Object states
+  _NOT_IN_PROGRESS = 0
+  _IN_PROGRESS = 1
+
+  def _Initialize(self):
+    super(IterativeBinaryPlist, self)._Initialize()
+    # The state of each object index. Allocated when parsing starts.
+    self._object_states = None
+
+  def DropObjects(self):
+    super(IterativeBinaryPlist, self).DropObjects()
+    self._object_states = None
+
+  def _ResolveArray(self, references):
+    return _PendingContainer([], references, None)
+
+  def _ResolveDict(self, keys, values):
+    return _PendingContainer({}, values, keys)
+
+  def _ParseObjectByIndex(self, index, offset_list):
+    """Returns an object by its index.
+
+    See BinaryPlist._ParseObjectByIndex. Arrays, sets and dictionaries are
+    pushed to a stack of pending containers and their references resolved in
+    the same order BinaryPlist resolves them.
+    """
+    if (self._object_states is None or
+        len(self._object_states) < len(offset_list)):
+      self._object_states = bytearray(len(offset_list))
+    obj = self._StartObject(index, offset_list)
+    if obj.__class__ is not _PendingContainer:
+      return obj
+
+    stack = [obj]
+    try:
+      while stack:
+        pending = stack[-1]
+        if pending.position == len(pending.references):
+          # All the references of the container have been resolved
+          stack.pop()
+          obj = self._FinishObject(pending)
+          if stack:
+            self._AddToContainer(stack[-1], obj)
+          continue
+        if pending.keys is None:
+          # Resolve elements in a row until one of them is a container
+          array = pending.obj
+          references = pending.references
+          while pending.position < len(references):
+            obj = self._StartArrayElement(references[pending.position],
+                                          offset_list)
+            if obj.__class__ is _PendingContainer:
+              stack.append(obj)
+              break
+            array.append(obj)
+            pending.position += 1
+          continue
+        if pending.key is _PendingContainer.NO_KEY:
+          obj = self._StartDictKey(pending, offset_list)
+        else:
+          obj = self._StartDictValue(pending, offset_list)
+        if obj.__class__ is _PendingContainer:
+          stack.append(obj)
+        else:
+          self._AddToContainer(pending, obj)
+    finally:
+      # Don't leave objects in progress if parsing raised
+      for pending in stack:
+        self._object_states[pending.index] = self._NOT_IN_PROGRESS
+    return obj
+
+  def _StartArrayElement(self, reference, offset_list):
+    """Starts parsing an element of a pending array.
+
+    Returns:
+      The element, CorruptReference or a new pending container.
+    """
+    if reference is CorruptReference:
+      return CorruptReference
+    elif reference >= self.object_count:
+      self._LogWarn("Reference %d out of bounds, skipping...", reference)
+      self.is_corrupt = True
+      return CorruptReference
+    elif self._object_states[reference]:
+      self._LogWarn("Circular reference detected at array object.")
+      self.is_corrupt = True
+      return CorruptReference
+    return self._StartObject(reference, offset_list)
+
+  def _StartDictKey(self, pending, offset_list):
+    """Starts parsing the next key of a pending dictionary.
+
+    Returns:
+      The key, a "corrupt:<reference>" or "corrupt:truncated" string or a new
+      pending container.
+    """
+    k_ref = pending.keys[pending.position]
+    if k_ref is CorruptReference:
+      return self._TruncatedKey()
+    if k_ref >= self.object_count or self._object_states[k_ref]:
+      # Circular reference at the key or key pointing to a nonexisting object
+      self._LogWarn("Circular reference key or invalid object key.")
+      self.is_corrupt = True
+      return "corrupt:%d" % k_ref
+    return self._StartObject(k_ref, offset_list)
+
+  def _StartDictValue(self, pending, offset_list):
+    """Starts parsing the next value of a pending dictionary.
+
+    Returns:
+      The value, CorruptReference or a new pending container.
+    """
+    v_ref = pending.references[pending.position]
+    if (v_ref is CorruptReference or v_ref >= self.object_count or
+        self._object_states[v_ref]):
+      # Circular reference at value or value pointing to a nonexisting object
+      self._LogWarn("Circular reference value or invalid object value.")
+      self.is_corrupt = True
+      return CorruptReference
+    return self._StartObject(v_ref, offset_list)
+
+  def _AddToContainer(self, pending, obj):
+    """Adds an element, key or value to a pending container."""
+    if pending.keys is None:
+      pending.obj.append(obj)
+      pending.position += 1
+      return
+    if pending.key is _PendingContainer.NO_KEY:
+      pending.key = obj
+      return
+    try:
+      pending.obj[pending.key] = obj
+    except TypeError:
+      # key is not hashable, so we adjust...
+      k_ref = pending.keys[pending.position]
+      self._LogDebug("Key %s not hashable... marking as corrupt.", k_ref)
+      pending.obj["corrupt:%d" % k_ref] = obj
+      self.is_corrupt = True
+    pending.key = _PendingContainer.NO_KEY
+    pending.position += 1
+
+  def _StartObject(self, index, offset_list):
+    """Starts parsing an object by its index.
+
+    Args:
+      index: The 0-based index of the object in the offset_list.
+      offset_list: A list of offsets for each of the available objects in the
+      binary plist file.
+
+    Returns:
+      The object or, for arrays, sets and dictionaries, a _PendingContainer
+      whose references have yet to be resolved.
+
+    Raises:
+      IndexError: If the index is invalid.
+    """
+    offset = offset_list[index]
+    if self._log_debug:
+      self._LogDebug("Parsing object at index %d", index)
+    if index in self.objects:
+      if self._log_debug:
+        self._LogDebug("Skipping: Object had already been parsed.")
+      return self.objects[index]
+    if offset > self._file_size:
+      # This only happens when the offset in the offset table is wrong
+      return CorruptReference
+    obj = self._ParseObjectAt(offset)
+    if obj.__class__ is _PendingContainer:
+      obj.index = index
+      self._object_states[index] = self._IN_PROGRESS
+      return obj
+    self.objects[index] = obj
+    self._LogObject(index, obj)
+    return obj
+
+  def _FinishObject(self, pending):
+    """Returns and caches the object of a fully resolved pending container."""
+    self._object_states[pending.index] = self._NOT_IN_PROGRESS
+    obj = pending.obj
+    if self.intern_pool is not None:
+      if pending.keys is None:
+        self.intern_pool.InternList(obj)
+      else:
+        obj = self.intern_pool.InternDict(obj)
+    self.objects[pending.index] = obj
+    self._LogObject(pending.index, obj)
+    return obj
+
+  def _LogObject(self, index, obj):
+    if self._log_ultra_verbose:
+      output_string = ToDebugString(obj)
+      fmt = "Object %d = %s"
+      if len(output_string) > self.debug_object_preview_length:
+        fmt = "Object %%d ~= %%.%ds ..." % self.debug_object_preview_length
+      self._LogUltraVerbose(fmt, index, output_string)
+
+
+class IterativeBufferBinaryPlist(IterativeBinaryPlist, BufferBinaryPlist):
+  """An IterativeBinaryPlist that parses from a memory buffer.
+
+  See IterativeBinaryPlist and BufferBinaryPlist.
+  """
+
+
+class _PendingContainer(object):
+  """An array or dictionary whose references haven't been resolved yet.
+
+  Attributes:
+    obj: The list or dictionary being filled.
+    references: The element references of an array or the value references of
+      a dictionary.
+    keys: The key references of a dictionary, None for arrays.
+    position: The index of the next reference to resolve.
+    key: The resolved key whose value is being resolved, NO_KEY otherwise.
+    index: The index of the container in the offset table.
+  """
+
+  __slots__ = ("obj", "references", "keys", "position", "key", "index")
+
+  NO_KEY = object()
+
+  def __init__(self, obj, references, keys):
+    self.obj = obj
+    self.references = references
+    self.keys = keys
+    self.position = 0
+    self.key = self.NO_KEY
+    self.index = None
+
+
+class LazyBinaryPlist(BinaryPlist):
+  """Represents a binary plist whose objects are parsed on demand.
+
+  Parse() doesn't parse every object in the offset table. Instead, arrays,
+  sets and dictionaries are returned as LazyList and LazyDict proxies that only
+  parse the objects they reference when these are accessed. This makes
+  looking up a couple of values in a big plist much cheaper.
+
+    with open("myfile.plist", "rb") as fd:
+      bplist = LazyBinaryPlist(fd)
+      top_level_object = bplist.Parse()
+      print(top_level_object["$top"])
+
+  The file object must be kept open for as long as the proxies are used.
+  Call Materialize() on a proxy to obtain a fully parsed copy of it, just as
+  BinaryPlist would have returned. BinaryPlist.is_corrupt only accounts for the
+  objects parsed so far.
+  """
+
+  def _ParseObjects(self):
+    """Objects are parsed when accessed instead."""
+
+  def _ResolveArray(self, references):
+    return LazyList(self, references)
+
+  def _ResolveDict(self, keys, values):
+    return LazyDict(self, keys, values)
+
+  def Query(self, path):
+    """Returns the object at path, parsing only the objects along it.
+
+    The header, trailer and offset table are read the first time this is
+    called, so querying several paths on the same plist is cheap.
+
+    Args:
+      path: The path to the object, e.g. "root.Items[3].Name". See query().
+
+    Returns:
+      The object at path, fully parsed.
+
+    Raises:
+      KeyError: When a dictionary key in path doesn't exist.
+      IndexError: When an array index in path doesn't exist.
+      ValueError: When path is malformed.
+    """
+    tokens = _ParsePlistPath(path)
+    if self.top_level_index is None:
+      top_level_object = self.Parse()
+    else:
+      top_level_object = self.top_level_object
+    return _WalkPlistPath(top_level_object, tokens, path)
+
+  def _ResolveReference(self, reference):
+    """Returns the object a container reference points to.
+
+    Args:
+      reference: An object reference from a container.
+
+    Returns:
+      The object or CorruptReference if the reference is invalid.
+    """
+    if reference is CorruptReference:
+      return CorruptReference
+    if reference >= self.object_count:
+      self._LogWarn("Reference %d out of bounds, skipping...", reference)
+      self.is_corrupt = True
+      return CorruptReference
+    obj = self._ParseObjectByIndex(reference, self.object_offsets)
+    if self.intern_pool is not None:
+      obj = self.intern_pool.InternValue(obj)
+    return obj
+
+  def _ResolveKey(self, reference):
+    """Returns the dictionary key a reference points to.
+
+    Args:
+      reference: An object reference to a dictionary key.
+
+    Returns:
+      The key, "corrupt:<reference>" when the reference or the key is invalid
+      or "corrupt:truncated" when the reference is cut short.
+    """
+    if reference is CorruptReference:
+      return self._TruncatedKey()
+    if reference >= self.object_count:
+      self._LogWarn("Circular reference key or invalid object key.")
+      self.is_corrupt = True
+      return "corrupt:%d" % reference
+    key = self._ParseObjectByIndex(reference, self.object_offsets)
+    try:
+      hash(key)
+    except TypeError:
+      self._LogDebug("Key %s not hashable... marking as corrupt.", reference)
+      self.is_corrupt = True
+      return "corrupt:%d" % reference
+    if self.intern_pool is not None:
+      key = self.intern_pool.Intern(key)
+    return key
+
+
+class LazyBufferBinaryPlist(LazyBinaryPlist, BufferBinaryPlist):
+  """A LazyBinaryPlist that parses from a memory buffer.
+
+  See LazyBinaryPlist and BufferBinaryPlist.
+  """
+
+
+class LazyList(collections_abc.Sequence):
+  """A read-only list whose elements are parsed when accessed."""
+
+  # Lists aren't hashable
+  __hash__ = None
+
+  def __init__(self, plist, references):
+    """Constructor.
+
+    Args:
+      plist: The LazyBinaryPlist the references belong to.
+      references: A list of object references.
+    """
+    self._plist = plist
+    self._references = references
+
+  def __len__(self):
+    return len(self._references)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self._plist._ResolveReference(reference)
+              for reference in self._references[index]]
+    return self._plist._ResolveReference(self._references[index])
+
+  def __eq__(self, other):
+    if not isinstance(other, (list, LazyList)):
+      return NotImplemented
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    if result is NotImplemented:
+      return result
+    return not result
+
+  def __repr__(self):
+    return "<LazyList of %d elements>" % len(self)
+
+  def Materialize(self):
+    """Returns a list with all the elements parsed, recursively."""
+    return _Materialize(self, set())
+
+
+class LazyDict(collections_abc.Mapping):
+  """A read-only dictionary whose values are parsed when accessed.
+
+  Keys are parsed the first time they're needed, which is the case for almost
+  anything but fetching the length. Values are only parsed when accessed.
+  """
+
+  def __init__(self, plist, keys, values):
+    """Constructor.
+
+    Args:
+      plist: The LazyBinaryPlist the references belong to.
+      keys: A list of object references to the keys.
+      values: A list of object references to the values.
+    """
+    self._plist = plist
+    self._key_references = keys
+    self._value_references = values
+    # Maps each parsed key to the reference of its value
+    self._value_references_by_key = None
+
+  def _GetValueReferencesByKey(self):
+    if self._value_references_by_key is None:
+      value_references_by_key = {}
+      for k_ref, v_ref in zip(self._key_references, self._value_references):
+        value_references_by_key[self._plist._ResolveKey(k_ref)] = v_ref
+      self._value_references_by_key = value_references_by_key
+    return self._value_references_by_key
+
+  def __len__(self):
+    return len(self._GetValueReferencesByKey())
+
+  def __iter__(self):
+    return iter(self._GetValueReferencesByKey())
+
+  def __contains__(self, key):
+    return key in self._GetValueReferencesByKey()
+
+  def __getitem__(self, key):
+    reference = self._GetValueReferencesByKey()[key]
+    return self._plist._ResolveReference(reference)
+
+  def __repr__(self):
+    # Don't use len(self), which would parse the keys
+    return "<LazyDict of %d entries>" % len(self._key_references)
+
+  def Materialize(self):
+    """Returns a dictionary with all the values parsed, recursively."""
+    return _Materialize(self, set())
+
+
+def _Materialize(obj, ancestors):
+  """Returns a fully parsed copy of obj.
+
+  Lazy containers that contain themselves get the circular reference replaced
+  by CorruptReference, as BinaryPlist does.
+
+  Args:
+    obj: The object to materialize.
+    ancestors: A set with the ids of the lazy containers being materialized.
+
+  Returns:
+    obj with all the lazy containers within replaced by lists and dictionaries.
+  """
+  if not isinstance(obj, (LazyList, LazyDict)):
+    return obj
+  if id(obj) in ancestors:
+    obj._plist._LogWarn("Circular reference detected.")
+    obj._plist.is_corrupt = True
+    return CorruptReference
+  ancestors.add(id(obj))
+  try:
+    if isinstance(obj, LazyList):
+      return [_Materialize(element, ancestors) for element in obj]
+    return dict((key, _Materialize(obj[key], ancestors)) for key in obj)
+  finally:
+    ancestors.remove(id(obj))
+
+
+class ParseStats(object):
+  """Statistics about the parsing of binary plists.
+
+    stats = ParseStats()
+    BinaryPlist(fd, stats=stats).Parse()
+    print(stats)
+
+  The parser methods being measured are wrapped on the parser instance, so
+  parsers without stats run exactly the same code they would otherwise.
+  Statistics add up when several parses or parsers share a ParseStats.
+
+  Attributes:
+    phase_times: Seconds spent in each parsing phase (see PHASES) and in
+      anything else measured with Time().
+    marker_counts: Objects decoded by type, as named in KNOWN_MARKERS.
+    cache_hits: Lookups of already parsed objects in BinaryPlist.objects.
+    cache_misses: Lookups of objects that had to be parsed.
+    reads: Calls to read() on the file object.
+    seeks: Calls to seek() on the file object.
+    bytes_read: Bytes returned by read().
+  """
+
+  PHASES = ("_ReadHeader", "_ReadTrailer", "_ReadOffsetTable", "_ParseObjects")
+
+  def __init__(self):
+    self.phase_times = {}
+    self.marker_counts = {}
+    self.cache_hits = 0
+    self.cache_misses = 0
+    self.reads = 0
+    self.seeks = 0
+    self.bytes_read = 0
+
+  def Attach(self, plist):
+    """Makes a parser collect its statistics into this object.
+
+    Args:
+      plist: A BinaryPlist, or any of its subclasses, before it's opened.
+    """
+    for phase in self.PHASES:
+      setattr(plist, phase, self._TimeMethod(phase, getattr(plist, phase)))
+
+    # Objects are counted when the parser dispatches them by marker. Counting
+    # methods get their own names, so that parsing functions calling each
+    # other (sets parsed as arrays...) don't count an object twice.
+    if isinstance(plist, BufferBinaryPlist):
+      counting_decoders = {}
+      for marker_hi, function_name in plist.KNOWN_DECODERS.items():
+        counting_decoders[marker_hi] = self._AddCountingMethod(
+            plist, BinaryPlist.KNOWN_MARKERS[marker_hi][0], function_name)
+      plist.KNOWN_DECODERS = counting_decoders
+    else:
+      counting_markers = {}
+      for marker_hi, (marker_name, function_name) in (
+          plist.KNOWN_MARKERS.items()):
+        counting_markers[marker_hi] = (marker_name, self._AddCountingMethod(
+            plist, marker_name, function_name))
+      plist.KNOWN_MARKERS = counting_markers
+      original_open = plist.Open
+      plist.Open = lambda file_obj: original_open(_CountingFile(file_obj,
+                                                                self))
+
+    original_initialize = plist._Initialize
+    def _Initialize():
+      original_initialize()
+      plist.objects = _CountingObjectDict(self)
+    plist._Initialize = _Initialize
+    original_allocate_objects = plist._AllocateObjects
+    def _AllocateObjects():
+      if plist.compact:
+        plist.objects = _CountingCompactObjectCache(self, plist.object_count)
+      else:
+        original_allocate_objects()
+    plist._AllocateObjects = _AllocateObjects
+
+  @contextlib.contextmanager
+  def Time(self, phase):
+    """Adds the time spent in a with block to a phase, e.g. "render"."""
+    start = time.time()
+    try:
+      yield
+    finally:
+      self._AddTime(phase, time.time() - start)
+
+  def AsDict(self):
+    """Returns the statistics as a dictionary, e.g. to export them as JSON."""
+    return {
+        "phase_times": dict(self.phase_times),
+        "marker_counts": dict(self.marker_counts),
+        "cache": {"hits": self.cache_hits, "misses": self.cache_misses},
+        "io": {"reads": self.reads, "seeks": self.seeks,
+               "bytes_read": self.bytes_read},
+    }
+
+  def __str__(self):
+    lines = ["%-20s %10.6fs" % (phase, self.phase_times[phase])
+             for phase in sorted(self.phase_times)]
+    lines.extend("%-20s %10d" % (marker_name, count)
+                 for marker_name, count in sorted(self.marker_counts.items()))
+    lines.append("cache hits/misses    %d/%d" % (self.cache_hits,
+                                                 self.cache_misses))
+    lines.append("reads/seeks/bytes    %d/%d/%d" % (self.reads, self.seeks,
+                                                    self.bytes_read))
+    return "\n".join(lines)
+
+  def _AddTime(self, phase, seconds):
+    self.phase_times[phase] = self.phase_times.get(phase, 0.0) + seconds
+
+  def _TimeMethod(self, phase, method):
+    def TimedMethod(*args, **kwargs):
+      with self.Time(phase):
+        return method(*args, **kwargs)
+    return TimedMethod
+
+  def _AddCountingMethod(self, plist, marker_name, function_name):
+    """Sets a method on plist counting objects of a type, and returns its name.
+    """
+    method = getattr(plist, function_name)
+    marker_counts = self.marker_counts
+    def CountingMethod(*args):
+      marker_counts[marker_name] = marker_counts.get(marker_name, 0) + 1
+      return method(*args)
+    counting_function_name = "_Counting" + function_name
+    setattr(plist, counting_function_name, CountingMethod)
+    return counting_function_name
+
+
+class _CompactObjectCache(list):
+  """BinaryPlist.objects in compact mode.
+
+  A list with an item for each object in the offset table, NotParsed for the
+  objects not parsed yet. Lookups and "in" behave as with the dictionary of
+  objects: looking up an object not parsed yet raises KeyError.
+  """
+
+  __slots__ = ()
+
+  def __init__(self, object_count):
+    list.__init__(self, itertools.repeat(NotParsed, object_count))
+
+  def __getitem__(self, index):
+    obj = list.__getitem__(self, index)
+    if obj is NotParsed:
+      raise KeyError(index)
+    return obj
+
+  def __contains__(self, index):
+    try:
+      return list.__getitem__(self, index) is not NotParsed
+    except (IndexError, TypeError):
+      return False
+
+
+class _CountingObjectCache(object):
+  """Counts the hits and misses of BinaryPlist.objects.
+
+  Mixed into the dictionary of objects or the compact list of objects.
+  """
+
+  __slots__ = ()
+
+  def __getitem__(self, index):
+    try:
+      obj = super(_CountingObjectCache, self).__getitem__(index)
+    except KeyError:
+      self._stats.cache_misses += 1
+      raise
+    self._stats.cache_hits += 1
+    return obj
+
+  def __contains__(self, index):
+    if super(_CountingObjectCache, self).__contains__(index):
+      # A hit is counted when the object is fetched
+      return True
+    self._stats.cache_misses += 1
+    return False
+
+
+class _CountingObjectDict(_CountingObjectCache, dict):
+
+  __slots__ = ("_stats",)
+
+  def __init__(self, stats):
+    dict.__init__(self)
+    self._stats = stats
+
+
+class _CountingCompactObjectCache(_CountingObjectCache, _CompactObjectCache):
+
+  __slots__ = ("_stats",)
+
+  def __init__(self, stats, object_count):
+    _CompactObjectCache.__init__(self, object_count)
+    self._stats = stats
+
+
+class _CountingFile(object):
+  """A file object wrapper that counts reads and seeks."""
+
+  def __init__(self, file_obj, stats):
+    self._file_obj = file_obj
+    self._stats = stats
+
+  def read(self, *args):
+    data = self._file_obj.read(*args)
+    self._stats.reads += 1
+    self._stats.bytes_read += len(data)
+    return data
+
+  def seek(self, *args):
+    self._stats.seeks += 1
+    return self._file_obj.seek(*args)
+
+  def __getattr__(self, name):
+    return getattr(self._file_obj, name)
+
+
+class ParseBudget(object):
+  """Limits on the resources a single parse may consume.
+
+    budget = ParseBudget(max_objects=100000, max_seconds=5)
+    top_level_object = BinaryPlist(fd, budget=budget).Parse()
+    if budget.exceeded:
+      print(budget)
+
+  Parsing always completes. Objects that would take the parse over budget are
+  replaced by CorruptReference and BinaryPlist.is_corrupt is set. Objects too
+  big or nested too deep are skipped on their own. Running out of objects,
+  decoded bytes or time ends the parse instead: every object not parsed by then
+  is CorruptReference. Objects are parsed from the top level object down, so
+  the partial results hold the top of the plist. In plists with circular
+  references, that order may flag different references than parsing without
+  a budget does.
+
+  As with ParseStats, limits are enforced by wrapping parser methods on the
+  instance. Consumption is reset every time parsing starts, so a budget should
+  only be used by a parser at a time. With lazy parsers, objects parsed on
+  demand after Parse() count too, and nesting isn't tracked. A budget without
+  any limit isn't attached at all: parsing is the same as without a budget and
+  nothing is measured.
+
+  Attributes:
+    max_objects: The maximum amount of objects to parse.
+    max_object_size: The maximum size in bytes of a string, a data object or
+      the references of an array or dictionary.
+    max_decoded_bytes: The maximum size in bytes of all of them.
+    max_depth: The maximum nesting level of objects. The top level object is
+      at level 1, the elements of a top level array at level 2, and so on.
+      Objects referenced from several containers are parsed at the level they
+      are first found at.
+    max_seconds: The maximum time to parse for.
+    objects: Objects parsed.
+    decoded_bytes: Bytes of strings, data objects and references decoded.
+    depth: The deepest nesting level reached.
+    seconds: Time spent parsing.
+    exceeded: A set with the names of the limits exceeded, e.g. "max_objects".
+  The limits are None when there's no limit.
+  """
+
+  # The size of each unit of length of variable sized objects. Containers are
+  # measured in object references, and dictionaries hold two per entry.
+  UNIT_SIZES = {"DATA": 1, "STRING": 1, "UTF16": 2}
+  REFERENCES_PER_UNIT = {"ARRAY": 1, "SET": 1, "DICT": 2}
+
+  def __init__(self, max_objects=None, max_object_size=None,
+               max_decoded_bytes=None, max_depth=None, max_seconds=None):
+    self.max_objects = max_objects
+    self.max_object_size = max_object_size
+    self.max_decoded_bytes = max_decoded_bytes
+    self.max_depth = max_depth
+    self.max_seconds = max_seconds
+    self._Reset()
+
+  def Attach(self, plist):
+    """Makes a parser respect this budget.
+
+    Args:
+      plist: A BinaryPlist, or any of its subclasses, before it's opened.
+    """
+    if (self.max_objects is None and self.max_object_size is None and
+        self.max_decoded_bytes is None and self.max_depth is None and
+        self.max_seconds is None):
+      # Nothing to enforce
+      return
+
+    original_initialize = plist._Initialize
+    def _Initialize():
+      original_initialize()
+      self._Reset()
+    plist._Initialize = _Initialize
+
+    original_parse = plist.Parse
+    def Parse():
+      try:
+        return original_parse()
+      finally:
+        self.seconds = time.time() - self._start
+    plist.Parse = Parse
+
+    original_parse_objects = plist._ParseObjects
+    def _ParseObjects():
+      # Parse from the top level object down, so that running out of budget
+      # leaves the top of the plist rather than the first objects in the
+      # offset table, which are usually leaves
+      if not isinstance(plist, LazyBinaryPlist):
+        plist._ParseObjectByIndex(plist.top_level_index, plist.object_offsets)
+      original_parse_objects()
+    plist._ParseObjects = _ParseObjects
+
+    original_parse_object_at = plist._ParseObjectAt
+    def _ParseObjectAt(offset):
+      if not self._Admit(plist):
+        plist.is_corrupt = True
+        return CorruptReference
+      self._level += 1
+      self.depth = max(self.depth, self._level)
+      try:
+        obj = original_parse_object_at(offset)
+      finally:
+        self._level -= 1
+      if obj.__class__ is _PendingContainer:
+        # Iterative parsers resolve containers after they've been returned
+        self._level += 1
+      return obj
+    plist._ParseObjectAt = _ParseObjectAt
+
+    if isinstance(plist, IterativeBinaryPlist):
+      original_finish_object = plist._FinishObject
+      def _FinishObject(pending):
+        self._level -= 1
+        return original_finish_object(pending)
+      plist._FinishObject = _FinishObject
+
+    # Variable sized objects are checked as soon as their length is known,
+    # before their contents are read
+    if isinstance(plist, BufferBinaryPlist):
+      budgeted_decoders = dict(plist.KNOWN_DECODERS)
+      for marker_hi, function_name in plist.KNOWN_DECODERS.items():
+        marker_name = BinaryPlist.KNOWN_MARKERS[marker_hi][0]
+        budgeted_decoders[marker_hi] = self._AddSizedMethod(
+            plist, marker_name, function_name)
+      plist.KNOWN_DECODERS = budgeted_decoders
+      sized_int_function_name = "_DecodeSizedInt"
+    else:
+      budgeted_markers = dict(plist.KNOWN_MARKERS)
+      for marker_hi, (marker_name, function_name) in (
+          plist.KNOWN_MARKERS.items()):
+        budgeted_markers[marker_hi] = (marker_name, self._AddSizedMethod(
+            plist, marker_name, function_name))
+      plist.KNOWN_MARKERS = budgeted_markers
+      sized_int_function_name = "_GetSizedIntFromFd"
+    setattr(plist, sized_int_function_name, self._CheckedSizeMethod(
+        plist, getattr(plist, sized_int_function_name)))
+
+  def AsDict(self):
+    """Returns the consumption as a dictionary, e.g. to export it as JSON."""
+    return {
+        "objects": self.objects,
+        "decoded_bytes": self.decoded_bytes,
+        "depth": self.depth,
+        "seconds": self.seconds,
+        "exceeded": sorted(self.exceeded),
+    }
+
+  def __str__(self):
+    lines = ["%-20s %10d" % (name, getattr(self, name))
+             for name in ("objects", "decoded_bytes", "depth")]
+    lines.append("%-20s %10.6fs" % ("seconds", self.seconds))
+    if self.exceeded:
+      lines.append("exceeded             %s" % ", ".join(sorted(self.exceeded)))
+    return "\n".join(lines)
+
+  def _Reset(self):
+    self.objects = 0
+    self.decoded_bytes = 0
+    self.depth = 0
+    self.seconds = 0.0
+    self.exceeded = set()
+    self._start = time.time()
+    self._exhausted = False
+    # The nesting level of the object being parsed and the size of each unit
+    # of its length
+    self._level = 0
+    self._unit_size = 1
+
+  def _Admit(self, plist):
+    """Returns whether an object can be parsed, and counts it."""
+    if self._exhausted:
+      return False
+    self.seconds = time.time() - self._start
+    if self.max_seconds is not None and self.seconds > self.max_seconds:
+      self._Exceed(plist, "max_seconds", exhausted=True)
+      return False
+    if self.max_objects is not None and self.objects >= self.max_objects:
+      self._Exceed(plist, "max_objects", exhausted=True)
+      return False
+    if self.max_depth is not None and self._level >= self.max_depth:
+      self._Exceed(plist, "max_depth")
+      return False
+    self.objects += 1
+    return True
+
+  def _Exceed(self, plist, limit, exhausted=False):
+    if limit not in self.exceeded:
+      plist._LogWarn("Parse budget %s exceeded.", limit)
+      self.exceeded.add(limit)
+    self._exhausted = self._exhausted or exhausted
+
+  def _AddSizedMethod(self, plist, marker_name, function_name):
+    """Sets a method on plist recording the unit size of objects of a type.
+
+    Returns:
+      The name of the method, or function_name for fixed sized objects.
+    """
+    unit_size = self.UNIT_SIZES.get(marker_name)
+    references_per_unit = self.REFERENCES_PER_UNIT.get(marker_name)
+    if unit_size is None and references_per_unit is None:
+      return function_name
+    method = getattr(plist, function_name)
+    def SizedMethod(*args):
+      if unit_size is None:
+        self._unit_size = references_per_unit * plist.object_ref_size
+      else:
+        self._unit_size = unit_size
+      try:
+        return method(*args)
+      except _BudgetExceeded:
+        plist.is_corrupt = True
+        return CorruptReference
+    sized_function_name = "_Sized" + function_name
+    setattr(plist, sized_function_name, SizedMethod)
+    return sized_function_name
+
+  def _CheckedSizeMethod(self, plist, method):
+    """Wraps a method reading the length of an object to check its size."""
+    def CheckedSizeMethod(*args):
+      result = method(*args)
+      # Lengths are returned along with the position by buffer parsers
+      length = result[0] if result.__class__ is tuple else result
+      size = length * self._unit_size
+      if self.max_object_size is not None and size > self.max_object_size:
+        self._Exceed(plist, "max_object_size")
+        raise _BudgetExceeded
+      if (self.max_decoded_bytes is not None and
+          self.decoded_bytes + size > self.max_decoded_bytes):
+        self._Exceed(plist, "max_decoded_bytes", exhausted=True)
+        raise _BudgetExceeded
+      self.decoded_bytes += size
+      return result
+    return CheckedSizeMethod
+
+
+class _BudgetExceeded(Exception):
+  """Raised when the object being parsed is over a ParseBudget."""
+
+
+class InternPool(object):
+  """A pool of strings shared among parsed plists.
+
+  Plists of the same kind (application bundles, launch agents, preferences...)
+  use the same dictionary keys and often the same values. Parsers sharing an
+  InternPool return dictionaries whose keys are taken from the pool, so each
+  distinct key is only kept in memory once, however many plists are parsed.
+
+    pool = InternPool(policy=InternPool.KEYS_AND_VALUES)
+    for path in paths:
+      with open(path, "rb") as fd:
+        plists[path] = BinaryPlist(fd, intern_pool=pool).Parse()
+
+  The pool holds up to max_entries strings. Once full, strings that aren't
+  pooled yet are returned as they are. Strings and unicode strings are pooled
+  separately, so interning never changes the type of a string.
+
+  Attributes:
+    max_entries: The maximum amount of strings in the pool.
+    policy: KEYS to intern dictionary keys only, KEYS_AND_VALUES to intern
+      array elements and dictionary values as well.
+    max_value_length: Values longer than this aren't interned.
+    size: The amount of strings in the pool.
+  """
+
+  KEYS = "keys"
+  KEYS_AND_VALUES = "keys_and_values"
+
+  def __init__(self, max_entries=65536, policy=KEYS, max_value_length=64):
+    if policy not in (self.KEYS, self.KEYS_AND_VALUES):
+      raise ValueError("Unknown intern policy %r." % policy)
+    self.max_entries = max_entries
+    self.policy = policy
+    self.max_value_length = max_value_length
+    self.size = 0
+    self._pools = {bytes: {}, unicode: {}}
+
+  def Intern(self, obj):
+    """Returns the pooled string equal to obj, pooling obj if there's none.
+
+    Objects other than strings are returned as they are.
+    """
+    pool = self._pools.get(obj.__class__)
+    if pool is None:
+      return obj
+    interned = pool.get(obj)
+    if interned is not None:
+      return interned
+    if self.size < self.max_entries:
+      pool[obj] = obj
+      self.size += 1
+    return obj
+
+  def InternValue(self, obj):
+    """Returns obj interned if the policy interns values and it's short."""
+    if (self.policy == self.KEYS or obj.__class__ not in self._pools or
+        len(obj) > self.max_value_length):
+      return obj
+    return self.Intern(obj)
+
+  def InternList(self, array):
+    """Interns the elements of array in place, as the policy dictates."""
+    if self.policy == self.KEYS:
+      return
+    pools = self._pools
+    max_value_length = self.max_value_length
+    for index, element in enumerate(array):
+      pool = pools.get(element.__class__)
+      if pool is not None and len(element) <= max_value_length:
+        # Pool lookups are inlined, most strings are already pooled
+        interned = pool.get(element)
+        array[index] = self.Intern(element) if interned is None else interned
+
+  def InternDict(self, the_dict):
+    """Returns a copy of the_dict with its keys, and values, interned."""
+    intern_values = self.policy != self.KEYS
+    pools = self._pools
+    max_value_length = self.max_value_length
+    interned_dict = {}
+    for key, value in _IterItems(the_dict):
+      pool = pools.get(key.__class__)
+      if pool is not None:
+        interned = pool.get(key)
+        key = self.Intern(key) if interned is None else interned
+      if intern_values:
+        pool = pools.get(value.__class__)
+        if pool is not None and len(value) <= max_value_length:
+          interned = pool.get(value)
+          value = self.Intern(value) if interned is None else interned
+      interned_dict[key] = value
+    return interned_dict
+
+  def Clear(self):
+    """Empties the pool."""
+    self._pools = {bytes: {}, unicode: {}}
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+
+class BinaryPlistWriter(object):
+  """Serializes python objects as binary plists.
+
+  Identical scalars and identical subtrees are written only once, and the
+  smallest offset and object reference sizes that fit are used. Objects are
+  encoded in memory and written to the file object all at once.
+
+  Python objects are written as:
+    NullValue, and CorruptReference or UnknownObject found by the parser: null.
+    None: fill byte.
+    bool, int, long, float and datetime: boolean, integer, real and date.
+      Naive datetimes are taken as UTC.
+    bytes: data. On python 2, str is string if it's ASCII, data otherwise.
+    unicode (str on python 3): string if it's ASCII, UTF-16 otherwise.
+    plistlib.Data, bytearray, RawValue, DataView and DataStream: data.
+    Uid: UID.
+    list, tuple and LazyList: array.
+    set and frozenset: set.
+    dict and LazyDict: dictionary.
+
+  Attributes:
+    object_ref_size: The size of object references or None to use the smallest
+      one that fits.
+    offset_int_size: The size of the offsets in the offset table or None to use
+      the smallest one that fits.
+  """
+
+  # Markers of the containers
+  ARRAY_MARKER = 0xA0
+  SET_MARKER = 0xC0
+  DICT_MARKER = 0xD0
+
+  CONTAINER_MARKERS = {
+      list: ARRAY_MARKER,
+      tuple: ARRAY_MARKER,
+      set: SET_MARKER,
+      frozenset: SET_MARKER,
+      dict: DICT_MARKER,
+  }
+
+  # Objects of these classes are looked up by value before being encoded
+  HASHABLE_SCALARS = frozenset([bytes, unicode, int, long, bool])
+  # Objects of these classes are never containers
+  SCALARS = frozenset([float, datetime.datetime, type(None), type])
+
+  def __init__(self, object_ref_size=None, offset_int_size=None):
+    self.object_ref_size = object_ref_size
+    self.offset_int_size = offset_int_size
+    # Encoded scalars (strings) or containers (marker, references tuples)
+    self._objects = []
+    # Object index by encoded scalar or container
+    self._indexes = {}
+    # Container and object index by container id
+    self._containers_by_id = {}
+    # Object index by class and value of hashable scalars
+    self._scalar_indexes = {}
+
+  def Write(self, root_object, file_obj):
+    """Writes root_object as a binary plist to file_obj.
+
+    Raises:
+      TypeError: If an object can't be written to a plist.
+      ValueError: If there's a circular reference, an integer is out of range
+        or the requested reference or offset sizes are too small.
+    """
+    file_obj.write(self.ToString(root_object))
+
+  def ToString(self, root_object):
+    """Returns root_object as a binary plist string. See Write."""
+    try:
+      top_level_index = self._FlattenObjects(root_object)
+      return self._Serialize(top_level_index)
+    finally:
+      self._objects = []
+      self._indexes = {}
+      self._containers_by_id = {}
+      self._scalar_indexes = {}
+
+  def _FlattenObjects(self, root_object):
+    """Assigns an object index to root_object and every object it contains.
+
+    Containers are walked with an explicit stack so that there's no limit to
+    their nesting. A container is added after its contents, as it's only then
+    that it can be compared to the ones already added.
+
+    Returns:
+      The object index of root_object.
+    """
+    stack = []
+    in_progress = set()
+    index = self._AddObject(root_object, stack, in_progress)
+    while stack:
+      obj, marker, items, references = stack[-1]
+      if len(references) < len(items):
+        index = self._AddObject(items[len(references)], stack, in_progress)
+        if index is not None:
+          references.append(index)
+        continue
+      stack.pop()
+      in_progress.discard(id(obj))
+      index = self._AddEncoded((marker, tuple(references)))
+      self._containers_by_id[id(obj)] = (obj, index)
+      if stack:
+        stack[-1][3].append(index)
+    return index
+
+  def _AddObject(self, obj, stack, in_progress):
+    """Adds an object.
+
+    Returns:
+      The object index or None for containers that still have to be walked,
+      which are pushed to the stack instead.
+
+    Raises:
+      ValueError: If obj contains itself.
+    """
+    cls = obj.__class__
+    if cls in self.HASHABLE_SCALARS:
+      index = self._scalar_indexes.get((cls, obj))
+      if index is None:
+        index = self._AddEncoded(self._EncodeScalar(obj))
+        self._scalar_indexes[(cls, obj)] = index
+      return index
+    if cls in self.SCALARS:
+      return self._AddEncoded(self._EncodeScalar(obj))
+    marker = self.CONTAINER_MARKERS.get(cls)
+    if marker is None:
+      marker = self._GetContainerMarker(obj)
+      if marker is None:
+        return self._AddEncoded(self._EncodeScalar(obj))
+    # Containers already written are reused before their items are read,
+    # which would parse the values of lazy containers again
+    try:
+      return self._containers_by_id[id(obj)][1]
+    except KeyError:
+      pass
+    if id(obj) in in_progress:
+      raise ValueError("Circular reference to %r." % type(obj))
+    if marker == self.DICT_MARKER:
+      items = list(obj.keys())
+      items.extend([obj[key] for key in items])
+    elif cls is list or cls is tuple:
+      items = obj
+    else:
+      items = list(obj)
+    in_progress.add(id(obj))
+    stack.append((obj, marker, items, []))
+    return None
+
+  def _GetContainerMarker(self, obj):
+    """Returns the marker of a container, or None if obj isn't one."""
+    if isinstance(obj, (dict, LazyDict)):
+      return self.DICT_MARKER
+    elif isinstance(obj, (list, tuple, LazyList)):
+      return self.ARRAY_MARKER
+    elif isinstance(obj, (set, frozenset)):
+      return self.SET_MARKER
+    return None
+
+  def _AddEncoded(self, encoded):
+    """Returns the index of an encoded object, adding it if it's new."""
+    try:
+      return self._indexes[encoded]
+    except KeyError:
+      index = len(self._objects)
+      self._objects.append(encoded)
+      self._indexes[encoded] = index
+      return index
+
+  def _EncodeScalar(self, obj):
+    """Returns the binary plist encoding of anything but a container.
+
+    Raises:
+      TypeError: If obj can't be written to a plist.
+      ValueError: If obj is an integer out of range.
+    """
+    if obj is None:
+      return b"\x0F"
+    elif obj is NullValue or obj is CorruptReference or obj is UnknownObject:
+      return b"\x00"
+    elif obj is True:
+      return b"\x09"
+    elif obj is False:
+      return b"\x08"
+    elif isinstance(obj, Uid):
+      return self._EncodeUid(obj)
+    elif isinstance(obj, (int, long)):
+      return self._EncodeInteger(obj)
+    elif isinstance(obj, float):
+      return b"\x23" + struct.pack(">d", obj)
+    elif isinstance(obj, datetime.datetime):
+      if obj.tzinfo is None:
+        obj = obj.replace(tzinfo=pytz.utc)
+      delta = obj - BinaryPlist.plist_epoch
+      seconds = (delta.days * 86400 + delta.seconds +
+                 delta.microseconds / 1000000.0)
+      return b"\x33" + struct.pack(">d", seconds)
+    elif isinstance(obj, unicode):
+      try:
+        return self._EncodeLength(0x50, len(obj)) + obj.encode("ascii")
+      except UnicodeEncodeError:
+        utf16 = obj.encode("utf-16-be")
+        return self._EncodeLength(0x60, len(utf16) // 2) + utf16
+    elif isinstance(obj, bytes):
+      if not _PY3:
+        # Python 2 strings are text as often as they're data
+        try:
+          obj.decode("ascii")
+        except UnicodeDecodeError:
+          pass
+        else:
+          return self._EncodeLength(0x50, len(obj)) + obj
+      return self._EncodeLength(0x40, len(obj)) + obj
+    elif isinstance(obj, (_PlistlibData, bytearray, RawValue, DataView,
+                          DataStream)):
+      if isinstance(obj, bytearray):
+        data = bytes(obj)
+      elif isinstance(obj, _PlistlibData):
+        data = obj.data
+      elif isinstance(obj, (DataView, DataStream)):
+        data = obj.ToBytes()
+      else:
+        data = obj.value
+      return self._EncodeLength(0x40, len(data)) + data
+    raise TypeError("Can't write %r to a plist." % type(obj))
+
+  def _EncodeInteger(self, value):
+    """Returns the binary plist encoding of an integer.
+
+    Raises:
+      ValueError: If value can't be represented in 16 bytes.
+    """
+    if value < 0:
+      if value < -(1 << 63):
+        raise ValueError("Integer %d is too small." % value)
+      # Negative integers are 8 bytes long and signed
+      return b"\x13" + struct.pack(">q", value)
+    elif value < 1 << 8:
+      return b"\x10" + struct.pack(">B", value)
+    elif value < 1 << 16:
+      return b"\x11" + struct.pack(">H", value)
+    elif value < 1 << 32:
+      return b"\x12" + struct.pack(">L", value)
+    elif value < 1 << 63:
+      return b"\x13" + struct.pack(">q", value)
+    elif value < 1 << 64:
+      return b"\x14" + struct.pack(">QQ", 0, value)
+    raise ValueError("Integer %d is too large." % value)
+
+  def _EncodeUid(self, value):
+    """Returns the binary plist encoding of a UID."""
+    uid_size = _MinimalIntegerSize(value)
+    return _BYTES[0x80 | (uid_size - 1)] + struct.pack(
+        ">%c" % BinaryPlist.bytesize_to_uchar[uid_size], value)
+
+  def _EncodeLength(self, marker, length):
+    """Returns a marker with the length of its object.
+
+    Lengths over 14 are stored as an integer after the marker.
+    """
+    if length < 0xF:
+      return _BYTES[marker | length]
+    return _BYTES[marker | 0xF] + self._EncodeInteger(length)
+
+  def _Serialize(self, top_level_index):
+    """Returns the binary plist with the objects added so far."""
+    object_count = len(self._objects)
+    object_ref_size = self._CheckIntegerSize(
+        self.object_ref_size, object_count - 1, "object_ref_size")
+    reference_char = BinaryPlist.bytesize_to_uchar[object_ref_size]
+    chunks = [b"bplist00"]
+    offsets = []
+    offset = len(chunks[0])
+    for encoded in self._objects:
+      if encoded.__class__ is tuple:
+        marker, references = encoded
+        length = len(references)
+        if marker == self.DICT_MARKER:
+          length //= 2
+        encoded = self._EncodeLength(marker, length) + struct.pack(
+            ">%d%c" % (len(references), reference_char), *references)
+      offsets.append(offset)
+      chunks.append(encoded)
+      offset += len(encoded)
+    offset_int_size = self._CheckIntegerSize(
+        self.offset_int_size, offsets[-1], "offset_int_size")
+    chunks.append(struct.pack(
+        ">%d%c" % (object_count, BinaryPlist.bytesize_to_uchar[offset_int_size]),
+        *offsets))
+    chunks.append(struct.pack(">6xBBQQQ", offset_int_size, object_ref_size,
+                              object_count, top_level_index, offset))
+    return b"".join(chunks)
+
+  def _CheckIntegerSize(self, size, value, name):
+    """Returns the requested integer size, or the minimal one if it's None.
+
+    Raises:
+      ValueError: If the requested size is too small for value.
+    """
+    minimal_size = _MinimalIntegerSize(value)
+    if size is None:
+      return minimal_size
+    if size not in BinaryPlist.bytesize_to_uchar or size < minimal_size:
+      raise ValueError("Invalid %s %d, at least %d is needed." %
+                       (name, size, minimal_size))
+    return size
+
+
+def _MinimalIntegerSize(value):
+  """Returns the smallest of 1, 2, 4 or 8 bytes that fits an unsigned value."""
+  for size in (1, 2, 4):
+    if value < 1 << (8 * size):
+      return size
+  return 8
+
+
+def _BuildIntegerTypecodes():
+  """Maps integer sizes in bytes to the array typecode used to store them.
+
+  Returns:
+    A dictionary of integer sizes to (typecode, itemsize) tuples, where
+    itemsize is the smallest array item size able to hold the integer.
+  """
+  sized_typecodes = {}
+  for unsigned, signed in [("B", "b"), ("H", "h"), ("I", "i"), ("L", "l"),
+                           ("Q", "q")]:
+    try:
+      itemsize = array.array(unsigned).itemsize
+    except ValueError:
+      # Not all python versions support long long arrays.
+      continue
+    sized_typecodes.setdefault(itemsize, (unsigned, signed))
+  typecodes = {}
+  for int_size in range(1, 9):
+    for itemsize in sorted(sized_typecodes):
+      if itemsize >= int_size:
+        unsigned, signed = sized_typecodes[itemsize]
+        # When the item is bigger than the integer its sign bit is never set.
+        # Signed items are cheaper to read back in python 2.
+        if itemsize == int_size:
+          typecodes[int_size] = (unsigned, itemsize)
+        else:
+          typecodes[int_size] = (signed, itemsize)
+        break
+  return typecodes
+
+
+_INTEGER_TYPECODES = _BuildIntegerTypecodes()
+
+
+if _PY3:
+  def _BigEndianToInteger(data):
+    """Returns the unsigned big endian integer stored in data."""
+    return int.from_bytes(data, "big")
+
+  def _ArrayFromBytes(integers, data):
+    """Appends the items stored in data, a string or bytearray, to an array."""
+    integers.frombytes(data)
+
+  def _IterItems(mapping):
+    """Returns an iterator over the items of a mapping."""
+    return iter(mapping.items())
+else:
+  def _BigEndianToInteger(data):
+    """Returns the unsigned big endian integer stored in data."""
+    integer = 0
+    for character in data:
+      integer <<= 8
+      integer |= ord(character)
+    return integer
+
+  def _ArrayFromBytes(integers, data):
+    """Appends the items stored in data, a string or bytearray, to an array."""
+    integers.fromstring(buffer(data))  # pylint: disable=undefined-variable
+
+  def _IterItems(mapping):
+    """Returns an iterator over the items of a mapping."""
+    return mapping.iteritems()
+
+
+def _DecodeAscii(data):
+  """Returns an ASCII string object as str, or as bytes if it's not ASCII."""
+  try:
+    return data.decode("ascii")
+  except UnicodeDecodeError:
+    return data
+
+
+# Each byte value as a string of length 1
+_BYTES = [struct.pack(">B", byte) for byte in range(256)]
+# Reads single bytes, such as markers, from any buffer without slicing it
+_BYTE_STRUCT = struct.Struct(">B")
+
+# plistlib.Data is gone in python 3, which uses bytes instead. Writing and
+# exporting check bytes first, so this never matches them.
+_PlistlibData = getattr(plistlib, "Data", bytes)
+
+
+def _Bytes(data):
+  """Returns a buffer slice as a string, copying it if it's a memoryview."""
+  if isinstance(data, memoryview):
+    return data.tobytes()
+  return data
+
+
+def _MakeUid(value):
+  """Returns value as a Uid, or as is if it's too large for one."""
+  try:
+    return Uid(value)
+  except OverflowError:
+    return value
+
+
+def _UnpackIntegers(data, int_size):
+  """Decodes a run of unsigned big endian integers in bulk.
+
+  Integers of 1, 2, 4 and 8 bytes are loaded straight into an array. Other
+  sizes (3, 5, 6 and 7 bytes) are first padded to the next array item size,
+  one byte column at a time, so no per-integer work happens in python.
+
+  Args:
+    data: A string with the integers.
+    int_size: The size of each integer in bytes.
+
+  Returns:
+    An array with one integer for each full int_size bytes in data. If no
+    array type is big enough for the integers, a list is returned instead.
+  """
+  count = len(data) // int_size
+  data_size = count * int_size
+  try:
+    typecode, itemsize = _INTEGER_TYPECODES[int_size]
+  except KeyError:
+    return [_BigEndianToInteger(data[position:position + int_size])
+            for position in range(0, data_size, int_size)]
+  integers = array.array(typecode)
+  if itemsize == int_size:
+    _ArrayFromBytes(integers, data[:data_size])
+  else:
+    padded = bytearray(count * itemsize)
+    padding = itemsize - int_size
+    for byte_index in range(int_size):
+      padded[padding + byte_index::itemsize] = (
+          data[byte_index:data_size:int_size])
+    _ArrayFromBytes(integers, padded)
+  if itemsize > 1 and sys.byteorder == "little":
+    integers.byteswap()
+  return integers
+
+
+# Named readPlist so that binplist resembles the plistlib standard python module
+def readPlist(pathOrFile, data_stream_size=None):
+  """Returns the top level object of the plist at pathOrFile.
+
+  Args:
+    pathOrFile: A path or a file-like object to the plist.
+    data_stream_size: Return binary plist data objects of this size or bigger
+      as DataStream objects. File-like objects must then stay open while
+      they're in use.
+
+  Returns:
+    The top level object of the plist.
+
+  Raises:
+    FormatError: When the given file is not a binary plist or its version
+    is unknown.
+  """
+  try:
+    # See if it's a file-like object.
+    bplist_start_offset = pathOrFile.tell()
+    file_obj = pathOrFile
+  except AttributeError:
+    # Must be a path then
+    file_obj = open(pathOrFile, "rb")
+    bplist_start_offset = file_obj.tell()
+
+  magicversion = file_obj.read(8)
+  if magicversion.startswith(b"bplist15"):
+    logging.info("Binary plist version 1.5 found. Please, inform %s.",
+                 __feedback_email__)
+    raise FormatError("Binary plist version 1.5 found. Not supported yet.")
+
+  try:
+    file_obj.seek(bplist_start_offset)
+    bplist = BinaryPlist(file_obj, data_stream_size=data_stream_size)
+    return bplist.Parse()
+  except FormatError:
+    try:
+      file_obj.seek(bplist_start_offset)
+      return readXmlPlist(file_obj)
+    except xml.parsers.expat.ExpatError:
+      raise FormatError("Invalid plist file.")
+
+
+def readPlistFromString(data):
+  """Returns the top level object of the plist held in data.
+
+  Binary plists are parsed from memory with BufferBinaryPlist.
+
+  Args:
+    data: A string, memoryview or mmap object holding the plist.
+
+  Returns:
+    The top level object of the plist.
+
+  Raises:
+    FormatError: When data is not a plist or its version is unknown.
+  """
+  return _ReadPlistFromBuffer(data)
+
+
+def readPlistMapped(pathOrFile, data_views=False):
+  """Returns the top level object of the plist at pathOrFile.
+
+  The file is memory mapped and parsed with BufferBinaryPlist. File-like
+  objects must be backed by a real file (have a fileno() method) and are
+  parsed from their current position, just as with readPlist.
+
+  Args:
+    pathOrFile: A path or a file object to the plist.
+    data_views: Return data objects as DataView objects. The file stays mapped
+      until none of them is referenced any more.
+
+  Returns:
+    The top level object of the plist.
+
+  Raises:
+    FormatError: When the given file is not a plist or its version is unknown.
+  """
+  try:
+    # See if it's a file-like object.
+    bplist_start_offset = pathOrFile.tell()
+    file_obj = pathOrFile
+  except AttributeError:
+    # Must be a path then
+    file_obj = open(pathOrFile, "rb")
+    bplist_start_offset = 0
+
+  try:
+    if not os.fstat(file_obj.fileno()).st_size:
+      # Empty files can't be mapped.
+      return _ReadPlistFromBuffer(b"")
+    mapped_file = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+    if data_views:
+      # The data views hold the only references to the mapping
+      return _ReadPlistFromBuffer(mapped_file, bplist_start_offset,
+                                  data_views=True)
+    try:
+      return _ReadPlistFromBuffer(mapped_file, bplist_start_offset)
+    finally:
+      mapped_file.close()
+  finally:
+    if file_obj is not pathOrFile:
+      file_obj.close()
+
+
+def _ReadPlistFromBuffer(data, offset=0, data_views=False):
+  """Returns the top level object of the plist at the given offset of data."""
+  if _Bytes(data[offset:offset + 8]).startswith(b"bplist15"):
+    logging.info("Binary plist version 1.5 found. Please, inform %s.",
+                 __feedback_email__)
+    raise FormatError("Binary plist version 1.5 found. Not supported yet.")
+
+  try:
+    bplist = BufferBinaryPlist(data, offset=offset, data_views=data_views)
+    return bplist.Parse()
+  except FormatError:
+    try:
+      return readXmlPlist(io.BytesIO(_Bytes(data[offset:])))
+    except xml.parsers.expat.ExpatError:
+      raise FormatError("Invalid plist file.")
+
+
+def readXmlPlist(file_obj):
+  """Returns the top level object of the XML plist read from file_obj.
+
+  This is the fallback readPlist uses when a file is not a binary plist.
+
+  Args:
+    file_obj: A binary file-like object positioned at the start of the plist.
+
+  Returns:
+    The top level object of the plist.
+
+  Raises:
+    xml.parsers.expat.ExpatError: When it's not an XML plist.
+  """
+  if _PY3:
+    return plistlib.load(file_obj, fmt=plistlib.FMT_XML)
+  return plistlib.readPlist(file_obj)
+
+
+def query(pathOrFile, path):
+  """Returns the object at path in the plist at pathOrFile.
+
+  For binary plists, only the header, the trailer, the offset table and the
+  objects along path are parsed. Dictionary keys are compared as they're
+  parsed and the values that don't match are never parsed. XML plists are
+  parsed in full.
+
+  Paths start with "root", which is the top level object, followed by any
+  number of dictionary keys (".key" or "['key']", the latter allowing any
+  character but the quote) and array indexes ("[3]" or "[-1]").
+
+    query("Info.plist", "root.CFBundleDocumentTypes[0].CFBundleTypeName")
+
+  To extract several paths from the same binary plist, use
+  LazyBinaryPlist.Query instead.
+
+  Args:
+    pathOrFile: A path or a file-like object to the plist.
+    path: The path to the object.
+
+  Returns:
+    The object at path, fully parsed.
+
+  Raises:
+    FormatError: When the given file is not a plist.
+    KeyError: When a dictionary key in path doesn't exist.
+    IndexError: When an array index in path doesn't exist.
+    ValueError: When path is malformed.
+  """
+  tokens = _ParsePlistPath(path)
+  try:
+    # See if it's a file-like object.
+    bplist_start_offset = pathOrFile.tell()
+    file_obj = pathOrFile
+  except AttributeError:
+    # Must be a path then
+    file_obj = open(pathOrFile, "rb")
+    bplist_start_offset = 0
+
+  try:
+    try:
+      top_level_object = LazyBinaryPlist(file_obj).Parse()
+    except FormatError:
+      try:
+        file_obj.seek(bplist_start_offset)
+        top_level_object = readXmlPlist(file_obj)
+      except xml.parsers.expat.ExpatError:
+        raise FormatError("Invalid plist file.")
+    return _WalkPlistPath(top_level_object, tokens, path)
+  finally:
+    if file_obj is not pathOrFile:
+      file_obj.close()
+
+
+# Matches each of the steps in a path after "root"
+_PLIST_PATH_STEP = re.compile(r"""
+    \.(?P<key>[^.\[\]]+) |
+    \[(?P<index>-?\d+)\] |
+    \[(?P<quote>["'])(?P<quoted_key>.*?)(?P=quote)\]
+    """, re.VERBOSE)
+
+
+def _ParsePlistPath(path):
+  """Splits a path into dictionary keys and array indexes.
+
+  Args:
+    path: A path, as described at query().
+
+  Returns:
+    A list with a string for each dictionary key and an integer for each array
+    index in path.
+
+  Raises:
+    ValueError: When path is malformed.
+  """
+  if not path.startswith("root"):
+    raise ValueError("Path %s doesn't start with 'root'." % path)
+  tokens = []
+  position = len("root")
+  while position < len(path):
+    step = _PLIST_PATH_STEP.match(path, position)
+    if not step:
+      raise ValueError("Invalid path %s at position %d." % (path, position))
+    if step.group("index") is not None:
+      tokens.append(int(step.group("index")))
+    elif step.group("key") is not None:
+      tokens.append(step.group("key"))
+    else:
+      tokens.append(step.group("quoted_key"))
+    position = step.end()
+  return tokens
+
+
+def _WalkPlistPath(obj, tokens, path):
+  """Returns the object reached by following tokens from obj.
+
+  Args:
+    obj: The object to start from.
+    tokens: A list of dictionary keys and array indexes.
+    path: The path tokens come from, for error reporting.
+
+  Returns:
+    The object at the end of the path, fully parsed.
+
+  Raises:
+    KeyError: When a dictionary key doesn't exist.
+    IndexError: When an array index doesn't exist.
+  """
+  for token in tokens:
+    if isinstance(obj, (dict, LazyDict)):
+      if token not in obj:
+        raise KeyError("%r not found while looking for %s." % (token, path))
+      obj = obj[token]
+    elif isinstance(obj, (list, LazyList)) and isinstance(token, int):
+      try:
+        obj = obj[token]
+      except IndexError:
+        raise IndexError("Index %d out of range while looking for %s." %
+                         (token, path))
+    else:
+      raise KeyError("%r not found while looking for %s." % (token, path))
+  if isinstance(obj, (LazyList, LazyDict)):
+    return obj.Materialize()
+  return obj
+
+
+def writePlist(rootObject, pathOrFile):
+  """Writes rootObject as a binary plist to pathOrFile.
+
+  See BinaryPlistWriter for how python objects are written.
+
+  Args:
+    rootObject: The top level object of the plist.
+    pathOrFile: A path or a file-like object to write the plist to.
+
+  Raises:
+    TypeError: If an object can't be written to a plist.
+    ValueError: If there's a circular reference or an integer is out of range.
+  """
+  data = writePlistToString(rootObject)
+  if hasattr(pathOrFile, "write"):
+    pathOrFile.write(data)
+  else:
+    with open(pathOrFile, "wb") as file_obj:
+      file_obj.write(data)
+
+
+def writePlistToString(rootObject):
+  """Returns rootObject as a binary plist string. See writePlist."""
+  return BinaryPlistWriter().ToString(rootObject)
+
+
+def ToDebugString(string):
+  try:
+    return str(string)
+  except UnicodeEncodeError:
+    return unicode(string).encode('unicode_escape')
+
+
+
+def PlistToUnicode(o, string_encoding='safeascii', encoding_options="strict",
+                   indent=4, previous_indent=0):
+  """Returns the Unicode representation of a plist object.
+
+  This is mostly just to handle displaying unicode keys or values in
+  dictionaries as the default dict implementation escapes them, and to try to
+  represent byte strings in a more human-readable form.
+
+  See IterPlistToUnicode.
+  """
+  return u"".join(IterPlistToUnicode(o, string_encoding=string_encoding,
+                                     encoding_options=encoding_options,
+                                     indent=indent,
+                                     previous_indent=previous_indent))
+
+
+def IterPlistToUnicode(o, string_encoding='safeascii',
+                       encoding_options="strict", indent=4, previous_indent=0):
+  """Yields the Unicode representation of a plist object in chunks.
+
+  Joined, the chunks are the output of PlistToUnicode. Containers are walked
+  with an explicit stack, so there's no limit to their nesting, and nothing
+  is rendered twice.
+
+  Args:
+    o: A plist object.
+    string_encoding: The encoding of byte strings, or "safeascii" to escape
+      their non printable characters.
+    encoding_options: The error handling scheme to decode byte strings with.
+    indent: The amount of spaces each dictionary level is indented with.
+    previous_indent: The indentation of o.
+
+  Yields:
+    Unicode strings with consecutive pieces of the representation.
+  """
+  # Each frame has an iterator over a container, the separator and closing
+  # bracket of the container, whether the next item is the first one, whether
+  # it's a dictionary and the indentation of the items. Array items have the
+  # indentation of the array.
+  stack = []
+  # Brackets, separators and keys are yielded along with the next value
+  prefix = u""
+  str_to_unicode = _StrToUnicode
+  while True:
+    if isinstance(o, bytes):
+      yield prefix + str_to_unicode(o, string_encoding, encoding_options)
+    elif isinstance(o, unicode):
+      # Return a quote-enclosed string
+      yield u"%s'%s'" % (prefix, o)
+    elif isinstance(o, dict) or o.__class__ is LazyDict:
+      # LazyDict is checked by class as checking abstract classes is slow
+      if not len(o):
+        yield prefix + u"{}"
+      else:
+        level = previous_indent + indent
+        opening_bracket, separator, _ = _GetIndentation(level)
+        yield prefix + opening_bracket
+        stack.append([_IterItems(o), separator,
+                      _GetIndentation(previous_indent)[2], True, True, level])
+    elif o.__class__ is DataView or o.__class__ is DataStream:
+      yield prefix + str_to_unicode(o.ToBytes(), string_encoding,
+                                    encoding_options)
+    elif o is NullValue:
+      yield prefix + u"NULL"
+    elif o is CorruptReference:
+      yield prefix + u"##CORRUPT_REFERENCE##"
+    elif o is UnknownObject:
+      yield prefix + u"##UNKNOWN_OBJECT##"
+    else:
+      try:
+        items = iter(o)
+      except TypeError:
+        yield prefix + unicode(o)
+      else:
+        yield prefix + u"["
+        stack.append([items, u", ", u"]", True, False, previous_indent])
+
+    prefix = u""
+    while stack:
+      frame = stack[-1]
+      try:
+        item = next(frame[0])
+      except StopIteration:
+        stack.pop()
+        prefix += frame[2]
+        continue
+      if frame[3]:
+        frame[3] = False
+      else:
+        prefix += frame[1]
+      previous_indent = frame[5]
+      if not frame[4]:
+        # An array element
+        o = item
+        break
+      # A dictionary item
+      key, o = item
+      if isinstance(key, bytes):
+        prefix += str_to_unicode(key, string_encoding, encoding_options)
+      elif isinstance(key, unicode):
+        prefix += u"'%s'" % key
+      else:
+        prefix += u"".join(IterPlistToUnicode(
+            key, string_encoding=string_encoding,
+            encoding_options=encoding_options, indent=indent,
+            previous_indent=previous_indent))
+      prefix += u": "
+      break
+    else:
+      if prefix:
+        yield prefix
+      return
+
+
+def WritePlistToUnicode(o, file_obj, encoding="utf-8", errors="strict",
+                        string_encoding='safeascii', encoding_options="strict",
+                        indent=4, buffer_size=65536):
+  """Writes the Unicode representation of a plist object to file_obj.
+
+  See IterPlistToUnicode. The representation is encoded with encoding and
+  written in batches of about buffer_size characters, so that the whole
+  document is never held in memory.
+
+  Args:
+    o: A plist object.
+    file_obj: A file-like object to write the representation to.
+    encoding: The encoding of the output.
+    errors: The error handling scheme to encode the output with.
+    string_encoding: See IterPlistToUnicode.
+    encoding_options: See IterPlistToUnicode.
+    indent: See IterPlistToUnicode.
+    buffer_size: The amount of characters to encode and write at once.
+  """
+  encoder = codecs.getincrementalencoder(encoding)(errors)
+  pending = []
+  pending_size = 0
+  for chunk in IterPlistToUnicode(o, string_encoding=string_encoding,
+                                  encoding_options=encoding_options,
+                                  indent=indent):
+    pending.append(chunk)
+    pending_size += len(chunk)
+    if pending_size >= buffer_size:
+      file_obj.write(encoder.encode(u"".join(pending)))
+      pending = []
+      pending_size = 0
+  file_obj.write(encoder.encode(u"".join(pending), True))
+
+
+# Dictionary delimiters by indentation level
+_INDENTATIONS = {}
+
+
+def _GetIndentation(level):
+  """Returns the dictionary delimiters of an indentation level.
+
+  Returns:
+    A tuple with the opening bracket and separator of the items indented by
+    level, and the closing bracket of a dictionary indented by level.
+  """
+  try:
+    return _INDENTATIONS[level]
+  except KeyError:
+    spaces = u" " * level
+    _INDENTATIONS[level] = (u"{\n%s" % spaces, u",\n%s" % spaces,
+                            u"\n%s}" % spaces)
+    return _INDENTATIONS[level]
+
+
+def _StrToUnicode(o, string_encoding, encoding_options):
+  """Returns the quote-enclosed Unicode representation of a byte string."""
+  try:
+    if string_encoding == "safeascii":
+      return u"'%s'" % _SafeAsciiEscape(o).decode("ascii", "strict")
+    return u"'%s'" % o.decode(string_encoding, encoding_options)
+  except (UnicodeEncodeError, UnicodeDecodeError):
+    return u"'%s'" % _HexEscape(o)
+
+
+# The bytes that aren't escaped in the safeascii representation
+_PRINTABLE = string.printable.encode("ascii")
+
+# The safeascii representation of each byte
+_SAFEASCII_ESCAPES = [_BYTES[byte] if _BYTES[byte] in _PRINTABLE
+                      else ("\\x%02x" % byte).encode("ascii")
+                      for byte in range(256)]
+
+# Amount of bytes escaped at once, to bound the memory used by large strings
+_ESCAPE_CHUNK_SIZE = 1 << 20
+
+
+def _SafeAsciiEscape(data):
+  """Returns data with its non printable bytes escaped as \\xNN."""
+  if not data.translate(None, _PRINTABLE):
+    # Nothing to escape
+    return data
+  escapes = _SAFEASCII_ESCAPES.__getitem__
+  return b"".join([
+      b"".join(map(escapes, bytearray(data[start:start + _ESCAPE_CHUNK_SIZE])))
+      for start in range(0, len(data), _ESCAPE_CHUNK_SIZE)])
+
+
+def _HexEscape(data):
+  """Returns every byte of data escaped as \\xNN."""
+  hex_data = binascii.hexlify(data)
+  escaped = bytearray(2 * len(hex_data))
+  escaped[0::4] = b"\\" * len(data)
+  escaped[1::4] = b"x" * len(data)
+  escaped[2::4] = hex_data[0::2]
+  escaped[3::4] = hex_data[1::2]
+  return str(escaped.decode("ascii"))
+
+
+def IterPlistToJson(o):
+  """Yields the JSON representation of a plist object in chunks.
+
+  The output is ASCII only. Containers are walked with an explicit stack, so
+  there's no limit to their nesting. Objects that have no JSON counterpart are
+  represented as follows:
+    datetime: An ISO 8601 string in UTC, such as "2013-05-06T07:08:09Z".
+    Data, bytearray and, on python 2, strings that aren't valid UTF-8:
+      {"$data": base64}. On python 3, bytes are always data.
+      DataView and DataStream objects are represented as the strings they
+      stand for, which are read in full.
+    RawValue: {"$raw": base64}.
+    Uid: {"$uid": integer}.
+    NullValue and fill bytes (None): null.
+    CorruptReference: {"$corrupt": "reference"}.
+    UnknownObject: {"$corrupt": "unknown"}.
+    NaN and infinite reals: "NaN", "Infinity" and "-Infinity".
+  Dictionary keys that aren't strings are converted to the string of their
+  JSON representation.
+
+  Args:
+    o: A plist object, as returned by the parser.
+
+  Yields:
+    Strings with consecutive pieces of the JSON representation.
+  """
+  # Each frame has an iterator over the container, its closing bracket and
+  # whether the next item is the first one.
+  stack = []
+  while True:
+    if isinstance(o, (dict, LazyDict)):
+      yield "{"
+      stack.append([_IterItems(o), "}", True])
+    elif isinstance(o, (list, LazyList)):
+      yield "["
+      stack.append([iter(o), "]", True])
+    else:
+      yield _JsonScalar(o)
+
+    while stack:
+      frame = stack[-1]
+      items, closing_bracket, first = frame
+      try:
+        item = next(items)
+      except StopIteration:
+        stack.pop()
+        yield closing_bracket
+        continue
+      frame[2] = False
+      separator = "" if first else ", "
+      if closing_bracket == "}":
+        key, o = item
+        yield "%s%s: " % (separator, _JsonKey(key))
+      else:
+        o = item
+        if separator:
+          yield separator
+      break
+    else:
+      return
+
+
+def WritePlistToJson(o, file_obj, buffer_size=65536):
+  """Writes the JSON representation of a plist object to file_obj.
+
+  See IterPlistToJson. Chunks are written in batches of about buffer_size
+  bytes, so that the whole document is never held in memory. On python 3,
+  file_obj must be a text file.
+  """
+  pending = []
+  pending_size = 0
+  for chunk in IterPlistToJson(o):
+    pending.append(chunk)
+    pending_size += len(chunk)
+    if pending_size >= buffer_size:
+      file_obj.write("".join(pending))
+      pending = []
+      pending_size = 0
+  file_obj.write("".join(pending))
+
+
+def WritePlistToNdjson(o, file_obj, buffer_size=65536):
+  """Writes a plist object as newline delimited JSON to file_obj.
+
+  Each element of a top level array is written as a JSON document in its own
+  line. Any other top level object is written as a single line.
+  """
+  records = o if isinstance(o, (list, LazyList)) else [o]
+  for record in records:
+    WritePlistToJson(record, file_obj, buffer_size=buffer_size)
+    file_obj.write("\n")
+
+
+def _JsonKey(key):
+  """Returns the JSON representation of a key, which is always a string."""
+  representation = _JsonScalar(key)
+  if representation.startswith('"'):
+    return representation
+  return json.encoder.encode_basestring_ascii(representation)
+
+
+def _JsonScalar(o):
+  """Returns the JSON representation of anything but a container."""
+  if o is None or o is NullValue:
+    return "null"
+  elif o is True:
+    return "true"
+  elif o is False:
+    return "false"
+  elif isinstance(o, Uid):
+    return '{"$uid": %d}' % o
+  elif isinstance(o, (int, long)):
+    return str(o)
+  elif isinstance(o, float):
+    if math.isnan(o):
+      return '"NaN"'
+    elif math.isinf(o):
+      return '"Infinity"' if o > 0 else '"-Infinity"'
+    return repr(o)
+  elif isinstance(o, unicode):
+    return json.encoder.encode_basestring_ascii(o)
+  elif isinstance(o, bytes):
+    if not _PY3:
+      try:
+        return json.encoder.encode_basestring_ascii(o)
+      except UnicodeDecodeError:
+        pass
+    return '{"$data": "%s"}' % _Base64(o)
+  elif isinstance(o, datetime.datetime):
+    if o.tzinfo is not None:
+      o = o.astimezone(pytz.utc).replace(tzinfo=None)
+    return '"%sZ"' % o.isoformat()
+  elif isinstance(o, (DataView, DataStream)):
+    return _JsonScalar(o.ToBytes())
+  elif isinstance(o, RawValue):
+    return '{"$raw": "%s"}' % _Base64(o.value)
+  elif isinstance(o, _PlistlibData):
+    return '{"$data": "%s"}' % _Base64(o.data)
+  elif isinstance(o, bytearray):
+    return '{"$data": "%s"}' % _Base64(bytes(o))
+  elif o is CorruptReference:
+    return '{"$corrupt": "reference"}'
+  elif o is UnknownObject:
+    return '{"$corrupt": "unknown"}'
+  return json.encoder.encode_basestring_ascii(unicode(o))
+
+
+def _Base64(data):
+  """Returns data encoded as base64, as a native string."""
+  return str(base64.b64encode(data).decode("ascii"))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caches parsed plists in memory, for plists that are read over and over.
+
+  from binplist import cache
+  preferences = cache.readPlist("/Library/Preferences/com.apple.foo.plist")
+
+readPlist works as binplist.readPlist, but it only parses a plist the first
+time it's read. Plists read by path are identified by their device, inode,
+size and modification time, so a modified file is parsed again. Plists read
+from file objects are identified by a hash of their contents.
+
+Parsed plists are kept pickled, which makes every read return a fresh copy of
+the plist. Callers can modify what they get without affecting the cache, and
+unpickling is much faster than parsing. The size of the pickle is used as the
+memory footprint of each entry. PlistCache objects hold their own entries and
+limits; readPlist uses DEFAULT_CACHE.
+"""
+
+import collections
+import hashlib
+import os
+import threading
+
+try:
+  import cPickle as pickle
+except ImportError:
+  # Python 3
+  import pickle
+
+from . import binplist
+
+
+class PlistCache(object):
+  """A least recently used cache of parsed plists.
+
+  Attributes:
+    max_entries: The maximum amount of plists cached.
+    max_bytes: The maximum size of the cached plists, pickled. Plists bigger
+      than this aren't cached.
+    hits: Reads served from the cache.
+    misses: Reads that had to parse the plist.
+    evictions: Plists removed from the cache to make room for others.
+    size: The size of the cached plists, pickled.
+  """
+
+  def __init__(self, max_entries=256, max_bytes=64 << 20):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.size = 0
+    # Pickled plists by key, least recently used first
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def ReadPlist(self, pathOrFile):
+    """Returns a copy of the top level object of the plist at pathOrFile.
+
+    Args:
+      pathOrFile: A path or a file-like object to the plist. File-like objects
+        are read from their current position to the end.
+
+    Returns:
+      The top level object of the plist.
+
+    Raises:
+      binplist.FormatError: When the given file is not a plist or its version
+      is unknown.
+    """
+    try:
+      read = pathOrFile.read
+    except AttributeError:
+      # Must be a path then
+      with open(pathOrFile, "rb") as file_obj:
+        file_stat = os.fstat(file_obj.fileno())
+        key = ("file", file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+               file_stat.st_mtime)
+        return self._Get(key, file_obj.read)
+    data = read()
+    return self._Get(("sha1", hashlib.sha1(data).digest()), lambda: data)
+
+  def Clear(self):
+    """Removes all the cached plists."""
+    with self._lock:
+      self._entries.clear()
+      self.size = 0
+
+  def AsDict(self):
+    """Returns the cache statistics as a dictionary."""
+    with self._lock:
+      return {
+          "hits": self.hits,
+          "misses": self.misses,
+          "evictions": self.evictions,
+          "entries": len(self._entries),
+          "size": self.size,
+      }
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _Get(self, key, read):
+    """Returns the plist cached with key, parsing it on a miss.
+
+    Args:
+      key: The key of the plist.
+      read: A function returning the plist data.
+    """
+    with self._lock:
+      pickled = self._entries.pop(key, None)
+      if pickled is not None:
+        # Most recently used now
+        self._entries[key] = pickled
+        self.hits += 1
+      else:
+        self.misses += 1
+    if pickled is not None:
+      return pickle.loads(pickled)
+
+    top_level_object = binplist.readPlistFromString(read())
+    pickled = pickle.dumps(top_level_object, pickle.HIGHEST_PROTOCOL)
+    if len(pickled) <= self.max_bytes:
+      self._Add(key, pickled)
+    return top_level_object
+
+  def _Add(self, key, pickled):
+    with self._lock:
+      previous = self._entries.pop(key, None)
+      if previous is not None:
+        # Parsed by another thread meanwhile
+        self.size -= len(previous)
+      self._entries[key] = pickled
+      self.size += len(pickled)
+      while (len(self._entries) > self.max_entries or
+             self.size > self.max_bytes):
+        _, evicted = self._entries.popitem(last=False)
+        self.size -= len(evicted)
+        self.evictions += 1
+
+
+DEFAULT_CACHE = PlistCache()
+
+
+def readPlist(pathOrFile):
+  """Returns the top level object of the plist at pathOrFile, cached.
+
+  See PlistCache.ReadPlist. The plist is cached in DEFAULT_CACHE.
+  """
+  return DEFAULT_CACHE.ReadPlist(pathOrFile)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Carves binary plists out of disk images, memory dumps and other blobs.
+
+Binary plists don't store their length, so carving one takes two steps. The
+input is searched for the "bplist00" magic and, for each hit, the data that
+follows is searched for a trailer whose offset table ends right before it.
+The region between the magic and the end of the trailer is then parsed.
+
+  for carved_plist in CarvePlists("memory.dmp"):
+    print(carved_plist.offset, carved_plist.length, carved_plist.is_corrupt)
+
+The input is memory mapped in windows, which are searched in parallel by a
+pool of processes. Windows overlap so that no magic is missed at their
+boundaries, and the search for a trailer can go past the end of a window.
+"""
+
+import collections
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+
+from . import binplist
+
+
+MAGIC = b"bplist00"
+
+# A plist found by CarvePlists
+CarvedPlist = collections.namedtuple(
+    "CarvedPlist", ["offset", "length", "is_corrupt", "top_level_object"])
+
+# The trailer struct and the start of the trailers Apple writes: 5 unused
+# bytes and the sort version, all zeros, followed by the offset and object
+# reference sizes.
+_TRAILER_STRUCT = struct.Struct(">6xBBQQQ")
+_TRAILER_START = re.compile(br"\x00{6}[\x01\x02\x04\x08][\x01\x02\x04\x08]")
+
+
+def CarvePlists(path, jobs=None, window_size=64 << 20,
+                max_plist_size=16 << 20):
+  """Yields the binary plists found in a file.
+
+  Args:
+    path: The path of the file to carve.
+    jobs: The amount of processes searching the file. Defaults to one per
+      CPU. With 1, the file is searched in this process.
+    window_size: The amount of bytes each process searches at a time.
+    max_plist_size: The size of the largest plist to look for. Trailers are
+      only searched this far from the magic.
+
+  Yields:
+    A CarvedPlist for each plist found, ordered by offset. Plists embedded in
+    other plists are found too.
+  """
+  file_size = os.path.getsize(path)
+  windows = [(path, start, min(start + window_size, file_size),
+              max_plist_size)
+             for start in range(0, file_size, window_size)]
+  if jobs == 1:
+    results = (_CarveWindow(window) for window in windows)
+  else:
+    pool = multiprocessing.Pool(jobs)
+    results = pool.imap(_CarveWindow, windows)
+  try:
+    for carved_plists in results:
+      for carved_plist in carved_plists:
+        yield carved_plist
+  finally:
+    if jobs != 1:
+      pool.terminate()
+
+
+def CarvePlistAt(data, offset, max_plist_size=16 << 20):
+  """Carves the plist whose magic is at offset in data.
+
+  Args:
+    data: A string or mmap object.
+    offset: The offset of the magic in data.
+    max_plist_size: The size of the largest plist to look for.
+
+  Returns:
+    A CarvedPlist or None if no plist could be parsed at offset.
+  """
+  end = min(len(data), offset + max_plist_size)
+  for match in _TRAILER_START.finditer(data, offset + len(MAGIC), end):
+    trailer_end = match.start() + _TRAILER_STRUCT.size
+    if trailer_end > end:
+      break
+    (offset_int_size, _, object_count, top_level_index,
+     offtable_offset) = _TRAILER_STRUCT.unpack(data[match.start():trailer_end])
+    # The offset table must come right before the trailer
+    if (not object_count or top_level_index >= object_count or
+        offtable_offset < len(MAGIC) or
+        offtable_offset + object_count * offset_int_size !=
+        match.start() - offset):
+      continue
+    plist = binplist.IterativeBufferBinaryPlist(data[offset:trailer_end])
+    try:
+      top_level_object = plist.Parse()
+    except Exception:  # pylint: disable=broad-except
+      # Not a plist after all, or too corrupt to be parsed. Candidates are
+      # arbitrary bytes, which the parser can reject with FormatError, IOError,
+      # struct.error, ValueError or OverflowError, and none of them may stop
+      # the carving of the rest of the file.
+      continue
+    return CarvedPlist(offset, trailer_end - offset, plist.is_corrupt,
+                       top_level_object)
+  return None
+
+
+def _CarveWindow(window):
+  """Carves the plists whose magic starts within a window of a file.
+
+  Args:
+    window: A tuple with the path of the file, the offsets where the window
+      starts and ends, and the size of the largest plist to look for.
+
+  Returns:
+    A list of CarvedPlist, ordered by offset.
+  """
+  path, start, end, max_plist_size = window
+  carved_plists = []
+  with open(path, "rb") as file_obj:
+    file_size = os.fstat(file_obj.fileno()).st_size
+    # A magic starting at the end of the window ends in the next one
+    scan_data, scan_start = _MapRegion(
+        file_obj, start, min(end + len(MAGIC) - 1, file_size))
+    try:
+      position = scan_data.find(MAGIC, start - scan_start)
+      while position != -1 and position + scan_start < end:
+        offset = position + scan_start
+        plist_data, plist_start = _MapRegion(
+            file_obj, offset, min(offset + max_plist_size, file_size))
+        try:
+          carved_plist = CarvePlistAt(plist_data, offset - plist_start,
+                                      max_plist_size)
+        finally:
+          plist_data.close()
+        if carved_plist:
+          carved_plists.append(carved_plist._replace(offset=offset))
+        position = scan_data.find(MAGIC, position + 1)
+    finally:
+      scan_data.close()
+  return carved_plists
+
+
+def _MapRegion(file_obj, start, end):
+  """Maps a region of a file in memory.
+
+  Mappings have to start at a multiple of the allocation granularity, so the
+  mapping can start before the region.
+
+  Returns:
+    A tuple with the mmap object and the file offset it starts at.
+  """
+  mapping_start = start - start % mmap.ALLOCATIONGRANULARITY
+  return (mmap.mmap(file_obj.fileno(), end - mapping_start,
+                    access=mmap.ACCESS_READ, offset=mapping_start),
+          mapping_start)
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decodes NSKeyedArchiver archives.
+
+Keyed archives are plists whose objects live in a flat "$objects" array and
+reference each other by UID. The roots are in the "$top" dictionary and each
+archived object points to a class description through its "$class" UID.
+
+  top = readKeyedArchive("myfile.plist")
+  print(top["root"])
+
+UIDs are replaced by the objects they reference, decoded. Each object is
+decoded only once, so objects referenced from several places are shared, and
+objects that reference themselves produce circular Python structures, just
+as NSKeyedUnarchiver would. Arrays, sets and dictionaries are decoded without
+recursion, so deeply nested archives are fine.
+
+Objects of the classes in CLASS_DECODERS become native types: NSArray and
+NSSet become lists, NSDictionary becomes a dictionary, NSString a string,
+NSData bytes, NSDate a datetime and NSNull None. Archives parsed with data
+views or data streams give the binplist.DataView or binplist.DataStream of
+NSData objects instead of bytes. Objects of any other class become an
+ArchivedObject with their fields decoded. Subclasses of known classes, as
+listed in the "$classes" of their class description, are decoded as their
+closest known superclass.
+
+With lazy=True, arrays and dictionaries are returned as binplist.LazyList and
+binplist.LazyDict proxies that only decode what's accessed.
+readKeyedArchive(..., lazy=True) also parses the plist with
+LazyBufferBinaryPlist, so looking up a few objects in a big archive doesn't
+parse the rest of it.
+"""
+
+import datetime
+import logging
+import math
+import numbers
+
+from . import binplist
+
+
+NULL = "$null"
+
+
+def DecodeArray(archive, fields):
+  """Decodes NSArray, NSSet and NSOrderedSet objects into lists.
+
+  KeyedArchive handles this decoder itself, without recursion.
+  """
+  return [archive.Resolve(value) for value in fields["NS.objects"]]
+
+
+def DecodeDictionary(archive, fields):
+  """Decodes NSDictionary objects into dictionaries.
+
+  KeyedArchive handles this decoder itself, without recursion.
+  """
+  return dict((archive.Resolve(key), archive.Resolve(value))
+              for key, value in zip(fields["NS.keys"], fields["NS.objects"]))
+
+
+def DecodeString(archive, fields):
+  """Decodes NSString objects."""
+  return archive.Resolve(fields["NS.string"])
+
+
+def DecodeData(archive, fields):
+  """Decodes NSData objects into the data object they hold, usually bytes."""
+  return archive.Resolve(fields["NS.data"])
+
+
+def DecodeDate(archive, fields):
+  """Decodes NSDate objects into datetimes."""
+  fraction, integer = math.modf(archive.Resolve(fields["NS.time"]))
+  return binplist.BinaryPlist.plist_epoch + datetime.timedelta(
+      seconds=int(integer), microseconds=int(fraction*1000000))
+
+
+def DecodeNull(unused_archive, unused_fields):
+  """Decodes NSNull objects into None."""
+  return None
+
+
+# Maps class names to the functions that decode their objects. Decoders are
+# called with the KeyedArchive and the fields of the archived object and
+# return the decoded object. Use KeyedArchive.Resolve to decode the UIDs in
+# the fields.
+CLASS_DECODERS = {
+    "NSArray": DecodeArray,
+    "NSMutableArray": DecodeArray,
+    "NSSet": DecodeArray,
+    "NSMutableSet": DecodeArray,
+    "NSOrderedSet": DecodeArray,
+    "NSMutableOrderedSet": DecodeArray,
+    "NSDictionary": DecodeDictionary,
+    "NSMutableDictionary": DecodeDictionary,
+    "NSString": DecodeString,
+    "NSMutableString": DecodeString,
+    "NSData": DecodeData,
+    "NSMutableData": DecodeData,
+    "NSDate": DecodeDate,
+    "NSNull": DecodeNull,
+}
+
+
+class ArchivedObject(dict):
+  """An archived object of a class without decoder.
+
+  It's a dictionary with the fields of the object, decoded, but "$class".
+  """
+
+  def __init__(self, classname, classes):
+    """Constructor.
+
+    Args:
+      classname: The name of the class of the object.
+      classes: The names of the class and its superclasses.
+    """
+    dict.__init__(self)
+    self.classname = classname
+    self.classes = classes
+
+  def __repr__(self):
+    return "<ArchivedObject %s %s>" % (self.classname, dict.__repr__(self))
+
+
+# Marks objects of the archive that haven't been decoded yet
+_NOT_DECODED = object()
+# Marks objects whose decoder is running
+_IN_PROGRESS = object()
+
+
+class KeyedArchive(object):
+  """Represents a keyed archive.
+
+    archive = KeyedArchive(binplist.readPlist("myfile.plist"))
+    print(archive.top["root"])
+
+  Invalid UIDs, circular references that can't be represented and objects
+  whose decoder fails become binplist.CorruptReference, and set is_corrupt.
+  """
+
+  def __init__(self, archive, lazy=False, class_decoders=None):
+    """Constructor.
+
+    Args:
+      archive: The top level object of the keyed archive plist.
+      lazy: Whether to decode arrays and dictionaries on access.
+      class_decoders: A dictionary with class decoders that are added to or
+        replace those in CLASS_DECODERS.
+
+    Raises:
+      binplist.FormatError: When archive is not a keyed archive.
+    """
+    try:
+      self.objects = archive["$objects"]
+      self._top_references = archive["$top"]
+      self._object_count = len(self.objects)
+      self._top_references.items
+    except (KeyError, TypeError, AttributeError):
+      raise binplist.FormatError("Not a keyed archive.")
+    self.lazy = lazy
+    self.class_decoders = dict(CLASS_DECODERS)
+    if class_decoders:
+      self.class_decoders.update(class_decoders)
+    self.is_corrupt = False
+    self._top = None
+    # The decoded objects, by index
+    self._decoded = [_NOT_DECODED] * self._object_count
+    # Maps class description indexes to (decoder, classname, classes)
+    self._classes = {}
+
+  @property
+  def top(self):
+    """The "$top" dictionary of the archive, decoded."""
+    if self._top is None:
+      self._top = dict((key, self.Resolve(value))
+                       for key, value in self._top_references.items())
+    return self._top
+
+  def Resolve(self, value):
+    """Returns the object a UID references, decoded.
+
+    Args:
+      value: A UID or any other value found in an archived object.
+
+    Returns:
+      The decoded object when value is a UID, else value itself.
+    """
+    pending = []
+    obj = self._DecodeValue(value, pending)
+    self._FillContainers(pending)
+    return obj
+
+  def _DecodeValue(self, value, pending):
+    """Decodes value if it's a UID, leaving any containers to fill in pending.
+
+    Binary plists have binplist.Uid objects, XML plists have {"CF$UID": n}
+    dictionaries.
+    """
+    if value.__class__ is binplist.Uid:
+      return self._DecodeObject(value, pending)
+    if isinstance(value, dict) and len(value) == 1 and "CF$UID" in value:
+      index = value["CF$UID"]
+      if not isinstance(index, numbers.Integral):
+        self._LogWarn("Invalid UID %r.", index)
+        self.is_corrupt = True
+        return binplist.CorruptReference
+      return self._DecodeObject(index, pending)
+    return value
+
+  def _DecodeObject(self, index, pending):
+    """Decodes the object at index of "$objects".
+
+    Arrays, dictionaries and objects without decoder are returned empty, and
+    added to pending to be filled by _FillContainers. Creating them before
+    decoding what they contain lets objects reference themselves.
+
+    Args:
+      index: The index of the object.
+      pending: A list of (container, fields) to add the containers to.
+
+    Returns:
+      The decoded object.
+    """
+    if not 0 <= index < self._object_count:
+      self._LogWarn("UID %s out of bounds.", index)
+      self.is_corrupt = True
+      return binplist.CorruptReference
+    obj = self._decoded[index]
+    if obj is not _NOT_DECODED:
+      if obj is _IN_PROGRESS:
+        self._LogWarn("Circular reference to object %d.", index)
+        self.is_corrupt = True
+        return binplist.CorruptReference
+      return obj
+
+    fields = self.objects[index]
+    if fields.__class__ is binplist.LazyDict or isinstance(fields, dict):
+      class_reference = fields.get("$class")
+    else:
+      class_reference = None
+    if class_reference is None:
+      # Strings, numbers and data are archived as is
+      obj = None if fields == NULL else fields
+      self._decoded[index] = obj
+      return obj
+
+    try:
+      class_tuple = self._classes[class_reference]
+    except (KeyError, TypeError):
+      # First object of the class, or a {"CF$UID": n} reference
+      class_tuple = self._GetClass(class_reference)
+    decoder, classname, classes = class_tuple
+    if decoder is DecodeArray:
+      if self.lazy:
+        obj = binplist.LazyList(self, fields.get("NS.objects", []))
+      else:
+        obj = []
+        pending.append((obj, fields))
+    elif decoder is DecodeDictionary:
+      if self.lazy:
+        obj = binplist.LazyDict(self, fields.get("NS.keys", []),
+                                fields.get("NS.objects", []))
+      else:
+        obj = {}
+        pending.append((obj, fields))
+    elif decoder is not None:
+      self._decoded[index] = _IN_PROGRESS
+      try:
+        obj = decoder(self, fields)
+      except (KeyError, IndexError, TypeError, ValueError, OverflowError) as e:
+        self._LogWarn("Unable to decode object %d of class %s: %s", index,
+                      classname, e)
+        self.is_corrupt = True
+        obj = binplist.CorruptReference
+    elif classname is not None:
+      obj = ArchivedObject(classname, classes)
+      pending.append((obj, fields))
+    else:
+      obj = binplist.CorruptReference
+    self._decoded[index] = obj
+    return obj
+
+  def _FillContainers(self, pending):
+    """Fills the containers created by _DecodeObject, and those they contain.
+
+    Args:
+      pending: A list of (container, fields) to fill.
+    """
+    decoded = self._decoded
+    object_count = self._object_count
+    decode_object = self._DecodeObject
+    decode_value = self._DecodeValue
+    uid_class = binplist.Uid
+    while pending:
+      obj, fields = pending.pop()
+      try:
+        if obj.__class__ is list:
+          append = obj.append
+          for value in fields["NS.objects"]:
+            # Inlined memo lookup, the usual case in big archives
+            if value.__class__ is uid_class and value < object_count:
+              element = decoded[value]
+              if element is _NOT_DECODED or element is _IN_PROGRESS:
+                element = decode_object(value, pending)
+              append(element)
+            else:
+              append(decode_value(value, pending))
+        elif obj.__class__ is dict:
+          keys = fields["NS.keys"]
+          values = fields["NS.objects"]
+          if len(keys) != len(values):
+            self._LogWarn("Dictionary with %d keys and %d values.",
+                          len(keys), len(values))
+            self.is_corrupt = True
+          for key_reference, value in zip(keys, values):
+            if (key_reference.__class__ is uid_class and
+                key_reference < object_count):
+              key = decoded[key_reference]
+              if key is _NOT_DECODED or key is _IN_PROGRESS:
+                key = decode_object(key_reference, pending)
+            else:
+              key = decode_value(key_reference, pending)
+            if value.__class__ is uid_class and value < object_count:
+              reference, value = value, decoded[value]
+              if value is _NOT_DECODED or value is _IN_PROGRESS:
+                value = decode_object(reference, pending)
+            else:
+              value = decode_value(value, pending)
+            try:
+              obj[key] = value
+            except TypeError:
+              obj[self._CheckKey(key, key_reference)] = value
+        else:
+          for key, value in fields.items():
+            if key != "$class":
+              obj[key] = decode_value(value, pending)
+      except (KeyError, TypeError) as e:
+        self._LogWarn("Missing or invalid field in archived object: %s", e)
+        self.is_corrupt = True
+
+  def _GetClass(self, class_reference):
+    """Returns the decoder and class names for a "$class" reference.
+
+    Args:
+      class_reference: The UID of the class description.
+
+    Returns:
+      A tuple with the decoder of the class or its closest superclass with a
+      decoder, the name of the class and the names of the class and its
+      superclasses. The decoder is None when no class has one, and everything
+      is None when the class description is invalid.
+    """
+    class_index = self._GetIndex(class_reference)
+    if not isinstance(class_index, numbers.Integral):
+      class_index = -1
+    if class_index in self._classes:
+      return self._classes[class_index]
+    try:
+      if not 0 <= class_index < self._object_count:
+        raise IndexError("UID out of bounds")
+      # Class descriptions are read as is, they aren't archived objects
+      class_description = self.objects[class_index]
+      classname = class_description["$classname"]
+      classes = list(class_description.get("$classes") or [classname])
+      hash(classname)
+    except (KeyError, IndexError, TypeError, AttributeError):
+      self._LogWarn("Invalid class description %s.", class_reference)
+      self.is_corrupt = True
+      classname = classes = None
+    decoder = None
+    for name in classes or []:
+      try:
+        decoder = self.class_decoders.get(name)
+      except TypeError:
+        continue
+      if decoder:
+        break
+    class_tuple = (decoder, classname, classes)
+    self._classes[class_index] = class_tuple
+    return class_tuple
+
+  def _CheckKey(self, key, key_reference):
+    """Returns key or "corrupt:<reference>" when it isn't hashable."""
+    try:
+      hash(key)
+    except TypeError:
+      self._LogWarn("Dictionary key %s not hashable.", key_reference)
+      self.is_corrupt = True
+      return "corrupt:%s" % self._GetIndex(key_reference)
+    return key
+
+  @staticmethod
+  def _GetIndex(value):
+    """Returns the index a UID references, or value when it isn't a UID."""
+    if isinstance(value, dict):
+      return value.get("CF$UID", value)
+    return value
+
+  # Called by binplist.LazyList and binplist.LazyDict
+  def _ResolveReference(self, reference):
+    return self.Resolve(reference)
+
+  def _ResolveKey(self, reference):
+    return self._CheckKey(self.Resolve(reference), reference)
+
+  def _LogWarn(self, *args, **kwargs):
+    logging.warning(*args, **kwargs)
+
+
+def readKeyedArchive(pathOrFile, lazy=False, class_decoders=None):
+  """Returns the "$top" dictionary of the keyed archive at pathOrFile, decoded.
+
+  Args:
+    pathOrFile: A path or a file-like object to the archive.
+    lazy: Whether to parse and decode arrays and dictionaries on access. The
+      plist is read in memory, so there's no file to keep open.
+    class_decoders: Class decoders to add to those in CLASS_DECODERS.
+
+  Returns:
+    A dictionary with the decoded objects in the "$top" of the archive.
+
+  Raises:
+    binplist.FormatError: When the file is not a plist or a keyed archive.
+  """
+  if lazy:
+    try:
+      data = pathOrFile.read()
+    except AttributeError:
+      with open(pathOrFile, "rb") as file_obj:
+        data = file_obj.read()
+    try:
+      archive = binplist.LazyBufferBinaryPlist(data).Parse()
+    except binplist.FormatError:
+      archive = binplist.readPlistFromString(data)
+  else:
+    archive = binplist.readPlist(pathOrFile)
+  return KeyedArchive(archive, lazy=lazy, class_decoders=class_decoders).top
@@ -14,8 +14,11 @@
 # limitations under the License.
 
 import argparse
+import io
+import json
 import logging
-import plistlib
+import multiprocessing
+import os
 import sys
 
 from binplist import binplist
@@ -23,8 +26,10 @@ from binplist import binplist
 
 parser = argparse.ArgumentParser(description="A forensic plist parser.")
 parser.add_argument(
-  "plist", default=None, action="store",
-  help="plist file to be parsed")
+  "plists", default=None, action="store", nargs="+", metavar="plist",
+  help=("plist file to be parsed. Directories are searched recursively and "
+        "@file reads the paths to parse from file, one per line (@- reads "
+        "them from stdin)."))
 parser.add_argument(
   "-V", "--version", action="version", version=binplist.__version__)
 parser.add_argument("-v", "--verbose", action="append_const", const=True,
@@ -46,37 +51,214 @@ parser.add_argument("-EO", "--output-encoding-option", default="strict",
 parser.add_argument("-d", "--discovery-mode", action="store_true",
                     help=("Will inform you when a UID or a SET is found so "
                           "that you can help me improve the parser."))
+parser.add_argument("-j", "--jobs", default=1, type=int,
+                    help=("Number of processes parsing plists. 0 uses one "
+                          "per CPU."))
+parser.add_argument("-o", "--order", default="input",
+                    choices=["input", "completion"],
+                    help=("Whether results are written in the order plists "
+                          "were given or as soon as they're parsed."))
+parser.add_argument("-f", "--format", default="text",
+                    choices=["text", "json", "ndjson"],
+                    help=("Output format. ndjson writes each element of a top "
+                          "level array in its own line. When parsing many "
+                          "plists, JSON documents are wrapped in an object "
+                          "with their path."))
+parser.add_argument("-s", "--stats", action="store_true",
+                    help=("Print parsing statistics of each plist to stderr: "
+                          "time per phase, objects per type, cache hits and "
+                          "file reads and seeks."))
+
+# The options of the worker processes
+worker_options = None
+
+
+def IterPaths(inputs):
+  """Yields the paths of the plists to parse.
+
+  Args:
+    inputs: A list of plist paths, directories and @file names.
+
+  Yields:
+    The paths of the plist files, in the order they were given. Directories
+    are walked in sorted order.
+  """
+  for path in inputs:
+    if path.startswith("@"):
+      if path == "@-":
+        paths = [line.rstrip("\r\n") for line in sys.stdin]
+      else:
+        with open(path[1:]) as file_list:
+          paths = [line.rstrip("\r\n") for line in file_list]
+      for listed_path in IterPaths([line for line in paths
+                                    if line and not line.startswith("@")]):
+        yield listed_path
+    elif os.path.isdir(path):
+      for directory, subdirectories, filenames in os.walk(path):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+          yield os.path.join(directory, filename)
+    else:
+      yield path
+
+
+def InitWorker(options):
+  """Sets the options of a worker process."""
+  global worker_options
+  worker_options = options
+
+
+def ParsePlist(path, options, stats=None):
+  """Returns the top level object of the plist at path.
+
+  Args:
+    path: The path of the plist.
+    options: The parsed command line options.
+    stats: A binplist.ParseStats to collect parsing statistics into, or None.
+  """
+  with open(path, "rb") as fd:
+    plist = binplist.BinaryPlist(file_obj=fd,
+                                 ultra_verbosity=options.ultra_verbosity,
+                                 discovery_mode=options.discovery_mode,
+                                 stats=stats)
+    try:
+      parsed_plist = plist.Parse()
+      if plist.is_corrupt:
+        logging.warning("%s LOOKS CORRUPTED. You might not obtain all data!",
+                        path)
+    except binplist.FormatError:
+      fd.seek(0)
+      parsed_plist = binplist.readXmlPlist(fd)
+  return parsed_plist
+
+
+def WritePlist(parsed_plist, path, output, options):
+  """Writes a parsed plist to output in the requested format.
+
+  Args:
+    parsed_plist: The top level object of the plist.
+    path: The path of the plist.
+    output: A binary file object.
+    options: The parsed command line options.
+  """
+  if options.format == "text":
+    if options.tag_results:
+      output.write(b"==> " + _PathToBytes(path) + b" <==\n")
+    binplist.WritePlistToUnicode(
+      parsed_plist, output,
+      encoding=options.output_encoding,
+      errors=options.output_encoding_option,
+      string_encoding=options.string_encoding,
+      encoding_options=options.string_encoding_option)
+    output.write(b"\n")
+    return
+
+  records = [parsed_plist]
+  if options.format == "ndjson" and isinstance(parsed_plist, list):
+    records = parsed_plist
+  for record in records:
+    if options.tag_results:
+      output.write(b'{"path": ' + json.dumps(_PathToUnicode(path)).encode(
+          "ascii") + b', "plist": ')
+    if sys.version_info[0] < 3:
+      binplist.WritePlistToJson(record, output)
+    else:
+      # JSON is written as str, which python 3 only writes to text files
+      text_output = io.TextIOWrapper(output, encoding="ascii",
+                                     write_through=True)
+      binplist.WritePlistToJson(record, text_output)
+      text_output.detach()
+    if options.tag_results:
+      output.write(b"}")
+    output.write(b"\n")
+
+
+def _PathToBytes(path):
+  """Returns path as bytes, as the file system stores it."""
+  if isinstance(path, bytes):
+    return path
+  return path.encode(sys.getfilesystemencoding(), "surrogateescape")
+
+
+def _PathToUnicode(path):
+  """Returns path as unicode, replacing what can't be decoded."""
+  return _PathToBytes(path).decode(sys.getfilesystemencoding(), "replace")
+
+
+def ProcessPlist(path):
+  """Parses the plist at path and renders it with the worker options.
+
+  Errors are returned instead of raised, so that they don't stop the batch.
+  Plists are rendered to a string first, so a plist that fails halfway
+  doesn't leave a partial render in the output.
+
+  Args:
+    path: The path of the plist.
+
+  Returns:
+    A tuple with path, the rendered plist or None, the error message or None,
+    and the parsing statistics or None when they weren't requested.
+  """
+  stats = None
+  if worker_options.stats:
+    stats = binplist.ParseStats()
+  output = io.BytesIO()
+  try:
+    parsed_plist = ParsePlist(path, worker_options, stats)
+    if stats:
+      with stats.Time("render"):
+        WritePlist(parsed_plist, path, output, worker_options)
+    else:
+      WritePlist(parsed_plist, path, output, worker_options)
+  except Exception as e:  # pylint: disable=broad-except
+    return path, None, "%s: %s" % (type(e).__name__, e), stats
+  return path, output.getvalue(), None, stats
 
 
 if __name__ == "__main__":
   options = parser.parse_args()
-  if not options.plist:
+  if not options.plists:
     parser.print_help()
     sys.exit(-1)
 
-  ultra_verbosity = False
+  options.ultra_verbosity = False
   if options.verbose:
     if len(options.verbose) == 1:
       logging.basicConfig(level=logging.DEBUG)
     else:
-      ultra_verbosity = True
+      options.ultra_verbosity = True
       logging.basicConfig(level=binplist.LOG_ULTRA_VERBOSE)
 
-  with open(options.plist, "rb") as fd:
-    plist = binplist.BinaryPlist(file_obj=fd,
-                                 ultra_verbosity=ultra_verbosity,
-                                 discovery_mode=options.discovery_mode)
-    try:
-      parsed_plist = plist.Parse()
-      if plist.is_corrupt:
-        logging.warn("%s LOOKS CORRUPTED. You might not obtain all data!\n",
-                     options.plist)
-    except binplist.FormatError, e:
-      parsed_plist = plistlib.readPlist(options.plist)
+  # A single plist is written as is, batches are tagged by path
+  options.tag_results = (len(options.plists) > 1 or
+                         options.plists[0].startswith("@") or
+                         os.path.isdir(options.plists[0]))
+  paths = IterPaths(options.plists)
+  # Plists are rendered as bytes, which python 3 writes to the stdout buffer
+  stdout = getattr(sys.stdout, "buffer", sys.stdout)
+  pool = None
+  if options.jobs == 1:
+    InitWorker(options)
+    results = (ProcessPlist(path) for path in paths)
+  else:
+    pool = multiprocessing.Pool(options.jobs or None, InitWorker, (options,))
+    if options.order == "input":
+      results = pool.imap(ProcessPlist, paths, chunksize=16)
+    else:
+      results = pool.imap_unordered(ProcessPlist, paths, chunksize=16)
 
-    print binplist.PlistToUnicode(
-      parsed_plist,
-      string_encoding=options.string_encoding,
-      encoding_options=options.string_encoding_option).encode(
-        options.output_encoding,
-        options.output_encoding_option)
+  failures = 0
+  for path, output, error, stats in results:
+    if error:
+      failures += 1
+      logging.error("%s: %s", path, error)
+    else:
+      stdout.write(output)
+    if stats:
+      sys.stderr.write("==> %s stats <==\n%s\n" % (path, stats))
+  if pool is not None:
+    pool.close()
+    pool.join()
+  if failures:
+    logging.error("%d plists could not be parsed.", failures)
+    sys.exit(1)
@@ -0,0 +1,122 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for binplist.aio."""
+
+import plistlib
+import unittest
+
+from binplist import binplist
+
+try:
+  import asyncio
+  import concurrent.futures
+  from binplist import aio
+except (ImportError, SyntaxError):
+  # binplist.aio requires python 3
+  aio = None
+
+
+class _Stream(object):
+  """A stream stand-in with just a read coroutine."""
+
+  def __init__(self, read):
+    self.read = read
+
+
+@unittest.skipIf(aio is None, "binplist.aio requires python 3.7 or later.")
+class AioTest(unittest.TestCase):
+  def setUp(self):
+    self.plist = {"a": [1, u"ሴ", "x" * 100], "b": 2.5}
+    self.data = binplist.writePlistToString(self.plist)
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.ranges_read = []
+    self.sizes_read = []
+
+  def tearDown(self):
+    asyncio.set_event_loop(None)
+    self.loop.close()
+
+  def _Run(self, coroutine):
+    return self.loop.run_until_complete(coroutine)
+
+  def _StreamReader(self, data):
+    """Returns an in-memory asyncio stream with data."""
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    # Records the sizes asked for, not the reads StreamReader makes itself
+    read = reader.read
+    def Read(size=-1):
+      self.sizes_read.append(size)
+      return read(size)
+    return _Stream(Read)
+
+  def _RangeReader(self, data):
+    """Returns an in-memory read_range for readPlistFromRanges."""
+    def ReadRange(offset, size):
+      self.ranges_read.append((offset, size))
+      future = self.loop.create_future()
+      future.set_result(data[offset:offset + size])
+      return future
+    return ReadRange
+
+  def testReadPlist(self):
+    self.assertEqual(self.plist,
+                     self._Run(aio.readPlist(self._StreamReader(self.data))))
+    # The header, then everything after it
+    self.assertEqual([8, -1], self.sizes_read)
+    xml = plistlib.dumps(self.plist)
+    self.assertEqual(self.plist,
+                     self._Run(aio.readPlist(self._StreamReader(xml))))
+    self.assertRaises(binplist.FormatError, self._Run,
+                      aio.readPlist(self._StreamReader(b"not a plist")))
+    self.assertRaises(binplist.FormatError, self._Run,
+                      aio.readPlist(self._StreamReader(b"")))
+    # Invalid trailers are rejected before parsing, even in an executor
+    corrupt = self.data[:-8] + b"\xff" * 8
+    self.assertRaises(binplist.FormatError, self._Run, aio.readPlist(
+        self._StreamReader(corrupt), executor=object(), offload_size=0))
+
+  def testReadPlistOffloaded(self):
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+      self.assertEqual(self.plist, self._Run(aio.readPlist(
+          self._StreamReader(self.data), executor=executor, offload_size=0)))
+
+  def testReadPlistFromRanges(self):
+    size = len(self.data)
+    self.assertEqual(self.plist, self._Run(aio.readPlistFromRanges(
+        self._RangeReader(self.data), size)))
+    # Header and trailer, then everything in between
+    self.assertEqual([(0, 8), (size - 32, 32), (8, size - 40)],
+                     self.ranges_read)
+
+    xml = plistlib.dumps(self.plist)
+    self.assertEqual(self.plist, self._Run(aio.readPlistFromRanges(
+        self._RangeReader(xml), len(xml), offload_size=0)))
+
+    # Invalid trailers are rejected before reading the body
+    self.ranges_read = []
+    corrupt = self.data[:-8] + b"\xff" * 8
+    self.assertRaises(binplist.FormatError, self._Run, aio.readPlistFromRanges(
+        self._RangeReader(corrupt), size))
+    self.assertEqual(2, len(self.ranges_read))
+
+
+if __name__ == "__main__":
+  unittest.main()
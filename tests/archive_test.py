@@ -0,0 +1,152 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for binplist.archive."""
+
+import io
+import plistlib
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from binplist import archive
+from binplist import binplist
+
+# plistlib.writePlistToString is gone in python 3
+_WriteXmlPlist = getattr(plistlib, "dumps", None) or plistlib.writePlistToString
+
+
+class _Stream(object):
+  """A file object that can only be read, as a pipe."""
+
+  def __init__(self, data):
+    self._file_obj = io.BytesIO(data)
+
+  def read(self, size=-1):
+    return self._file_obj.read(size)
+
+
+class ArchiveTest(unittest.TestCase):
+  def setUp(self):
+    binary = binplist.writePlistToString({"a": [1, u"ሴ"], "b": 2.5})
+    # Point the first value of the top level dictionary past the objects
+    position = binary.index(b"\xD2") + 3
+    corrupt = binary[:position] + b"\x7F" + binary[position + 1:]
+    self.members = [
+        ("binary.plist", binary),
+        ("dir/xml.plist", _WriteXmlPlist(["xml"])),
+        ("not_a_plist.txt", b"bplis" + b"\x00" * 2000),
+        ("other.xml", b'<?xml version="1.0"?><html></html>'),
+        ("corrupt.plist", corrupt),
+        ("truncated.plist", binary[:20]),
+        ("big.plist", binplist.writePlistToString(["x" * 5000])),
+    ]
+    self.expected = [
+        ("binary.plist", {"a": [1, u"ሴ"], "b": 2.5}, False),
+        ("dir/xml.plist", ["xml"], False),
+        ("corrupt.plist", {"a": binplist.CorruptReference, "b": 2.5}, True),
+        ("truncated.plist", binplist.CorruptReference, True),
+        ("big.plist", ["x" * 5000], False),
+    ]
+
+  def _Zip(self):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as zip_file:
+      zip_file.writestr("dir/", b"")
+      for name, member_data in self.members:
+        zip_file.writestr(name, member_data)
+    return data.getvalue()
+
+  def _Tar(self, mode="w:gz"):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar_file:
+      directory = tarfile.TarInfo("dir")
+      directory.type = tarfile.DIRTYPE
+      tar_file.addfile(directory)
+      for name, member_data in self.members:
+        info = tarfile.TarInfo(name)
+        info.size = len(member_data)
+        tar_file.addfile(info, io.BytesIO(member_data))
+    return data.getvalue()
+
+  def testReadArchivePlists(self):
+    for data in [self._Zip(), self._Tar(), self._Tar("w")]:
+      self.assertEqual(self.expected,
+                       list(archive.ReadArchivePlists(io.BytesIO(data))))
+      # Paths, and file objects past the start of the archive
+      with tempfile.NamedTemporaryFile() as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        self.assertEqual(self.expected,
+                         list(archive.ReadArchivePlists(temp_file.name)))
+      file_obj = io.BytesIO(b"\x00" * 10 + data)
+      file_obj.seek(10)
+      self.assertEqual(self.expected,
+                       list(archive.ReadArchivePlists(file_obj)))
+      # Members over the maximum size are skipped
+      self.assertEqual(
+          self.expected[:-1],
+          list(archive.ReadArchivePlists(io.BytesIO(data),
+                                         max_member_size=1000)))
+
+  def testReadArchivePlistsFromStream(self):
+    self.assertEqual(self.expected,
+                     list(archive.ReadArchivePlists(_Stream(self._Tar()))))
+    # Zip archives can't be read from streams
+    self.assertRaises(tarfile.TarError, list,
+                      archive.ReadArchivePlists(_Stream(self._Zip())))
+    self.assertRaises(tarfile.TarError, list,
+                      archive.ReadArchivePlists(io.BytesIO(b"not an archive")))
+
+  def testReadArchivePlistsInPool(self):
+    for data in [self._Zip(), self._Tar()]:
+      archived_plists = list(archive.ReadArchivePlists(io.BytesIO(data),
+                                                       jobs=2))
+      self.assertEqual(sorted(self.expected),
+                       sorted(archived_plists))
+      # The results of the pool are the module's own objects
+      self.assertTrue(isinstance(archived_plists[0], archive.ArchivedPlist))
+      corrupt = [archived_plist for archived_plist in archived_plists
+                 if archived_plist.name == "truncated.plist"][0]
+      self.assertTrue(corrupt.top_level_object is binplist.CorruptReference)
+
+    # Plists nested too deep to be sent back from the pool are corrupt
+    deep = nested = []
+    for _ in range(sys.getrecursionlimit() * 10):
+      nested.append([])
+      nested = nested[0]
+    self.members.append(("deep.plist", binplist.writePlistToString(deep)))
+    archived_plists = list(archive.ReadArchivePlists(io.BytesIO(self._Tar()),
+                                                     jobs=2))
+    self.assertEqual(
+        sorted(self.expected + [
+            ("deep.plist", binplist.CorruptReference, True)]),
+        sorted(archived_plists))
+
+  def testIsPlist(self):
+    self.assertTrue(archive.IsPlist(b"bplist00"))
+    self.assertTrue(archive.IsPlist(_WriteXmlPlist([1])))
+    self.assertTrue(archive.IsPlist(b"\xef\xbb\xbf\n<plist version='1.0'>"))
+    self.assertFalse(archive.IsPlist(b"<html><body></body></html>"))
+    self.assertFalse(archive.IsPlist(b"text <plist>"))
+    self.assertFalse(archive.IsPlist(b""))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -17,31 +17,60 @@
 
 """Tests for binplist."""
 
+import binascii
 import datetime
+import json
 import logging
 import os
+import pickle
 import random
-import StringIO
+import string
+import io
+import struct
+import sys
+import tempfile
 import unittest
 
 from binplist import binplist
 import pytz
 
+if sys.version_info[0] >= 3:
+  # The python 2 names the tests are written against
+  basestring = (bytes, str)  # pylint: disable=redefined-builtin,invalid-name
+  unicode = str  # pylint: disable=redefined-builtin,invalid-name
+  # The JSON writers write str, which is bytes in python 2
+  TextIO = io.StringIO
+else:
+  TextIO = io.BytesIO
+
+
+def Canonical(obj):
+  """Returns a representation of obj that can be compared across parses."""
+  if isinstance(obj, dict):
+    return sorted((Canonical(k), Canonical(v)) for k, v in obj.items())
+  elif isinstance(obj, list):
+    return [Canonical(element) for element in obj]
+  elif isinstance(obj, binplist.RawValue):
+    # RawValue objects are hashed by identity
+    return ("RawValue", obj.value)
+  # NaN doesn't compare equal to itself
+  return repr(obj)
+
 
 class BinplistTest(unittest.TestCase):
   def setUp(self):
-    notrailer = "bplist00"  # header
-    self.notrailer = StringIO.StringIO(notrailer)
+    notrailer = b"bplist00"  # header
+    self.notrailer = io.BytesIO(notrailer)
 
     # A bplist of size 32, which lacks a full trailer
     # A dumb parser will try to start parsing the trailer at the header
-    shorttrailer = ("bplist\x00\x00"  # header
-                    "\x00\x00\x00\x00\x00"  # unused
-                    "\x00"  # sortversion
-                    "\x00"  # offset int size
-                    "\x00"  # object ref size
-                    "\x00\x00\x00\x00\x00\x00\x00\x00"  # num objects
-                    "\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+    shorttrailer = (b"bplist\x00\x00"  # header
+                    b"\x00\x00\x00\x00\x00"  # unused
+                    b"\x00"  # sortversion
+                    b"\x00"  # offset int size
+                    b"\x00"  # object ref size
+                    b"\x00\x00\x00\x00\x00\x00\x00\x00"  # num objects
+                    b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
                    )
     # This could be interpreted as
     # "bplis"  # unused
@@ -52,85 +81,105 @@ class BinplistTest(unittest.TestCase):
     # "\x00\x00\x00\x00\x00\x00\x00\x00" # top object
     # "\x00\x00\x00\x00\x00\x00\x00\x00" # object table offset
     # Note that this is an invalid plist for OSX
-    self.shorttrailer = StringIO.StringIO(shorttrailer)
+    self.shorttrailer = io.BytesIO(shorttrailer)
 
     # The smallest possible non-overlapping bplist
     # This is still not a valid plist for OSX
-    minimal = ("bplist00"  # header
-               "\x00\x00\x00\x00\x00"  # unused
-               "\x01"  # sortversion
-               "\x00"  # offset int size
-               "\x00"  # object ref size
-               "\x00\x00\x00\x00\x00\x00\x00\x00"  # num objects
-               "\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
-               "\x00\x00\x00\x00\x00\x00\x00\x00"  # offset to offtable
+    minimal = (b"bplist00"  # header
+               b"\x00\x00\x00\x00\x00"  # unused
+               b"\x01"  # sortversion
+               b"\x00"  # offset int size
+               b"\x00"  # object ref size
+               b"\x00\x00\x00\x00\x00\x00\x00\x00"  # num objects
+               b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+               b"\x00\x00\x00\x00\x00\x00\x00\x00"  # offset to offtable
               )
-    self.minimal = StringIO.StringIO(minimal)
+    self.minimal = io.BytesIO(minimal)
 
     # bplist with a single element. This is the smallest possible plist
     # that"s accepted by OSX.
-    single = ("bplist00"  # header
-              "\x09"  # offset table, points to the next byte
-              "\x09"  # True object
-              "\x00\x00\x00\x00\x00"  # unused
-              "\x01"  # sortversion
-              "\x01"  # offset int size
-              "\x00"  # object ref size
-              "\x00\x00\x00\x00\x00\x00\x00\x01"  # num objects
-              "\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
-              "\x00\x00\x00\x00\x00\x00\x00\x08"  # offset to offtable
+    single = (b"bplist00"  # header
+              b"\x09"  # offset table, points to the next byte
+              b"\x09"  # True object
+              b"\x00\x00\x00\x00\x00"  # unused
+              b"\x01"  # sortversion
+              b"\x01"  # offset int size
+              b"\x00"  # object ref size
+              b"\x00\x00\x00\x00\x00\x00\x00\x01"  # num objects
+              b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+              b"\x00\x00\x00\x00\x00\x00\x00\x08"  # offset to offtable
              )
-    self.single = StringIO.StringIO(single)
+    self.single = io.BytesIO(single)
 
     # bplist with more offsets than objects (shouldn't be a problem)
-    short = ("bplist00"  # header
-             "\x09\x0a\x0b\x0c\x0d\x0e"  # offset table
-             "\x09"  # True object
-             "\x00\x00\x00\x00\x00"  # unused
-             "\x01"  # sortversion
-             "\x01"  # offset int size
-             "\x00"  # object ref size
-             "\x00\x00\x00\x00\x00\x00\x00\x03"  # num objects
-             "\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
-             "\x00\x00\x00\x00\x00\x00\x00\x08"  # offset to offtable
+    short = (b"bplist00"  # header
+             b"\x09\x0a\x0b\x0c\x0d\x0e"  # offset table
+             b"\x09"  # True object
+             b"\x00\x00\x00\x00\x00"  # unused
+             b"\x01"  # sortversion
+             b"\x01"  # offset int size
+             b"\x00"  # object ref size
+             b"\x00\x00\x00\x00\x00\x00\x00\x03"  # num objects
+             b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+             b"\x00\x00\x00\x00\x00\x00\x00\x08"  # offset to offtable
             )
-    self.short = StringIO.StringIO(short)
+    self.short = io.BytesIO(short)
 
     # bplist with an offset table that starts past the file
-    overflow = ("bplist00"  # header
-                "\x09"  # offset table, points to the next byte
-                "\x09"  # True object
-                "\x00\x00\x00\x00\x00"  # unused
-                "\x01"  # sortversion
-                "\x01"  # offset int size
-                "\x00"  # object ref size
-                "\x00\x00\x00\x00\x00\x00\x00\x01"  # num objects
-                "\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
-                "\x00\x00\x00\x00\x00\x00\xFF\xFF"  # offset to offtable (OF)
+    overflow = (b"bplist00"  # header
+                b"\x09"  # offset table, points to the next byte
+                b"\x09"  # True object
+                b"\x00\x00\x00\x00\x00"  # unused
+                b"\x01"  # sortversion
+                b"\x01"  # offset int size
+                b"\x00"  # object ref size
+                b"\x00\x00\x00\x00\x00\x00\x00\x01"  # num objects
+                b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+                b"\x00\x00\x00\x00\x00\x00\xFF\xFF"  # offset to offtable (OF)
                )
-    self.overflow = StringIO.StringIO(overflow)
+    self.overflow = io.BytesIO(overflow)
+    # {"a": [1, "bc", u"d"], "b": 2.0}
+    nested = (b"bplist00"  # header
+              b"\xD2\x01\x02\x03\x07"  # Dict of 2 entries
+              b"\x51a"  # "a"
+              b"\x51b"  # "b"
+              b"\xA3\x04\x05\x06"  # Array of 3 objects
+              b"\x10\x01"  # 1
+              b"\x52bc"  # "bc"
+              b"\x61\x00d"  # u"d"
+              b"\x23\x40\x00\x00\x00\x00\x00\x00\x00"  # 2.0
+              b"\x08\x0D\x0F\x11\x15\x17\x1A\x1D"  # offset table
+              b"\x00\x00\x00\x00\x00"  # unused
+              b"\x00"  # sortversion
+              b"\x01"  # offset int size
+              b"\x01"  # object ref size
+              b"\x00\x00\x00\x00\x00\x00\x00\x08"  # num objects
+              b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+              b"\x00\x00\x00\x00\x00\x00\x00\x26"  # offset to offtable
+             )
+    self.nested = io.BytesIO(nested)
     # The minimal valid XML plist.
-    self.min_xml = StringIO.StringIO('<?xml version="1.0" encoding="UTF-8"?>'
-                                     '<plist></plist>')
+    self.min_xml = io.BytesIO(b'<?xml version="1.0" encoding="UTF-8"?>'
+                              b'<plist></plist>')
 
   def testReadHeader(self):
-    blank_header = StringIO.StringIO()
+    blank_header = io.BytesIO()
     plist = binplist.BinaryPlist(blank_header)
     self.assertRaises(binplist.FormatError, plist._ReadHeader)
-    wrong_header = StringIO.StringIO("bla")
+    wrong_header = io.BytesIO(b"bla")
     plist = binplist.BinaryPlist(wrong_header)
     self.assertRaises(binplist.FormatError, plist._ReadHeader)
-    unknown_version = StringIO.StringIO("bplist99")
+    unknown_version = io.BytesIO(b"bplist99")
     plist = binplist.BinaryPlist(unknown_version)
     plist._ReadHeader()
-    self.assertEqual(plist.version, "99")
-    usual_header = StringIO.StringIO("bplist00")
+    self.assertEqual(plist.version, b"99")
+    usual_header = io.BytesIO(b"bplist00")
     plist = binplist.BinaryPlist(usual_header)
     plist._ReadHeader()
-    self.assertEqual(plist.version, "00")
+    self.assertEqual(plist.version, b"00")
 
   def testReadTrailer(self):
-    blank_trailer = StringIO.StringIO()
+    blank_trailer = io.BytesIO()
     plist = binplist.BinaryPlist(blank_trailer)
     self.assertRaises(IOError, plist._ReadTrailer)
     plist = binplist.BinaryPlist(self.minimal)
@@ -146,24 +195,62 @@ class BinplistTest(unittest.TestCase):
     plist = binplist.BinaryPlist(self.single)
     plist._ReadTrailer()
     plist._ReadOffsetTable()
-    self.assertListEqual([0x09], plist.object_offsets)
+    self.assertListEqual([0x09], list(plist.object_offsets))
     # Test the plist that doesn't have a full trailer
     plist = binplist.BinaryPlist(self.short)
     plist._ReadTrailer()
     plist._ReadOffsetTable()
-    self.assertListEqual([9, 10, 11], plist.object_offsets)
+    self.assertListEqual([9, 10, 11], list(plist.object_offsets))
     # Test the plist with an offset table that overflows the file
     plist = binplist.BinaryPlist(self.overflow)
     plist._ReadTrailer()
     self.assertRaises(binplist.FormatError, plist._ReadOffsetTable)
 
+  def testUnpackIntegers(self):
+    for int_size in range(1, 10):
+      integers = [0, 1, 0x80, (1 << (int_size * 8)) - 1,
+                  random.randint(0, (1 << (int_size * 8)) - 1)]
+      data = b"".join(binascii.unhexlify("%0*x" % (int_size * 2, integer))
+                      for integer in integers)
+      self.assertListEqual(integers,
+                           list(binplist._UnpackIntegers(data, int_size)))
+      # Incomplete integers at the end are ignored
+      self.assertListEqual(
+          integers[:-1], list(binplist._UnpackIntegers(data[:-1], int_size)))
+
+  def testParseOfftableOddSizes(self):
+    for int_size in [3, 5, 6, 7]:
+      trailer = (b"\x00\x00\x00\x00\x00"  # unused
+                 b"\x01"  # sortversion
+                 + struct.pack(">B", int_size) +  # offset int size
+                 b"\x01"  # object ref size
+                 b"\x00\x00\x00\x00\x00\x00\x00\x02"  # num objects
+                 b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+                 b"\x00\x00\x00\x00\x00\x00\x00\x0A"  # offset to offtable
+                )
+      data = (b"bplist00"  # header
+              b"\xA1\x01"  # Array with a reference to the next object
+              + b"\x00" * (int_size - 1) + b"\x08"  # offset of the array
+              + b"\x00" * (int_size - 1) + b"\x09"  # offset of the True object
+              b"\x09"  # True object
+              + trailer)
+      # Fix the offset of the True object, which is right after the table
+      true_offset = 10 + 2 * int_size
+      data = data.replace(
+          b"\x00" * (int_size - 1) + b"\x09",
+          b"\x00" * (int_size - 1) + struct.pack(">B", true_offset), 1)
+      for plist in (binplist.BinaryPlist(io.BytesIO(data)),
+                    binplist.BufferBinaryPlist(data)):
+        self.assertEqual([True], plist.Parse())
+        self.assertListEqual([8, true_offset], list(plist.object_offsets))
+
   def testReadPlist(self):
-    blank_file = StringIO.StringIO()
+    blank_file = io.BytesIO()
     self.assertRaises(binplist.FormatError, binplist.readPlist, blank_file)
-    bplist15 = StringIO.StringIO("bplist15")
+    bplist15 = io.BytesIO(b"bplist15")
     self.assertRaises(binplist.FormatError, binplist.readPlist, bplist15)
     # Incomplete XML does not parse (expat error from plistlib is caught)
-    xml_file = StringIO.StringIO("<xml")
+    xml_file = io.BytesIO(b"<xml")
     self.assertRaises(binplist.FormatError, binplist.readPlist, xml_file)
     # Check that a minimal XML plist does parse.
     # We're not testing full XML parsing per se as that's plistlib's tests job.
@@ -173,9 +260,9 @@ class BinplistTest(unittest.TestCase):
     for _ in range(5):
       self.single.seek(0, os.SEEK_SET)
       rand_int = random.randint(0, 2048)
-      padding = "A" * rand_int
+      padding = b"A" * rand_int
       padded_singleplist = padding + self.single.read()
-      fd = StringIO.StringIO(padded_singleplist)
+      fd = io.BytesIO(padded_singleplist)
       fd.seek(rand_int, os.SEEK_SET)
       plist = binplist.BinaryPlist(fd)
       plist.Parse()
@@ -184,148 +271,757 @@ class BinplistTest(unittest.TestCase):
     for _ in range(5):
       self.min_xml.seek(0, os.SEEK_SET)
       rand_int = random.randint(0, 2048)
-      padding = "A" * rand_int
+      padding = b"A" * rand_int
       padded_xml_plist = padding + self.min_xml.read()
-      fd = StringIO.StringIO(padded_xml_plist)
+      fd = io.BytesIO(padded_xml_plist)
       fd.seek(rand_int, os.SEEK_SET)
       binplist.readPlist(fd)
 
+  def testBufferBinaryPlist(self):
+    for fd in (self.single, self.short):
+      fd.seek(0, os.SEEK_SET)
+      data = fd.read()
+      fd.seek(0, os.SEEK_SET)
+      plist = binplist.BinaryPlist(fd)
+      expected_result = plist.Parse()
+      buffer_plist = binplist.BufferBinaryPlist(data)
+      self.assertEqual(expected_result, buffer_plist.Parse())
+      self.assertEqual(plist.objects, buffer_plist.objects)
+      self.assertEqual(list(plist.object_offsets),
+                       list(buffer_plist.object_offsets))
+      self.assertEqual(plist.is_corrupt, buffer_plist.is_corrupt)
+      # Parsing a memoryview or at an offset works as well
+      view = memoryview(data)
+      buffer_plist = binplist.BufferBinaryPlist(view)
+      self.assertEqual(expected_result, buffer_plist.Parse())
+      # memoryviews are parsed in place, without copying them
+      self.assertTrue(buffer_plist.data is view)
+      self.assertEqual(expected_result, binplist.readPlistFromString(view))
+      buffer_plist = binplist.BufferBinaryPlist(b"A" * 13 + data, offset=13)
+      self.assertEqual(expected_result, buffer_plist.Parse())
+    for fd in (self.minimal, self.overflow):
+      plist = binplist.BufferBinaryPlist(fd.read())
+      self.assertRaises(binplist.FormatError, plist.Parse)
+    plist = binplist.BufferBinaryPlist(b"bplist00")
+    self.assertRaises(IOError, plist.Parse)
+    self.assertRaises(IOError, binplist.BufferBinaryPlist().Parse)
+
+  def testEnginesMatchBinaryPlist(self):
+    nested = self.nested.read()
+    self.assertEqual({"a": [1, "bc", u"d"], "b": 2.0},
+                     binplist.BufferBinaryPlist(nested).Parse())
+    # Corrupt every byte in a few ways and check all engines agree
+    for position in range(len(nested)):
+      for value in [b"\x00", b"\x0F", b"\x1F", b"\x5F", b"\xAF", b"\xDF",
+                    b"\xFF"]:
+        data = nested[:position] + value + nested[position+1:]
+        outcomes = []
+        for plist in (binplist.BinaryPlist(io.BytesIO(data)),
+                      binplist.BufferBinaryPlist(data),
+                      binplist.BufferBinaryPlist(memoryview(data)),
+                      binplist.IterativeBinaryPlist(io.BytesIO(data)),
+                      binplist.IterativeBufferBinaryPlist(data)):
+          try:
+            outcomes.append((Canonical(plist.Parse()), plist.is_corrupt))
+          except Exception as e:
+            outcomes.append(type(e))
+        for outcome in outcomes[1:]:
+          self.assertEqual(outcomes[0], outcome)
+    # Lengths too big for a single read are cut at the end of the plist
+    huge = b"\x13\x7f\xff\xff\xff\xff\xff\xff\xff"
+    for marker in [b"\x4F", b"\x5F", b"\x6F"]:
+      obj = marker + huge + b"\x00a"
+      data = (b"bplist00" + obj + b"\x08" +
+              struct.pack(">5xBBBQQQ", 0, 1, 1, 1, 0, 8 + len(obj)))
+      outcomes = []
+      for plist in (binplist.BinaryPlist(io.BytesIO(data)),
+                    binplist.BufferBinaryPlist(data),
+                    binplist.IterativeBinaryPlist(io.BytesIO(data)),
+                    binplist.IterativeBufferBinaryPlist(data)):
+        outcomes.append((Canonical(plist.Parse()), plist.is_corrupt))
+      for outcome in outcomes[1:]:
+        self.assertEqual(outcomes[0], outcome)
+
+  def testTruncatedDictionaryKeys(self):
+    # A dictionary of 40 entries at the end of the file. After 3 references
+    # to "a", its keys run into the trailer and then past the end.
+    data = (b"bplist00" + b"\x51a\x10\x01" + b"\x0F\x08\x0A" +
+            b"\xDF\x10\x28" + b"\x01" * 3 +
+            struct.pack(">5xBBBQQQ", 0, 1, 1, 3, 0, 12))
+    corrupt = binplist.CorruptReference
+    expected = {"a": corrupt, "corrupt:0": corrupt, "corrupt:3": corrupt,
+                "corrupt:12": corrupt, "corrupt:truncated": corrupt}
+    for plist in (binplist.BinaryPlist(io.BytesIO(data)),
+                  binplist.BufferBinaryPlist(data),
+                  binplist.IterativeBinaryPlist(io.BytesIO(data)),
+                  binplist.IterativeBufferBinaryPlist(data),
+                  binplist.LazyBinaryPlist(io.BytesIO(data)),
+                  binplist.LazyBufferBinaryPlist(data)):
+      self.assertEqual(expected, dict(plist.Parse()))
+      self.assertTrue(plist.is_corrupt)
+
+  def testIterativeBinaryPlist(self):
+    # An array nested deeper than the recursion limit: [[[...[1]...]]]
+    depth = sys.getrecursionlimit() + 100
+    objects = [b"\xA1" + struct.pack(">H", index + 1) for index in range(depth)]
+    objects.append(b"\x10\x01")
+    offsets = [8 + 3 * index for index in range(len(objects))]
+    trailer = struct.pack(">5xBBBQQQ", 0, 2, 2, len(objects), 0,
+                          8 + len(b"".join(objects)))
+    data = (b"bplist00" + b"".join(objects) +
+            struct.pack(">%dH" % len(offsets), *offsets) + trailer)
+    for plist in (binplist.IterativeBinaryPlist(io.BytesIO(data)),
+                  binplist.IterativeBufferBinaryPlist(data)):
+      obj = plist.Parse()
+      self.assertFalse(plist.is_corrupt)
+      for _ in range(depth):
+        self.assertEqual(1, len(obj))
+        obj = obj[0]
+      self.assertEqual(1, obj)
+    # The recursive parser can't cope with it
+    plist = binplist.BinaryPlist(io.BytesIO(data))
+    self.assertRaises(RuntimeError, plist.Parse)
+
+    # A dictionary that contains itself: {"a": <itself>}
+    data = (b"bplist00\xD1\x01\x00\x51a\x08\x0B"
+            b"\x00\x00\x00\x00\x00\x00\x01\x01"
+            b"\x00\x00\x00\x00\x00\x00\x00\x02"
+            b"\x00\x00\x00\x00\x00\x00\x00\x00"
+            b"\x00\x00\x00\x00\x00\x00\x00\x0D")
+    for plist in (binplist.IterativeBinaryPlist(io.BytesIO(data)),
+                  binplist.IterativeBufferBinaryPlist(data)):
+      self.assertEqual({"a": binplist.CorruptReference}, plist.Parse())
+      self.assertTrue(plist.is_corrupt)
+
+  def testLazyBinaryPlist(self):
+    nested = self.nested.read()
+    for plist in (binplist.LazyBinaryPlist(io.BytesIO(nested)),
+                  binplist.LazyBufferBinaryPlist(nested)):
+      top_level_object = plist.Parse()
+      self.assertTrue(isinstance(top_level_object, binplist.LazyDict))
+      # Only the top level object has been parsed so far
+      self.assertListEqual([0], list(plist.objects.keys()))
+      self.assertEqual(2, len(top_level_object))
+      self.assertTrue("a" in top_level_object)
+      self.assertFalse("c" in top_level_object)
+      self.assertListEqual(["a", "b"], sorted(top_level_object.keys()))
+      # Keys are parsed but values aren't
+      self.assertListEqual([0, 1, 2], sorted(plist.objects.keys()))
+      array = top_level_object["a"]
+      self.assertTrue(isinstance(array, binplist.LazyList))
+      self.assertEqual(3, len(array))
+      self.assertListEqual([0, 1, 2, 3], sorted(plist.objects.keys()))
+      self.assertEqual("bc", array[1])
+      self.assertEqual(u"d", array[-1])
+      self.assertEqual([1, "bc", u"d"], array)
+      self.assertRaises(IndexError, array.__getitem__, 3)
+      self.assertRaises(KeyError, top_level_object.__getitem__, "c")
+      self.assertEqual({"a": [1, "bc", u"d"], "b": 2.0},
+                       top_level_object.Materialize())
+      self.assertFalse(plist.is_corrupt)
+      self.assertEqual(u"{\n    'a': [1, 'bc', 'd'],\n    'b': 2.0\n}",
+                       binplist.PlistToUnicode(top_level_object))
+
+  def testLazyBinaryPlistCircularReferences(self):
+    # [[<circular reference>, 1]]
+    data = (b"bplist00"  # header
+            b"\xA1\x01"  # Array with a reference to the next array
+            b"\xA2\x00\x02"  # Array with a circular reference and a 1
+            b"\x10\x01"  # 1
+            b"\x08\x0A\x0D"  # offset table
+            b"\x00\x00\x00\x00\x00\x01\x01\x01"  # trailer
+            b"\x00\x00\x00\x00\x00\x00\x00\x03"  # num objects
+            b"\x00\x00\x00\x00\x00\x00\x00\x00"  # top object
+            b"\x00\x00\x00\x00\x00\x00\x00\x0F"  # offset to offtable
+           )
+    self.assertEqual([[binplist.CorruptReference, 1]],
+                     binplist.BinaryPlist(io.BytesIO(data)).Parse())
+    plist = binplist.LazyBufferBinaryPlist(data)
+    top_level_object = plist.Parse()
+    self.assertTrue(top_level_object[0][0] is top_level_object)
+    self.assertFalse(plist.is_corrupt)
+    self.assertEqual([[binplist.CorruptReference, 1]],
+                     top_level_object.Materialize())
+    self.assertTrue(plist.is_corrupt)
+
+  def testQuery(self):
+    nested = self.nested.read()
+    self.assertEqual("bc", binplist.query(io.BytesIO(nested),
+                                          "root.a[1]"))
+    self.assertEqual(u"d", binplist.query(io.BytesIO(nested),
+                                          "root['a'][-1]"))
+    self.assertEqual([1, "bc", u"d"],
+                     binplist.query(io.BytesIO(nested), 'root["a"]'))
+    self.assertEqual({"a": [1, "bc", u"d"], "b": 2.0},
+                     binplist.query(io.BytesIO(nested), "root"))
+    for path, error in [("root.c", KeyError),
+                        ("root.b.c", KeyError),
+                        ("root.a.c", KeyError),
+                        ("root.a[3]", IndexError),
+                        ("a", ValueError),
+                        ("root.", ValueError),
+                        ("root[a]", ValueError)]:
+      self.assertRaises(error, binplist.query, io.BytesIO(nested), path)
+    # Only the objects on the path are parsed
+    plist = binplist.LazyBinaryPlist(io.BytesIO(nested))
+    self.assertEqual(1, plist.Query("root.a[0]"))
+    self.assertListEqual([0, 1, 2, 3, 4], sorted(plist.objects.keys()))
+    self.assertEqual(2.0, plist.Query("root.b"))
+    # Works on XML plists and paths as well
+    xml_plist = io.BytesIO(
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<plist><dict><key>a</key><array><string>b</string></array></dict>'
+        b'</plist>')
+    self.assertEqual("b", binplist.query(xml_plist, "root.a[0]"))
+    with tempfile.NamedTemporaryFile() as temp_file:
+      temp_file.write(nested)
+      temp_file.flush()
+      self.assertEqual("bc", binplist.query(temp_file.name, "root.a[1]"))
+    self.assertRaises(binplist.FormatError, binplist.query,
+                      io.BytesIO(b"<xml"), "root")
+
+  def testReadPlistFromString(self):
+    self.assertEqual(True, binplist.readPlistFromString(self.single.read()))
+    self.assertRaises(binplist.FormatError, binplist.readPlistFromString, b"")
+    self.assertRaises(binplist.FormatError, binplist.readPlistFromString,
+                      b"bplist15")
+    self.assertRaises(binplist.FormatError, binplist.readPlistFromString,
+                      b"<xml")
+    binplist.readPlistFromString(self.min_xml.read())
+
+  def testReadPlistMapped(self):
+    with tempfile.NamedTemporaryFile() as temp_file:
+      self.assertRaises(binplist.FormatError, binplist.readPlistMapped,
+                        temp_file.name)
+      temp_file.write(b"A" * 7 + self.single.read())
+      temp_file.flush()
+      temp_file.seek(7, os.SEEK_SET)
+      self.assertEqual(True, binplist.readPlistMapped(temp_file))
+      temp_file.seek(0, os.SEEK_SET)
+      self.assertRaises(binplist.FormatError, binplist.readPlistMapped,
+                        temp_file.name)
+
+  def testParseStats(self):
+    # 7 objects: the dictionary, its 3 keys, the array, 1 and 2.5. "a" and 1
+    # are referenced twice.
+    data = binplist.writePlistToString(
+        {"a": ["a", 1], "b": 2.5, "c": 1})
+    expected_markers = {"DICT": 1, "ARRAY": 1, "STRING": 3, "INT": 1,
+                        "REAL": 1}
+    for plist_class, data_class in [
+        (binplist.BinaryPlist, io.BytesIO),
+        (binplist.IterativeBinaryPlist, io.BytesIO),
+        (binplist.BufferBinaryPlist, bytes)]:
+      stats = binplist.ParseStats()
+      plist = plist_class(data_class(data), stats=stats)
+      self.assertEqual({"a": ["a", 1], "b": 2.5, "c": 1}, plist.Parse())
+      self.assertEqual(set(binplist.ParseStats.PHASES),
+                       set(stats.phase_times))
+      self.assertEqual(expected_markers, stats.marker_counts)
+      # Every object is parsed once, and fetched again by its container
+      self.assertEqual(7, stats.cache_misses)
+      # The 8 references plus the top level object
+      self.assertEqual(9, stats.cache_hits)
+      if plist_class is binplist.BufferBinaryPlist:
+        self.assertEqual(0, stats.reads)
+      else:
+        self.assertTrue(stats.reads > 7)
+        self.assertTrue(stats.seeks > 7)
+        self.assertTrue(0 < stats.bytes_read <= len(data))
+      # Statistics add up
+      plist = plist_class(data_class(data), stats=stats)
+      with stats.Time("render"):
+        binplist.PlistToUnicode(plist.Parse())
+      exported = stats.AsDict()
+      self.assertEqual(2, exported["marker_counts"]["DICT"])
+      self.assertEqual(14, exported["cache"]["misses"])
+      self.assertTrue("render" in exported["phase_times"])
+      json.dumps(exported)
+    # Parsers without stats aren't instrumented
+    plist = binplist.BinaryPlist(io.BytesIO(data))
+    plist.Parse()
+    self.assertEqual(dict, type(plist.objects))
+    self.assertFalse("_ParseObjects" in vars(plist))
+
+  def testCompact(self):
+    nested = self.nested.read()
+    for plist_class, data_class in [
+        (binplist.BinaryPlist, io.BytesIO),
+        (binplist.IterativeBinaryPlist, io.BytesIO),
+        (binplist.BufferBinaryPlist, bytes),
+        (binplist.IterativeBufferBinaryPlist, bytes)]:
+      expected_plist = plist_class(data_class(nested))
+      expected_result = expected_plist.Parse()
+      plist = plist_class(data_class(nested), compact=True)
+      self.assertEqual(expected_result, plist.Parse())
+      self.assertTrue(isinstance(plist.objects, list))
+      self.assertEqual(plist.object_count, len(plist.objects))
+      self.assertEqual(expected_plist.objects, dict(enumerate(plist.objects)))
+      self.assertEqual(expected_result, plist.top_level_object)
+      # Statistics are the same too
+      stats = binplist.ParseStats()
+      plist_class(data_class(nested), compact=True, stats=stats).Parse()
+      expected_stats = binplist.ParseStats()
+      plist_class(data_class(nested), stats=expected_stats).Parse()
+      self.assertEqual(expected_stats.cache_hits, stats.cache_hits)
+      self.assertEqual(expected_stats.cache_misses, stats.cache_misses)
+      # The parser forgets about the objects, callers keep theirs
+      plist.DropObjects()
+      self.assertEqual({}, plist.objects)
+      self.assertEqual(None, plist.top_level_object)
+      plist.Open(data_class(nested))
+      self.assertEqual(expected_result, plist.Parse())
+
+    # Objects not parsed yet
+    plist = binplist.LazyBufferBinaryPlist(nested, compact=True)
+    plist.Parse()
+    self.assertEqual(binplist.NotParsed, plist.objects[1:][0])
+    self.assertFalse(1 in plist.objects)
+    self.assertRaises(KeyError, plist.objects.__getitem__, 1)
+    self.assertTrue(0 in plist.objects)
+
+    # Corrupt values survive pickling with any protocol
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+      self.assertEqual(b"\xff", pickle.loads(pickle.dumps(
+          binplist.RawValue(b"\xff"), protocol)).value)
+
+  def testInternPool(self):
+    root = {"key": ["value", u"\xe9", "x" * 100], "unicode": u"key"}
+    data = binplist.writePlistToString(root)
+    for plist_class, data_class in [
+        (binplist.BinaryPlist, io.BytesIO),
+        (binplist.IterativeBinaryPlist, io.BytesIO),
+        (binplist.BufferBinaryPlist, bytes),
+        (binplist.LazyBufferBinaryPlist, bytes)]:
+      pool = binplist.InternPool()
+      first, second = [plist_class(data_class(data), intern_pool=pool).Parse()
+                       for _ in range(2)]
+      if plist_class is binplist.LazyBufferBinaryPlist:
+        first, second = first.Materialize(), second.Materialize()
+      self.assertEqual(root, first)
+      self.assertEqual(root, second)
+      first_keys = dict((key, key) for key in first)
+      for key in second:
+        self.assertTrue(key is first_keys[key])
+      # Values are only interned when asked to
+      self.assertFalse(first["key"][0] is second["key"][0])
+      self.assertEqual(2, len(pool))
+
+    pool = binplist.InternPool(policy=binplist.InternPool.KEYS_AND_VALUES,
+                               max_value_length=10)
+    first, second = [binplist.BufferBinaryPlist(data, intern_pool=pool).Parse()
+                     for _ in range(2)]
+    self.assertTrue(first["key"][0] is second["key"][0])
+    self.assertTrue(first["key"][1] is second["key"][1])
+    self.assertFalse(first["key"][2] is second["key"][2])
+    # "unicode" is written as an ASCII string, the same as the key
+    self.assertTrue(first["unicode"] is second["unicode"])
+    self.assertEqual(4, len(pool))
+    # "key" and u"key" are equal, but interning keeps their types
+    self.assertEqual(unicode, type(pool.Intern(u"key")))
+
+    # The pool is bounded
+    pool = binplist.InternPool(max_entries=1)
+    # Joined strings aren't interned by python itself
+    interned = pool.Intern("".join(["a", "a"]))
+    self.assertTrue(interned is pool.Intern("".join(["a", "a"])))
+    self.assertFalse(
+        pool.Intern("".join(["b", "b"])) is pool.Intern("".join(["b", "b"])))
+    self.assertEqual(1, len(pool))
+    pool.Clear()
+    self.assertEqual(0, len(pool))
+    self.assertRaises(ValueError, binplist.InternPool, policy="everything")
+
+  def testParseBudget(self):
+    root = {"a": ["x" * 100, u"\xe9" * 10], "b": [[[1]]]}
+    data = binplist.writePlistToString(root)
+    C = binplist.CorruptReference
+    for budget_args, expected_result, exceeded in [
+        ({}, root, []),
+        ({"max_object_size": 50}, {"a": [C, u"\xe9" * 10], "b": [[[1]]]},
+         ["max_object_size"]),
+        ({"max_object_size": 19}, {"a": [C, C], "b": [[[1]]]},
+         ["max_object_size"]),
+        ({"max_depth": 3}, {"a": ["x" * 100, u"\xe9" * 10], "b": [[C]]},
+         ["max_depth"]),
+        # The top of the plist is parsed first, "b" and its value never are
+        ({"max_objects": 5}, {"a": ["x" * 100, u"\xe9" * 10], C: C},
+         ["max_objects"]),
+        ({"max_decoded_bytes": 110}, {"a": ["x" * 100, C], C: C},
+         ["max_decoded_bytes"]),
+        ({"max_seconds": -1}, C, ["max_seconds"])]:
+      results = []
+      for plist_class, data_class in [
+          (binplist.BinaryPlist, io.BytesIO),
+          (binplist.IterativeBinaryPlist, io.BytesIO),
+          (binplist.BufferBinaryPlist, bytes),
+          (binplist.IterativeBufferBinaryPlist, bytes)]:
+        budget = binplist.ParseBudget(**budget_args)
+        plist = plist_class(data_class(data), budget=budget,
+                            stats=binplist.ParseStats())
+        self.assertEqual(expected_result, plist.Parse())
+        self.assertEqual(exceeded, sorted(budget.exceeded))
+        self.assertEqual(bool(exceeded), plist.is_corrupt)
+        results.append(budget.AsDict())
+      # All engines consume the same
+      for result in results:
+        del result["seconds"]
+        self.assertEqual(results[0], result)
+      json.dumps(results[0])
+
+    # Consumption is measured per parse
+    budget = binplist.ParseBudget(max_objects=1000)
+    plist = binplist.BufferBinaryPlist(data, budget=budget)
+    plist.Parse()
+    # The dictionary, its keys, the array in "a" and its elements, the 3
+    # nested arrays and 1. Bytes are the references of the containers and the
+    # characters of the strings.
+    self.assertEqual({"objects": 10, "depth": 5, "exceeded": [],
+                      "decoded_bytes": 4 + 2 + 2 + 100 + 20 + 3},
+                     dict((key, value) for key, value in budget.AsDict().items()
+                          if key != "seconds"))
+    plist.Parse()
+    self.assertEqual(10, budget.objects)
+    self.assertTrue("decoded_bytes" in str(budget))
+
+    # A budget without limits changes nothing, not even the parsing order.
+    # Budgets parse from the top level object down, which here is object 1 in
+    # a cycle of 3, so parsing from it finds the cycle elsewhere.
+    circular = (b"bplist00" + b"\xA2\x01\x02" + b"\xA1\x00" + b"\xA1\x01" +
+                b"\x08\x0B\x0D" + struct.pack(">5xBBBQQQ", 0, 1, 1, 3, 1, 15))
+    for plist_data in [data, circular]:
+      for plist_class, data_class in [
+          (binplist.BinaryPlist, io.BytesIO),
+          (binplist.IterativeBinaryPlist, io.BytesIO),
+          (binplist.BufferBinaryPlist, bytes),
+          (binplist.LazyBufferBinaryPlist, bytes)]:
+        plist = plist_class(data_class(plist_data))
+        result = plist.Parse()
+        budget = binplist.ParseBudget()
+        budgeted_plist = plist_class(data_class(plist_data), budget=budget)
+        self.assertEqual(Canonical(result), Canonical(budgeted_plist.Parse()))
+        self.assertEqual(plist.is_corrupt, budgeted_plist.is_corrupt)
+        self.assertEqual(list(plist.objects), list(budgeted_plist.objects))
+        self.assertFalse("_ParseObjectAt" in vars(budgeted_plist))
+        self.assertEqual(0, budget.objects)
+
   #############################################################################
   ##### Object-specific tests
 
+  def testDataViews(self):
+    blob = b"\xff" * 100
+    data = binplist.writePlistToString({"blob": blob, "key": "value"})
+    result = binplist.BufferBinaryPlist(data, data_views=True).Parse()
+    view = result["blob"]
+    self.assertEqual(binplist.DataView, type(view))
+    self.assertTrue(view.data is data)
+    self.assertEqual(100, len(view))
+    self.assertEqual(blob, view.ToBytes())
+    self.assertEqual(blob, bytes(view))
+    self.assertEqual(blob, view.MemoryView().tobytes())
+    self.assertEqual({"blob": blob, "key": "value"}, result)
+    self.assertEqual(hash(blob), hash(view))
+    self.assertEqual(view, binplist.DataView(b"xx" + blob, 2, 100))
+    unpickled = pickle.loads(pickle.dumps(view, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(view, unpickled)
+    self.assertEqual(0, unpickled.offset)
+    # Data views are written, rendered and exported as the data they stand for
+    self.assertEqual(data, binplist.writePlistToString(result))
+    expected = {"blob": blob, "key": "value"}
+    self.assertEqual(binplist.PlistToUnicode(expected),
+                     binplist.PlistToUnicode(result))
+    self.assertEqual(u"".join(binplist.IterPlistToJson(expected)),
+                     u"".join(binplist.IterPlistToJson(result)))
+    # Data past the end of the buffer is cut short, as without data views
+    truncated = data.replace(b"\x4f\x10\x64", b"\x4f\x11\x64")
+    view = binplist.BufferBinaryPlist(truncated, data_views=True).Parse()
+    self.assertEqual(binplist.BufferBinaryPlist(truncated).Parse()["blob"],
+                     view["blob"].ToBytes())
+    # Views of a memoryview reference it as well
+    view = binplist.BufferBinaryPlist(memoryview(data),
+                                      data_views=True).Parse()["blob"]
+    self.assertEqual(blob, view.ToBytes())
+    self.assertEqual(blob, view.MemoryView().tobytes())
+
+    with tempfile.NamedTemporaryFile() as temp_file:
+      temp_file.write(data)
+      temp_file.flush()
+      result = binplist.readPlistMapped(temp_file.name, data_views=True)
+    # The mapping outlives the file, and is released along with the views
+    self.assertEqual(blob, result["blob"].MemoryView().tobytes())
+    self.assertEqual("value", result["key"])
+
+  def testDataStreams(self):
+    blob = bytes(bytearray(range(128, 228)))
+    root = {"blob": blob, "small": b"\xff" * 3, "again": [blob]}
+    data = binplist.writePlistToString(root)
+    for plist_class in [binplist.BinaryPlist, binplist.IterativeBinaryPlist,
+                        binplist.LazyBinaryPlist]:
+      file_obj = io.BytesIO(data)
+      result = plist_class(file_obj, data_stream_size=50).Parse()
+      stream = result["blob"]
+      self.assertEqual(binplist.DataStream, type(stream))
+      self.assertTrue(stream.file_obj is file_obj)
+      self.assertEqual(100, len(stream))
+      self.assertEqual(blob, data[stream.offset:stream.offset + 100])
+      self.assertEqual(b"\xff" * 3, result["small"])
+      # All the references share the stream
+      self.assertTrue(result["again"][0] is stream)
+      self.assertEqual(blob[:30], stream.read(30))
+      self.assertEqual(blob[30:60], stream.read(30))
+      self.assertEqual(60, stream.tell())
+      self.assertEqual(blob[60:], stream.read())
+      self.assertEqual(b"", stream.read(10))
+      stream.seek(-10, os.SEEK_END)
+      self.assertEqual(blob[-10:], stream.read(100))
+      stream.seek(-20, os.SEEK_CUR)
+      self.assertEqual(80, stream.tell())
+      self.assertRaises(IOError, stream.seek, -1)
+      self.assertEqual(blob, stream.ToBytes())
+      self.assertEqual(80, stream.tell())
+      self.assertEqual(data, binplist.writePlistToString(result))
+      self.assertEqual(u"".join(binplist.IterPlistToJson(root)),
+                       u"".join(binplist.IterPlistToJson(result)))
+      self.assertEqual(binplist.PlistToUnicode(root),
+                       binplist.PlistToUnicode(result))
+
+    # Data past the end of the file is cut short, as without data streams
+    truncated = data.replace(b"\x4f\x10\x64", b"\x4f\x11\x64")
+    stream = binplist.BinaryPlist(io.BytesIO(truncated),
+                                  data_stream_size=0).Parse()["blob"]
+    self.assertEqual(
+        binplist.BinaryPlist(io.BytesIO(truncated)).Parse()["blob"],
+        stream.read())
+
+    with tempfile.NamedTemporaryFile() as temp_file:
+      temp_file.write(data)
+      temp_file.flush()
+      result = binplist.readPlist(temp_file.name, data_stream_size=50)
+      self.assertEqual(blob, result["blob"].read())
+      self.assertEqual(root, binplist.readPlist(temp_file.name))
+
+  def testWritePlist(self):
+    shared = ["x", 1]
+    root = {
+        "a": [1, "bc", u"d", u"\xe9t\xe9", 2.5, -3, 1 << 40, True, False],
+        "b": [None, binplist.NullValue, binplist.Uid(300), shared, shared],
+        "c": [list(shared), set([1]), {}, b"\xff\x00", "x" * 20],
+        "date": datetime.datetime(2013, 5, 6, 7, 8, 9, tzinfo=pytz.utc),
+    }
+    data = binplist.writePlistToString(root)
+    self.assertTrue(data.startswith(b"bplist00"))
+    plist = binplist.BufferBinaryPlist(data)
+    result = plist.Parse()
+    self.assertFalse(plist.is_corrupt)
+    # ASCII unicode strings are written as strings and sets read as lists
+    root["a"][2] = "d"
+    root["c"][1] = [1]
+    self.assertEqual(Canonical(root), Canonical(result))
+    self.assertTrue(isinstance(result["b"][2], binplist.Uid))
+    # Equal strings, numbers and lists are written once
+    self.assertEqual(27, plist.object_count)
+    self.assertEqual(1, plist.object_ref_size)
+    self.assertEqual(1, plist.offset_int_size)
+    # Parsed plists can be written back
+    self.assertEqual(Canonical(result), Canonical(binplist.readPlistFromString(
+        binplist.writePlistToString(result))))
+    # The values of a shared container are read only once
+    reads = []
+
+    class CountingDict(dict):
+      def __getitem__(self, key):
+        reads.append(key)
+        return dict.__getitem__(self, key)
+
+    counting = CountingDict(k=1)
+    data = binplist.writePlistToString([counting, counting, counting])
+    self.assertEqual([{"k": 1}] * 3, binplist.readPlistFromString(data))
+    self.assertEqual(["k"], reads)
+
+    # Minimal reference and offset sizes
+    plist = binplist.BufferBinaryPlist(
+        binplist.writePlistToString(list(range(300))))
+    self.assertEqual(list(range(300)), plist.Parse())
+    self.assertEqual(2, plist.object_ref_size)
+    self.assertEqual(2, plist.offset_int_size)
+    writer = binplist.BinaryPlistWriter(object_ref_size=4, offset_int_size=8)
+    plist = binplist.BufferBinaryPlist(writer.ToString(list(range(300))))
+    self.assertEqual(list(range(300)), plist.Parse())
+    self.assertEqual(4, plist.object_ref_size)
+    self.assertEqual(8, plist.offset_int_size)
+    writer = binplist.BinaryPlistWriter(object_ref_size=1)
+    self.assertRaises(ValueError, writer.ToString,
+                      list(range(300)))
+
+    # Unsupported objects, circular references and out of range integers
+    self.assertRaises(TypeError, binplist.writePlistToString, [object()])
+    circular = []
+    circular.append([circular])
+    self.assertRaises(ValueError, binplist.writePlistToString, circular)
+    self.assertRaises(ValueError, binplist.writePlistToString, 1 << 64)
+    # Integers past the signed 8 byte range are written in 16 bytes
+    for value in [1 << 63, (1 << 64) - 1]:
+      data = binplist.writePlistToString([value])
+      self.assertEqual([value], binplist.BufferBinaryPlist(data).Parse())
+      self.assertEqual([value],
+                       binplist.BinaryPlist(io.BytesIO(data)).Parse())
+
+    # Writing to a file and nesting deeper than the recursion limit
+    deep = nested = []
+    for _ in range(sys.getrecursionlimit() + 100):
+      nested.append([])
+      nested = nested[0]
+    with tempfile.NamedTemporaryFile() as temp_file:
+      binplist.writePlist(deep, temp_file.name)
+      with open(temp_file.name, "rb") as fd:
+        plist = binplist.IterativeBinaryPlist(fd)
+        self.assertEqual(1, len(plist.Parse()))
+      self.assertEqual(sys.getrecursionlimit() + 101, plist.object_count)
+      self.assertFalse(plist.is_corrupt)
+
   def testParseBoolFill(self):
     # null
-    data = StringIO.StringIO("\x00")
+    data = io.BytesIO(b"\x00")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(binplist.NullValue, plist._ParseObject())
     # false
-    data = StringIO.StringIO("\x08")
+    data = io.BytesIO(b"\x08")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(False, plist._ParseObject())
     # true
-    data = StringIO.StringIO("\x09")
+    data = io.BytesIO(b"\x09")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(True, plist._ParseObject())
     # fill byte
-    data = StringIO.StringIO("\x0F")
+    data = io.BytesIO(b"\x0F")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(None, plist._ParseObject())
     # unknown
-    for i in "\x01\x02\x03\x04\x05\x06\x07\x0a\x0b\x0c\x0d\x0e":
-      unk = StringIO.StringIO(i)
+    for marker in [0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x0a, 0x0b, 0x0c,
+                   0x0d, 0x0e]:
+      unk = io.BytesIO(struct.pack(">B", marker))
       plist = binplist.BinaryPlist(unk)
       self.assertEqual(binplist.UnknownObject, plist._ParseObject())
 
   def testParseInt(self):
     # 1 byte
-    data = StringIO.StringIO("\x10\x00")
+    data = io.BytesIO(b"\x10\x00")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(0, plist._ParseObject())
     # 2 bytes
-    data = StringIO.StringIO("\x11\x00\x01")
+    data = io.BytesIO(b"\x11\x00\x01")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(1, plist._ParseObject())
-    data = StringIO.StringIO("\x11\x01\x00")
+    data = io.BytesIO(b"\x11\x01\x00")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(256, plist._ParseObject())
     # 4 bytes
-    data = StringIO.StringIO("\x12\x00\x00\x00\x01")
+    data = io.BytesIO(b"\x12\x00\x00\x00\x01")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(1, plist._ParseObject())
     # 8 bytes - should be unsigned
-    data = StringIO.StringIO("\x13\x00\x00\x00\x00\x00\x00\x00\x01")
+    data = io.BytesIO(b"\x13\x00\x00\x00\x00\x00\x00\x00\x01")
     plist = binplist.BinaryPlist(data)
     self.assertEqual(1, plist._ParseObject())
     # Now with version 00 - signed
-    data = StringIO.StringIO("\x13\x00\x00\x00\x00\x00\x00\x00\x01")
+    data = io.BytesIO(b"\x13\x00\x00\x00\x00\x00\x00\x00\x01")
     plist = binplist.BinaryPlist(data)
-    plist.version = "00"
+    plist.version = b"00"
     self.assertEqual(1, plist._ParseObject())
     # 8 bytes - should be unsigned
-    data = StringIO.StringIO("\x13\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFE")
+    data = io.BytesIO(b"\x13\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFE")
     plist = binplist.BinaryPlist(data)
     self.assertEqual((1<<64)-2, plist._ParseObject())
     # Now with version 00 - signed
-    data = StringIO.StringIO("\x13\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFE")
+    data = io.BytesIO(b"\x13\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFE")
     plist = binplist.BinaryPlist(data)
-    plist.version = "00"
+    plist.version = b"00"
     self.assertEqual(-2, plist._ParseObject())
     # 16 bytes - should be unsigned
-    raw = "\x14\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01"
-    data = StringIO.StringIO(raw)
+    raw = (b"\x14\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+           b"\x01")
+    data = io.BytesIO(raw)
     plist = binplist.BinaryPlist(data)
     self.assertEqual(1, plist._ParseObject())
-    raw = "\x14\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x01"
-    data = StringIO.StringIO(raw)
+    raw = (b"\x14\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+           b"\x01")
+    data = io.BytesIO(raw)
     plist = binplist.BinaryPlist(data)
-    plist.version = "00"
+    plist.version = b"00"
     self.assertEqual(1, plist._ParseObject())
     # 16 bytes - should be unsigned
-    raw = "\x14\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFE"
-    data = StringIO.StringIO(raw)
+    raw = (b"\x14\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF"
+           b"\xFE")
+    data = io.BytesIO(raw)
     plist = binplist.BinaryPlist(data)
     self.assertEqual((1<<128)-2, plist._ParseObject())
     # Now with version 00 - signed
-    raw = "\x14\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFE"
-    data = StringIO.StringIO(raw)
+    raw = (b"\x14\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF"
+           b"\xFE")
+    data = io.BytesIO(raw)
     plist = binplist.BinaryPlist(data)
-    plist.version = "00"
+    plist.version = b"00"
     self.assertEqual(-2, plist._ParseObject())
     # Test incomplete data
-    data = StringIO.StringIO("\x10")
+    data = io.BytesIO(b"\x10")
     plist = binplist.BinaryPlist(data)
     int_object = plist._ParseObject()
     self.assertTrue(isinstance(int_object, binplist.RawValue))
-    data = StringIO.StringIO("\x11\x12")
+    data = io.BytesIO(b"\x11\x12")
     plist = binplist.BinaryPlist(data)
     int_object = plist._ParseObject()
     self.assertTrue(isinstance(int_object, binplist.RawValue))
+    # Incomplete data in a memoryview is copied, not kept as a view
+    plist = binplist.BufferBinaryPlist(memoryview(b"\x11\x12"))
+    int_object = plist._ParseObjectAt(0)
+    self.assertEqual(binplist.RawValue(b"\x12"), int_object)
+    self.assertTrue(isinstance(int_object.value, bytes))
     # Test unknown size
-    data = StringIO.StringIO("\x16\x00\x00")
+    data = io.BytesIO(b"\x16\x00\x00")
     plist = binplist.BinaryPlist(data)
     int_object = plist._ParseObject()
-    self.assertEqual(int_object, binplist.RawValue("\x00\x00"))
+    self.assertEqual(int_object, binplist.RawValue(b"\x00\x00"))
 
   def testParseReal(self):
     values = [
-        (0, "\x22\x00\x00\x00\x00", 0.0, float),
-        (0, "\x22\x3f\x80\x00\x00", 1.0, float),
-        (0, "\x22\xc1\xfa\xb2\x2d", -31.336999893188477, float),
-        (0, "\x23\x00\x00\x00\x00\x00\x00\x00\x00", 0.0, float),
-        (0, "\x23\xc0\x3f\x56\x45\xa1\xca\xc0\x83", -31.337, float),
+        (0, b"\x22\x00\x00\x00\x00", 0.0, float),
+        (0, b"\x22\x3f\x80\x00\x00", 1.0, float),
+        (0, b"\x22\xc1\xfa\xb2\x2d", -31.336999893188477, float),
+        (0, b"\x23\x00\x00\x00\x00\x00\x00\x00\x00", 0.0, float),
+        (0, b"\x23\xc0\x3f\x56\x45\xa1\xca\xc0\x83", -31.337, float),
         # Wrong size
-        (0, "\x21\xc0\x3f", "\xc0\x3f", binplist.RawValue)
+        (0, b"\x21\xc0\x3f", b"\xc0\x3f", binplist.RawValue)
     ]
     self.ObjectTest(values)
 
   def testParseDate(self):
     datetime_cls = datetime.datetime
     values = [
-        (0, "\x33"+"\x00"*8,  # plist epoch
+        (0, b"\x33"+b"\x00"*8,  # plist epoch
          datetime_cls(2001, 1, 1, 0, 0, 0, tzinfo=pytz.utc), datetime_cls),
-        (0, "\x33\xc0\xac\x20\x00\x00\x00\x00\x00",  # -1 hour
+        (0, b"\x33\xc0\xac\x20\x00\x00\x00\x00\x00",  # -1 hour
          datetime_cls(2000, 12, 31, 23, 0, 0, tzinfo=pytz.utc), datetime_cls),
-        (0, "\x33\x41\xb6\x92\x5e\x80\x00\x00\x00",  # +12 years
+        (0, b"\x33\x41\xb6\x92\x5e\x80\x00\x00\x00",  # +12 years
          datetime_cls(2013, 1, 1, 0, 0, 0, tzinfo=pytz.utc), datetime_cls),
         # Now try microseconds
-        (0, "\x33\x41\xb6\x92\x5e\x80\x00\x20\x00",  # +12 years and 488 us
+        (0, b"\x33\x41\xb6\x92\x5e\x80\x00\x20\x00",  # +12 years and 488 us
          datetime_cls(2013, 1, 1, 0, 0, 0, 488, tzinfo=pytz.utc), datetime_cls),
         # Negative date
-        (0, "\x33\xc1\xb6\x92\x5e\x80\x00\x00\x00",  # -12 years
+        (0, b"\x33\xc1\xb6\x92\x5e\x80\x00\x00\x00",  # -12 years
          datetime_cls(1989, 1, 1, 0, 0, 0, tzinfo=pytz.utc), datetime_cls),
         # Wrong size count, we allow these
-        (0, "\x31\x41\xb6\x92\x5e\x80\x00\x00\x00",  # +12 years
+        (0, b"\x31\x41\xb6\x92\x5e\x80\x00\x00\x00",  # +12 years
          datetime_cls(2013, 1, 1, 0, 0, 0, tzinfo=pytz.utc), datetime_cls),
         # And not enough data
-        (0, "\x31\x41\xb6",
-         binplist.RawValue("\x41\xb6"), binplist.RawValue),
+        (0, b"\x31\x41\xb6",
+         binplist.RawValue(b"\x41\xb6"), binplist.RawValue),
     ]
     self.ObjectTest(values)
 
   def ObjectTest(self, values):
     for test_value in values:
       raises, data, expected_result, result_type = test_value
-      fd = StringIO.StringIO(data)
+      fd = io.BytesIO(data)
       plist = binplist.BinaryPlist(fd)
       if not raises:
         result = plist._ParseObject()
@@ -334,66 +1030,74 @@ class BinplistTest(unittest.TestCase):
         self.assertEqual(result, expected_result)
       else:
         self.assertRaises(expected_result, plist._ParseObject)
+      # The buffer engine must decode the very same values
+      plist = binplist.BufferBinaryPlist(data)
+      if not raises:
+        result = plist._ParseObjectAt(0)
+        self.assertTrue(isinstance(result, result_type))
+        self.assertEqual(result, expected_result)
+      else:
+        self.assertRaises(expected_result, plist._ParseObjectAt, 0)
 
   def testParseData(self):
     values = [
         # Length 0 string
-        (0, "\x40\x99\x33", "", basestring),
+        (0, b"\x40\x99\x33", b"", basestring),
         # Length 1 string
-        (0, "\x41\x99\x33", "\x99", basestring),
+        (0, b"\x41\x99\x33", b"\x99", basestring),
         # Length 4 string
-        (0, "\x44data", "data", basestring),
+        (0, b"\x44data", b"data", basestring),
         # Length 4 via sized int string
-        (0, "\x4F\x00\x04data", "data", basestring),
+        (0, b"\x4F\x00\x04data", b"data", basestring),
         # Length 256 via sized int string
-        (0, "\x4F\x01\x01\x00"+"\x7f"*256, "\x7f"*256, basestring),
+        (0, b"\x4F\x01\x01\x00"+b"\x7f"*256, b"\x7f"*256, basestring),
         # Wrong size
-        (0, "\x48dat", "dat", basestring),
-        (0, "\x4F\x00\x04dat", "dat", basestring),
+        (0, b"\x48dat", b"dat", basestring),
+        (0, b"\x4F\x00\x04dat", b"dat", basestring),
     ]
     self.ObjectTest(values)
 
   def testParseString(self):
     values = [
         # Length 0 string
-        (0, "\x50blabla", "", basestring),
+        (0, b"\x50blabla", "", basestring),
         # Length 1 string
-        (0, "\x51d", "d", basestring),
+        (0, b"\x51d", "d", basestring),
         # Length 4 string
-        (0, "\x54data", "data", basestring),
+        (0, b"\x54data", "data", basestring),
         # Length 4 via sized int string
-        (0, "\x5F\x00\x04data", "data", basestring),
+        (0, b"\x5F\x00\x04data", "data", basestring),
         # Length 4 via sized int string and non-ASCII chars
-        (0, "\x5F\x00\x04\x9f\x88\xd3\xe6", "\x9f\x88\xd3\xe6", basestring),
+        (0, b"\x5F\x00\x04\x9f\x88\xd3\xe6", b"\x9f\x88\xd3\xe6", basestring),
         # Length 18 (tests the 1 << size & 0xF bug at GetSizedIntFromFd)
-        (0, "\x5F\x10\x12"+"A"*18, "A"*18, basestring),
+        (0, b"\x5F\x10\x12"+b"A"*18, "A"*18, basestring),
         # Length 256 via sized int string
-        (0, "\x5F\x01\x01\x00"+"A"*256, "A"*256, basestring),
+        (0, b"\x5F\x01\x01\x00"+b"A"*256, "A"*256, basestring),
         # Wrong size, we return what we can
-        (0, "\x58dat", "dat", basestring),
-        (0, "\x5F\x00\x04dat", "dat", basestring),
+        (0, b"\x58dat", "dat", basestring),
+        (0, b"\x5F\x00\x04dat", "dat", basestring),
     ]
     self.ObjectTest(values)
 
   def testParseUtf16(self):
     values = [
         # Length 0 string
-        (0, "\x60blabla", "", unicode),
+        (0, b"\x60blabla", "", unicode),
         # Length 1 string
-        (0, "\x61\x00d", u"d", unicode),
+        (0, b"\x61\x00d", u"d", unicode),
         # Length 4 string
-        (0, "\x64\x00d\x00a\x00t\x00a", u"data", unicode),
+        (0, b"\x64\x00d\x00a\x00t\x00a", u"data", unicode),
         # Length 4 via sized int string
-        (0, "\x6F\x00\x04\x00d\x00a\x00t\x00a", u"data", unicode),
+        (0, b"\x6F\x00\x04\x00d\x00a\x00t\x00a", u"data", unicode),
         # Length 4 via sized int string and non-ASCII chars
-        (0, "\x6F\x00\x04\x9f\x88\xd3\xe6", u"\u9f88\ud3e6", unicode),
+        (0, b"\x6F\x00\x04\x9f\x88\xd3\xe6", u"\u9f88\ud3e6", unicode),
         # Length 256 via sized int string
-        (0, "\x6F\x01\x01\x00"+"\x00A"*256, u"A"*256, unicode),
+        (0, b"\x6F\x01\x01\x00"+b"\x00A"*256, u"A"*256, unicode),
         # Odd-sized string, will return a raw value
-        (0, "\x62\x00a\x00", "\x00a\x00", binplist.RawValue),
+        (0, b"\x62\x00a\x00", b"\x00a\x00", binplist.RawValue),
         # Wrong size, we return what we can as RawValue.
-        (0, "\x68dat", "dat", binplist.RawValue),
-        (0, "\x6F\x00\x04dat", "dat", binplist.RawValue),
+        (0, b"\x68dat", b"dat", binplist.RawValue),
+        (0, b"\x6F\x00\x04dat", b"dat", binplist.RawValue),
     ]
     self.ObjectTest(values)
 
@@ -401,17 +1105,17 @@ class BinplistTest(unittest.TestCase):
     # This is experimental as we haven't seen actual UID values yet.
     values = [
         # UID of length 1
-        (0, "\x80\x01", 1, int),
+        (0, b"\x80\x01", 1, binplist.Uid),
         # UID of length 2
-        (0, "\x81\x00\x01", 1, int),
+        (0, b"\x81\x00\x01", 1, binplist.Uid),
         # UID of length 4
-        (0, "\x83\x00\x00\x00\x01", 1, int),
+        (0, b"\x83\x00\x00\x00\x01", 1, binplist.Uid),
         # UID of length 8
-        (0, "\x87\x00\x00\x00\x00\x00\x00\x00\x01", 1, int),
+        (0, b"\x87\x00\x00\x00\x00\x00\x00\x00\x01", 1, binplist.Uid),
         # UID of length 3 with enough data
-        (0, "\x82\x00\x00\x00\x00\x00\x00\x00\x01", 0, int),
+        (0, b"\x82\x00\x00\x00\x00\x00\x00\x00\x01", 0, binplist.Uid),
         # UID of length 3 without enough data. We return what we can
-        (0, "\x82\x00\x01", 1, int),
+        (0, b"\x82\x00\x01", 1, binplist.Uid),
     ]
     self.ObjectTest(values)
 
@@ -419,54 +1123,54 @@ class BinplistTest(unittest.TestCase):
     values = [
         # (ref_size, object_offsets, expected_result, data)
         # Array of 0 objects
-        (1, [], [], "\xA0"),
+        (1, [], [], b"\xA0"),
         # Array of 1 object
         (1,
          [0, 2],
          [False],
-         ("\xA1"  # Array of 1 object
-          "\x01"  # Reference to object False
-          "\x08"  # False object
+         (b"\xA1"  # Array of 1 object
+          b"\x01"  # Reference to object False
+          b"\x08"  # False object
          )),
         # Array of 2 objects
         (1,
          [0, 3, 4],
          [False, True],
-         ("\xA2"  # Array of 2 objects
-          "\x01"  # Reference to object False
-          "\x02"  # Reference to object True
-          "\x08"  # False object
-          "\x09"  # True object
+         (b"\xA2"  # Array of 2 objects
+          b"\x01"  # Reference to object False
+          b"\x02"  # Reference to object True
+          b"\x08"  # False object
+          b"\x09"  # True object
          )),
         # Array of 2 objects, 1 nonexistant
         (1,
          [0, 3, 4],
          [False, binplist.CorruptReference],
-         ("\xA2"  # Array of 2 objects
-          "\x01"  # Reference to object False
-          "\x09"  # Reference to a nonexistant object
-          "\x08"  # False object
-          "\x09"  # True object
+         (b"\xA2"  # Array of 2 objects
+          b"\x01"  # Reference to object False
+          b"\x09"  # Reference to a nonexistant object
+          b"\x08"  # False object
+          b"\x09"  # True object
          )),
         # Array of 2 objects, 1 out of bounds
         (1,
          [0, 3, 200],
          [False, binplist.CorruptReference],
-         ("\xA2"  # Array of 2 objects
-          "\x01"  # Reference to object False
-          "\x02"  # Reference out of bounds
-          "\x08"  # False object
-          "\x09"  # True object
+         (b"\xA2"  # Array of 2 objects
+          b"\x01"  # Reference to object False
+          b"\x02"  # Reference out of bounds
+          b"\x08"  # False object
+          b"\x09"  # True object
          )),
         # Array of 2 objects, 1 circular reference to the array itself
         (1,
          [0, 3, 4],
          [False, binplist.CorruptReference],
-         ("\xA2"  # Array of 2 objects
-          "\x01"  # Reference to object False
-          "\x00"  # circular reference to the array
-          "\x08"  # False object
-          "\x09"  # True object
+         (b"\xA2"  # Array of 2 objects
+          b"\x01"  # Reference to object False
+          b"\x00"  # circular reference to the array
+          b"\x08"  # False object
+          b"\x09"  # True object
          )),
         # Array of 2 objects, one a False value. The other is an array that
         # has a reference to the first array.
@@ -474,12 +1178,12 @@ class BinplistTest(unittest.TestCase):
         (1,
          [0, 3, 4],
          [False, [binplist.CorruptReference]],
-         ("\xA2"  # Array of 2 objects
-          "\x01"  # Reference to object False
-          "\x02"  # Reference to the second array
-          "\x08"  # False object
-          "\xA1"  # Array of 1 object, points to the first array
-          "\x00"  # circular reference to the first array
+         (b"\xA2"  # Array of 2 objects
+          b"\x01"  # Reference to object False
+          b"\x02"  # Reference to the second array
+          b"\x08"  # False object
+          b"\xA1"  # Array of 1 object, points to the first array
+          b"\x00"  # circular reference to the first array
          )),
         # Array with not enough elements. This is hardly possible
         # in a real world scenario because of the trailer always being
@@ -489,15 +1193,15 @@ class BinplistTest(unittest.TestCase):
         (1,
          [0, 3, 4],
          [binplist.CorruptReference, binplist.CorruptReference],
-         ("\xA2"  # Array of 2 objects
-          "\x01"  # Reference to a nonexistant object
+         (b"\xA2"  # Array of 2 objects
+          b"\x01"  # Reference to a nonexistant object
          )),
 
         ]
 
     for value in values:
       (ref_size, object_offsets, expected_result, data) = value
-      fd = StringIO.StringIO(data)
+      fd = io.BytesIO(data)
       plist = binplist.BinaryPlist(fd)
       # Fill objects_traversed with the current value as if we had been called
       # by a normal _Parse
@@ -509,99 +1213,141 @@ class BinplistTest(unittest.TestCase):
       self.assertListEqual(expected_result, result)
       # Test that the circular reference detection helper is cleaned properly
       self.assertSetEqual(plist.objects_traversed, {0})
+      # Same thing with the buffer engine
+      plist = binplist.BufferBinaryPlist(data)
+      plist.objects_traversed = {0}
+      plist.object_ref_size = ref_size
+      plist.object_offsets = object_offsets
+      plist.object_count = len(object_offsets)
+      self.assertListEqual(expected_result, plist._ParseObjectAt(0))
+      self.assertSetEqual(plist.objects_traversed, {0})
+
+  def testGetObjectReferences(self):
+    corrupt = binplist.CorruptReference
+    for ref_size, struct_char in [(1, "B"), (2, "H"), (4, "L")]:
+      references = [0, 1, (1 << (8 * ref_size)) - 1, 7, 2]
+      data = struct.pack(">%d%c" % (len(references), struct_char), *references)
+      cases = [
+          # (data, length, expected_result)
+          (data, 5, references),
+          (data, 3, references[:3]),
+          # The reference block runs past the end of the data
+          (data, 7, references + [corrupt, corrupt]),
+          (data[:-1], 5, references[:4] + [corrupt])]
+      for reference_data, length, expected_result in cases:
+        stats = binplist.ParseStats()
+        plist = binplist.BinaryPlist(io.BytesIO(reference_data), stats=stats)
+        plist.object_ref_size = ref_size
+        self.assertEqual(expected_result, plist._GetObjectReferences(length))
+        # All the references are read at once
+        self.assertEqual(1, stats.reads)
+        plist = binplist.BufferBinaryPlist(reference_data)
+        plist.object_ref_size = ref_size
+        self.assertEqual(expected_result,
+                         plist._DecodeObjectReferences(0, length))
+
+    # References are checked in batch: invalid and circular ones are found
+    plist = binplist.BinaryPlist(io.BytesIO(b""))
+    plist.object_count = 8
+    plist.objects_traversed = {3}
+    self.assertTrue(plist._AreValidReferences([]))
+    self.assertTrue(plist._AreValidReferences([0, 7, 1]))
+    self.assertFalse(plist._AreValidReferences([0, 8, 1]))
+    self.assertFalse(plist._AreValidReferences([0, 3]))
+    self.assertFalse(plist._AreValidReferences([0, corrupt]))
 
   def testParseDict(self):
     values = [
         # (ref_size, object_offsets, expected_result, data)
         # Dict of 0 objects
-        (1, [], {}, "\xD0"),
+        (1, [], {}, b"\xD0"),
         # Dict of 1 entry
         (1, [0, 3, 5],
          {"a": True},
-         ("\xD1"  # Dict of 1 entry
-          "\x01"  # Ref to key#1
-          "\x02"  # Ref to val#1
-          "\x51a"  # "a" (key#1)
-          "\x09"  # True (val#1)
+         (b"\xD1"  # Dict of 1 entry
+          b"\x01"  # Ref to key#1
+          b"\x02"  # Ref to val#1
+          b"\x51a"  # "a" (key#1)
+          b"\x09"  # True (val#1)
          )),
         # Dict of 1 entry, a key being an integer
         (1, [0, 3, 5],
          {1: True},
-         ("\xD1"  # Dict of 1 entry
-          "\x01"  # Ref to key#1
-          "\x02"  # Ref to val#1
-          "\x10\x01"  # 1 (key#1)
-          "\x09"  # True (val#1)
+         (b"\xD1"  # Dict of 1 entry
+          b"\x01"  # Ref to key#1
+          b"\x02"  # Ref to val#1
+          b"\x10\x01"  # 1 (key#1)
+          b"\x09"  # True (val#1)
          )),
         # Dict of 1 entry, has a circular key
         (1, [0, 3, 5],
          {"corrupt:0": True},
-         ("\xD1"  # Dict of 1 entry
-          "\x00"  # Circular key
-          "\x02"  # Ref to val#1
-          "\x10\x01"  # 1 (key#1)
-          "\x09"  # True (val#1)
+         (b"\xD1"  # Dict of 1 entry
+          b"\x00"  # Circular key
+          b"\x02"  # Ref to val#1
+          b"\x10\x01"  # 1 (key#1)
+          b"\x09"  # True (val#1)
          )),
         # Dict of 1 entry, has a circular value
         (1, [0, 3, 5],
          {1: binplist.CorruptReference},
-         ("\xD1"  # Dict of 1 entry
-          "\x01"  # Ref to key#1
-          "\x00"  # Circular value
-          "\x10\x01"  # 1 (key#1)
-          "\x09"  # True (val#1)
+         (b"\xD1"  # Dict of 1 entry
+          b"\x01"  # Ref to key#1
+          b"\x00"  # Circular value
+          b"\x10\x01"  # 1 (key#1)
+          b"\x09"  # True (val#1)
          )),
         # Dict of 1 entry, has both a circular key and a circular value
         (1, [0, 3, 5],
          {"corrupt:0": binplist.CorruptReference},
-         ("\xD1"  # Dict of 1 entry
-          "\x00"  # Circular key
-          "\x00"  # Circular value
-          "\x10\x01"  # 1 (key#1)
-          "\x09"  # True (val#1)
+         (b"\xD1"  # Dict of 1 entry
+          b"\x00"  # Circular key
+          b"\x00"  # Circular value
+          b"\x10\x01"  # 1 (key#1)
+          b"\x09"  # True (val#1)
          )),
         # Dict of 1 entry, value is a list that contains a circular value
         (1, [0, 3, 5, 8],
          {"a": [binplist.CorruptReference, 1]},
-         ("\xD1"  # Dict of 1 entry
-          "\x01"  # key#1
-          "\x02"  # val#1
-          "\x51a"  # "a" (key#1)
-          "\xA2\x00\x03"  # Array with 2 elements. The dict and an integer
-          "\x10\x01"  # 1
+         (b"\xD1"  # Dict of 1 entry
+          b"\x01"  # key#1
+          b"\x02"  # val#1
+          b"\x51a"  # "a" (key#1)
+          b"\xA2\x00\x03"  # Array with 2 elements. The dict and an integer
+          b"\x10\x01"  # 1
          )),
         # Dict of 2 entries
         (1,
          [0, 5, 7, 9, 10],
          {"a": False, "b": True},
-         ("\xD2"  # Dict of 2 entries
-          "\x01"  # key#1
-          "\x02"  # key#2
-          "\x03"  # val#2
-          "\x04"  # val#2
-          "\x51a"  # "a"
-          "\x51b"  # "b"
-          "\x08"  # False object
-          "\x09"  # True object
+         (b"\xD2"  # Dict of 2 entries
+          b"\x01"  # key#1
+          b"\x02"  # key#2
+          b"\x03"  # val#2
+          b"\x04"  # val#2
+          b"\x51a"  # "a"
+          b"\x51b"  # "b"
+          b"\x08"  # False object
+          b"\x09"  # True object
          )),
         # Dict with not enough references
         (1, [0],
          {"corrupt:1": binplist.CorruptReference},
-         ("\xD1"  # Dict of 1 entry
-          "\x01"  # key#1
+         (b"\xD1"  # Dict of 1 entry
+          b"\x01"  # key#1
          )),
         # Dict with a nonexistant reference
         (1, [0],
          {"corrupt:32": binplist.CorruptReference},
-         ("\xD1"  # Dict of 1 entry
-          "\x20"  # key#1
-          "\x99"  # val#1
+         (b"\xD1"  # Dict of 1 entry
+          b"\x20"  # key#1
+          b"\x99"  # val#1
          )),
     ]
 
     for value in values:
       (ref_size, object_offsets, expected_result, data) = value
-      fd = StringIO.StringIO(data)
+      fd = io.BytesIO(data)
       plist = binplist.BinaryPlist(fd)
       # Fill objects_traversed with the current value as if we had been called
       # by a normal _Parse
@@ -613,14 +1359,22 @@ class BinplistTest(unittest.TestCase):
       self.assertEqual(expected_result, result)
       # Test that the circular reference detection helper is cleaned properly
       self.assertSetEqual(plist.objects_traversed, {0})
+      # Same thing with the buffer engine
+      plist = binplist.BufferBinaryPlist(data)
+      plist.objects_traversed = {0}
+      plist.object_ref_size = ref_size
+      plist.object_offsets = object_offsets
+      plist.object_count = len(object_offsets)
+      self.assertEqual(expected_result, plist._ParseObjectAt(0))
+      self.assertSetEqual(plist.objects_traversed, {0})
 
 
   def test_ParseObjectByIndex(self):
-    unicode_string = ("\x6F\x00\x11\x65\xaf\x8b\xfa\x76\x7b\x90\x7f\x96\xbe"
-                      "\x75\x33\x8b\xf7\x7e\xc8\x88\xab\x90\x1a\x8f\xc7\x00"
-                      "\x20\x00\x2d\x00\x20\x00\x68\x00\x65\x00\x68")
+    unicode_string = (b"\x6F\x00\x11\x65\xaf\x8b\xfa\x76\x7b\x90\x7f\x96\xbe"
+                      b"\x75\x33\x8b\xf7\x7e\xc8\x88\xab\x90\x1a\x8f\xc7\x00"
+                      b"\x20\x00\x2d\x00\x20\x00\x68\x00\x65\x00\x68")
     actual_string = u"斯诺登避难申请终被通过 - heh"
-    fd = StringIO.StringIO(unicode_string)
+    fd = io.BytesIO(unicode_string)
     plist = binplist.BinaryPlist(file_obj=fd)
     # Make an external offset_list
     offset_list = [0]
@@ -630,19 +1384,19 @@ class BinplistTest(unittest.TestCase):
     # Second test
     second_resulting_object = plist._ParseObjectByIndex(0, offset_list)
     # Test that the UTF16 object was in the cache
-    self.assert_(second_resulting_object is resulting_object)
+    self.assertTrue(second_resulting_object is resulting_object)
     self.assertEqual(resulting_object, actual_string)
 
     # Now test for something more complex. An array that has both unicode and
     # str strings.
     two_element_array = (
-      "\xA2"  # Array of 2 objects
-      "\x01"  # Reference to object unicode string
-      "\x02"  # Reference to object str string
-      "\x61\x65\xaf"  # Unicode object
-      "\x52\x99\xcd"  # Str object
+      b"\xA2"  # Array of 2 objects
+      b"\x01"  # Reference to object unicode string
+      b"\x02"  # Reference to object str string
+      b"\x61\x65\xaf"  # Unicode object
+      b"\x52\x99\xcd"  # Str object
     )
-    fd = StringIO.StringIO(two_element_array)
+    fd = io.BytesIO(two_element_array)
     plist = binplist.BinaryPlist(fd)
     # Parsing with _ParseObjectByIndex requires setting up some bplist
     # properties.
@@ -652,8 +1406,84 @@ class BinplistTest(unittest.TestCase):
     plist.object_ref_size = 1
     plist._file_size = len(two_element_array)
     resulting_object = plist._ParseObjectByIndex(0, offset_list)
-    self.assertEqual(resulting_object, [u"斯", "\x99\xcd"])
+    self.assertEqual(resulting_object, [u"斯", b"\x99\xcd"])
+
+
+  def testEscaping(self):
+    all_bytes = bytes(bytearray(range(256)))
+    safeascii = "".join([chr(c) if chr(c) in string.printable else "\\x%02x" % c
+                         for c in range(256)])
+    hex_escaped = "".join(["\\x%02x" % c for c in range(256)])
+    self.assertEqual(u"'%s'" % safeascii, binplist.PlistToUnicode(all_bytes))
+    self.assertEqual(u"'%s'" % hex_escaped,
+                     binplist.PlistToUnicode(all_bytes, "ascii"))
+    self.assertEqual(u"'%s'" % hex_escaped,
+                     unicode(binplist.RawValue(all_bytes)))
+    self.assertEqual(u"'printable'", binplist.PlistToUnicode("printable"))
+    self.assertEqual(u"''", binplist.PlistToUnicode(""))
+    self.assertEqual(u"''", unicode(binplist.RawValue(b"")))
+
+  def testIterPlistToUnicode(self):
+    plist = {"a": [1, {"b": [b"\xff", u"\xe9"]}, {}], "c": {"d": [[]]}}
+    self.assertEqual(binplist.PlistToUnicode(plist),
+                     u"".join(binplist.IterPlistToUnicode(plist)))
+    self.assertEqual(
+        u"{\n  'a': [1, {\n    'b': ['\\xff', '\xe9']\n  }, {}],\n"
+        u"  'c': {\n    'd': [[]]\n  }\n}",
+        binplist.PlistToUnicode(plist, indent=2))
+
+    # Nesting deeper than the recursion limit
+    depth = sys.getrecursionlimit() + 100
+    deep = nested = {}
+    for _ in range(depth):
+      nested["a"] = {}
+      nested = nested["a"]
+    lines = binplist.PlistToUnicode(deep, indent=1).splitlines()
+    self.assertEqual(2 * depth + 1, len(lines))
+    self.assertEqual(u" " * depth + u"'a': {}", lines[depth])
+
+    output = io.BytesIO()
+    binplist.WritePlistToUnicode(plist, output, encoding="utf-16",
+                                 buffer_size=2)
+    self.assertEqual(binplist.PlistToUnicode(plist),
+                     output.getvalue().decode("utf-16"))
+
+  def testWritePlistToJson(self):
+    plist = {
+        "a": [1, "bc", u"\xe9", 2.5, float("nan"), True, None],
+        "b": [binplist.NullValue, binplist.CorruptReference,
+              binplist.UnknownObject, binplist.Uid(3)],
+        "c": [binplist.RawValue(b"\x01"), b"\xff", {}, []],
+        "d": datetime.datetime(2013, 5, 6, 7, 8, 9, 10, tzinfo=pytz.utc),
+        1: 2,
+    }
+    output = TextIO()
+    binplist.WritePlistToJson(plist, output, buffer_size=8)
+    self.assertEqual({
+        u"a": [1, u"bc", u"\xe9", 2.5, u"NaN", True, None],
+        u"b": [None, {u"$corrupt": u"reference"}, {u"$corrupt": u"unknown"},
+               {u"$uid": 3}],
+        u"c": [{u"$raw": u"AQ=="}, {u"$data": u"/w=="}, {}, []],
+        u"d": u"2013-05-06T07:08:09.000010Z",
+        u"1": 2,
+    }, json.loads(output.getvalue()))
+
+    # Nesting deeper than the recursion limit
+    deep = nested = []
+    for _ in range(sys.getrecursionlimit() + 100):
+      nested.append([])
+      nested = nested[0]
+    output = TextIO()
+    binplist.WritePlistToJson(deep, output)
+    self.assertEqual("[" * (sys.getrecursionlimit() + 101) +
+                     "]" * (sys.getrecursionlimit() + 101), output.getvalue())
 
+    output = TextIO()
+    binplist.WritePlistToNdjson([{"a": 1}, [2], "x"], output)
+    self.assertEqual('{"a": 1}\n[2]\n"x"\n', output.getvalue())
+    output = TextIO()
+    binplist.WritePlistToNdjson({"a": 1}, output)
+    self.assertEqual('{"a": 1}\n', output.getvalue())
 
   def test_PlistToUnicode(self):
     tests = [
@@ -671,11 +1501,11 @@ class BinplistTest(unittest.TestCase):
        u"'abc'",  # with default smartascii
        u"'abc'"),  # with utf-8 encoding
 
-      ('\xff\x34\x55',
+      (b'\xff\x34\x55',
        u"'\\xff4U'",  # smartascii handles this case "visually gracefully"
        u"'\\xff\\x34\\x55'"),  # invalid utf-8, so it's fully escaped
 
-      ('\x00\x00\x00',
+      (b'\x00\x00\x00',
        u"'\\x00\\x00\\x00'",  # smartascii escapes non-printable characters
        u"'\x00\x00\x00'"),  # utf-8 actually encodes these
 
@@ -698,12 +1528,12 @@ class BinplistTest(unittest.TestCase):
        u"{\n    'a': {\n        'b': 3\n    }\n}",  # default indent
        u"{\n    'a': {\n        'b': 3\n    }\n}"), # default indent
 
-      ({u"斯": '\xff\x61'},
+      ({u"斯": b'\xff\x61'},
        u"{\n    '斯': '\\xffa'\n}",  # smartascii handles a gracefully
        u"{\n    '斯': '\\xff\\x61'\n}"),  # utf-8 fails decoding, full-escape
 
       # Misc values
-      (binplist.RawValue('abc'),
+      (binplist.RawValue(b'abc'),
         u"'\\x61\\x62\\x63'",
         u"'\\x61\\x62\\x63'"),
 
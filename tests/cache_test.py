@@ -0,0 +1,125 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for binplist.cache."""
+
+import io
+import plistlib
+import tempfile
+import unittest
+
+from binplist import binplist
+from binplist import cache
+
+# plistlib.Data and writePlistToString are gone in python 3
+_PlistlibData = getattr(plistlib, "Data", bytes)
+_WriteXmlPlist = getattr(plistlib, "dumps", None) or plistlib.writePlistToString
+
+
+class PlistCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.plist = {"a": [1, u"ሴ", binplist.Uid(2)],
+                  "b": binplist.BinaryPlist.plist_epoch,
+                  "c": _PlistlibData(b"\xff")}
+    self.temp_file = tempfile.NamedTemporaryFile()
+    binplist.writePlist(self.plist, self.temp_file)
+    self.temp_file.flush()
+
+  def tearDown(self):
+    self.temp_file.close()
+
+  def testReadPlistByPath(self):
+    plist_cache = cache.PlistCache()
+    parsed = plist_cache.ReadPlist(self.temp_file.name)
+    self.assertEqual(self.plist, parsed)
+    self.assertEqual(0, plist_cache.hits)
+    self.assertEqual(1, plist_cache.misses)
+    cached = plist_cache.ReadPlist(self.temp_file.name)
+    self.assertEqual(self.plist, cached)
+    self.assertTrue(isinstance(cached["a"][2], binplist.Uid))
+    self.assertEqual(1, plist_cache.hits)
+    # Callers get copies
+    cached["a"].append("poison")
+    parsed["b"] = None
+    self.assertEqual(self.plist, plist_cache.ReadPlist(self.temp_file.name))
+    # A modified file is parsed again
+    self.temp_file.seek(0)
+    binplist.writePlist(["modified"], self.temp_file)
+    self.temp_file.truncate()
+    self.temp_file.flush()
+    self.assertEqual(["modified"],
+                     plist_cache.ReadPlist(self.temp_file.name))
+    self.assertEqual(2, plist_cache.misses)
+    self.assertEqual({"hits": 2, "misses": 2, "evictions": 0, "entries": 2,
+                      "size": plist_cache.size}, plist_cache.AsDict())
+
+  def testReadPlistByContents(self):
+    plist_cache = cache.PlistCache()
+    data = binplist.writePlistToString(self.plist)
+    self.assertEqual(self.plist,
+                     plist_cache.ReadPlist(io.BytesIO(data)))
+    self.assertEqual(self.plist,
+                     plist_cache.ReadPlist(io.BytesIO(data)))
+    self.assertEqual(1, plist_cache.hits)
+    # XML plists too
+    xml = _WriteXmlPlist(["xml"])
+    for _ in range(2):
+      self.assertEqual(["xml"], plist_cache.ReadPlist(io.BytesIO(xml)))
+    self.assertEqual(2, plist_cache.hits)
+    self.assertRaises(binplist.FormatError, plist_cache.ReadPlist,
+                      io.BytesIO(b"not a plist"))
+    self.assertEqual(2, len(plist_cache))
+
+  def testEviction(self):
+    plist_cache = cache.PlistCache(max_entries=2)
+    plists = [io.BytesIO(binplist.writePlistToString([index]))
+              for index in range(3)]
+    for plist in plists + plists[1:]:
+      plist.seek(0)
+      plist_cache.ReadPlist(plist)
+    self.assertEqual(2, plist_cache.hits)
+    self.assertEqual(1, plist_cache.evictions)
+    # The least recently used plist was evicted
+    plists[0].seek(0)
+    plist_cache.ReadPlist(plists[0])
+    self.assertEqual(4, plist_cache.misses)
+    self.assertEqual(2, plist_cache.evictions)
+
+    # By size, plists bigger than the cache aren't cached at all
+    plist_cache = cache.PlistCache(max_bytes=100)
+    plist_cache.ReadPlist(io.BytesIO(
+        binplist.writePlistToString(["x" * 100])))
+    self.assertEqual(0, len(plist_cache))
+    for index in range(10):
+      plist_cache.ReadPlist(io.BytesIO(
+          binplist.writePlistToString([index])))
+    self.assertTrue(plist_cache.size <= 100)
+    self.assertEqual(10 - len(plist_cache), plist_cache.evictions)
+    plist_cache.Clear()
+    self.assertEqual(0, plist_cache.size)
+    self.assertEqual(0, len(plist_cache))
+
+  def testReadPlist(self):
+    cache.DEFAULT_CACHE.Clear()
+    self.assertEqual(self.plist, cache.readPlist(self.temp_file.name))
+    self.assertEqual(self.plist, cache.readPlist(self.temp_file.name))
+    self.assertEqual(1, len(cache.DEFAULT_CACHE))
+    cache.DEFAULT_CACHE.Clear()
+
+
+if __name__ == "__main__":
+  unittest.main()
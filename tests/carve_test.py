@@ -0,0 +1,98 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for binplist.carve."""
+
+import tempfile
+import unittest
+
+from binplist import binplist
+from binplist import carve
+
+
+class CarveTest(unittest.TestCase):
+  def setUp(self):
+    self.plists = [
+        {"a": [1, "bc", u"d"], "uid": binplist.Uid(3)},
+        ["x" * 100, 2.5],
+        # A plist embedded as data in another plist
+        {"embedded": binplist.writePlistToString({"inner": True})},
+    ]
+    self.offsets = []
+    chunks = [b"\xFF" * 1000]
+    for plist in self.plists:
+      self.offsets.append(sum(len(chunk) for chunk in chunks))
+      chunks.append(binplist.writePlistToString(plist))
+      # A magic without a plist after every plist
+      chunks.append(b"bplist00" + b"\x00" * 200)
+    self.data = b"".join(chunks)
+    self.temp_file = tempfile.NamedTemporaryFile()
+    self.temp_file.write(self.data)
+    self.temp_file.flush()
+
+  def tearDown(self):
+    self.temp_file.close()
+
+  def testCarvePlistAt(self):
+    carved_plist = carve.CarvePlistAt(self.data, self.offsets[1])
+    self.assertEqual(self.offsets[1], carved_plist.offset)
+    self.assertEqual(len(binplist.writePlistToString(self.plists[1])),
+                     carved_plist.length)
+    self.assertFalse(carved_plist.is_corrupt)
+    self.assertEqual(self.plists[1], carved_plist.top_level_object)
+    # No trailer within the maximum plist size
+    self.assertEqual(None, carve.CarvePlistAt(self.data, self.offsets[1], 50))
+    # A magic without a plist
+    self.assertEqual(None, carve.CarvePlistAt(self.data,
+                                              self.data.rindex(b"bplist00")))
+
+  def testCarvePlists(self):
+    embedded_offset = self.data.index(b"bplist00", self.offsets[2] + 1)
+    expected = [
+        (self.offsets[0], self.plists[0]),
+        (self.offsets[1], self.plists[1]),
+        (self.offsets[2], self.plists[2]),
+        (embedded_offset, {"inner": True}),
+    ]
+    # Small windows split plists and magics across window boundaries
+    for jobs, window_size in [(1, 1 << 20), (1, 7), (1, 300), (2, 300)]:
+      carved_plists = list(carve.CarvePlists(
+          self.temp_file.name, jobs=jobs, window_size=window_size))
+      self.assertEqual(expected, [(carved_plist.offset,
+                                   carved_plist.top_level_object)
+                                  for carved_plist in carved_plists])
+      self.assertFalse(any(carved_plist.is_corrupt
+                           for carved_plist in carved_plists))
+      self.assertTrue(isinstance(carved_plists[0].top_level_object["uid"],
+                                 binplist.Uid))
+
+  def testCarveCorruptPlist(self):
+    # Corrupt the references of the first plist's top level dictionary
+    data = binplist.writePlistToString(self.plists[0])
+    data = data.replace(b"\xD2", b"\xD2\x7F", 1)[:-33] + data[-32:]
+    temp_file = tempfile.NamedTemporaryFile()
+    with temp_file:
+      temp_file.write(b"\x00" * 10 + data)
+      temp_file.flush()
+      carved_plists = list(carve.CarvePlists(temp_file.name, jobs=1))
+    self.assertEqual(1, len(carved_plists))
+    self.assertEqual(10, carved_plists[0].offset)
+    self.assertTrue(carved_plists[0].is_corrupt)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,188 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for binplist.keyedarchive."""
+
+import datetime
+import io
+import plistlib
+import unittest
+
+import pytz
+
+from binplist import binplist
+from binplist import keyedarchive
+
+U = binplist.Uid
+
+# plistlib.Data and writePlistToString are gone in python 3
+_PlistlibData = getattr(plistlib, "Data", bytes)
+_WriteXmlPlist = getattr(plistlib, "dumps", None) or plistlib.writePlistToString
+
+
+def BuildArchive(objects, root=1):
+  """Returns a keyed archive plist with the given objects after "$null"."""
+  return {
+      "$archiver": "NSKeyedArchiver",
+      "$version": 100000,
+      "$top": {"root": U(root)},
+      "$objects": ["$null"] + objects,
+  }
+
+
+class KeyedArchiveTest(unittest.TestCase):
+  def setUp(self):
+    # 1: root dictionary, 2-3: keys, 4: array, 5: string, 6: date, 7: data,
+    # 8: a shared object of a class without decoder, 9-13: classes
+    self.archive = BuildArchive([
+        {"$class": U(9), "NS.keys": [U(2), U(3)], "NS.objects": [U(4), U(8)]},
+        "items",
+        "shared",
+        {"$class": U(10), "NS.objects": [U(5), U(6), U(7), U(8), U(0), 3]},
+        {"$class": U(11), "NS.string": u"caf\xe9"},
+        {"$class": U(12), "NS.time": 86400.5},
+        b"\x00\xff",
+        {"$class": U(13), "name": U(2), "count": 7},
+        {"$classname": "NSMutableDictionary",
+         "$classes": ["NSMutableDictionary", "NSDictionary", "NSObject"]},
+        {"$classname": "MyArray",
+         "$classes": ["MyArray", "NSArray", "NSObject"]},
+        {"$classname": "NSString", "$classes": ["NSString", "NSObject"]},
+        {"$classname": "NSDate", "$classes": ["NSDate", "NSObject"]},
+        {"$classname": "MyThing", "$classes": ["MyThing", "NSObject"]},
+    ])
+    self.date = datetime.datetime(2001, 1, 2, 0, 0, 0, 500000,
+                                  tzinfo=pytz.utc)
+
+  def testDecode(self):
+    archive = keyedarchive.KeyedArchive(self.archive)
+    root = archive.top["root"]
+    self.assertEqual(["items", "shared"], sorted(root))
+    self.assertEqual([u"caf\xe9", self.date, b"\x00\xff",
+                      {"name": "items", "count": 7}, None, 3],
+                     root["items"])
+    shared = root["shared"]
+    self.assertTrue(isinstance(shared, keyedarchive.ArchivedObject))
+    self.assertEqual("MyThing", shared.classname)
+    self.assertEqual(["MyThing", "NSObject"], shared.classes)
+    # Objects referenced twice are decoded once
+    self.assertTrue(root["items"][3] is shared)
+    self.assertTrue(archive.Resolve(U(8)) is shared)
+    self.assertEqual(7, archive.Resolve(7))
+    self.assertFalse(archive.is_corrupt)
+
+  def testLazy(self):
+    archive = keyedarchive.KeyedArchive(self.archive, lazy=True)
+    root = archive.top["root"]
+    self.assertTrue(isinstance(root, binplist.LazyDict))
+    items = root["items"]
+    self.assertTrue(isinstance(items, binplist.LazyList))
+    self.assertEqual(self.date, items[1])
+    self.assertTrue(items[3] is root["shared"])
+    self.assertEqual(keyedarchive.KeyedArchive(self.archive).top["root"],
+                     root.Materialize())
+
+  def testReadKeyedArchive(self):
+    data = binplist.writePlistToString(self.archive)
+    expected = keyedarchive.KeyedArchive(self.archive).top
+    self.assertEqual(expected,
+                     keyedarchive.readKeyedArchive(io.BytesIO(data)))
+    top = keyedarchive.readKeyedArchive(io.BytesIO(data), lazy=True)
+    self.assertEqual(expected["root"], top["root"].Materialize())
+    # XML archives have {"CF$UID": n} dictionaries instead of UIDs
+    def XmlUids(obj):
+      if isinstance(obj, binplist.Uid):
+        return {"CF$UID": int(obj)}
+      if isinstance(obj, dict):
+        return dict((key, XmlUids(value)) for key, value in obj.items())
+      if isinstance(obj, list):
+        return [XmlUids(value) for value in obj]
+      return obj
+    xml_archive = self.archive.copy()
+    xml_archive["$objects"] = XmlUids(self.archive["$objects"])
+    xml_archive["$objects"][7] = _PlistlibData(b"\x00\xff")
+    xml_archive["$top"] = XmlUids(self.archive["$top"])
+    data = _WriteXmlPlist(xml_archive)
+    top = keyedarchive.readKeyedArchive(io.BytesIO(data))
+    self.assertEqual(expected["root"]["shared"], top["root"]["shared"])
+    self.assertEqual(self.date, top["root"]["items"][1])
+
+  def testCircularReferences(self):
+    # An array that contains itself and a dictionary that contains the array
+    archive = keyedarchive.KeyedArchive(BuildArchive([
+        {"$class": U(3), "NS.objects": [U(1), U(2)]},
+        {"$class": U(4), "NS.keys": [U(5)], "NS.objects": [U(1)]},
+        {"$classname": "NSArray"},
+        {"$classname": "NSDictionary"},
+        "parent",
+    ]))
+    root = archive.top["root"]
+    self.assertTrue(root[0] is root)
+    self.assertTrue(root[1]["parent"] is root)
+    self.assertFalse(archive.is_corrupt)
+    # A decoder can't return an object that contains itself
+    archive = keyedarchive.KeyedArchive(BuildArchive([
+        {"$class": U(2), "NS.string": U(1)},
+        {"$classname": "NSString"},
+    ]))
+    self.assertEqual(binplist.CorruptReference, archive.top["root"])
+    self.assertTrue(archive.is_corrupt)
+
+  def testDeepNesting(self):
+    depth = 5000
+    objects = [{"$class": U(depth + 2), "NS.objects": [U(index + 2)]}
+               for index in range(depth)]
+    objects.append({"$class": U(depth + 2), "NS.objects": []})
+    objects.append({"$classname": "NSArray"})
+    root = keyedarchive.KeyedArchive(BuildArchive(objects)).top["root"]
+    for _ in range(depth):
+      root = root[0]
+    self.assertEqual([], root)
+
+  def testCorruptArchive(self):
+    archive = keyedarchive.KeyedArchive(BuildArchive([
+        {"$class": U(5), "NS.keys": [U(2), U(3)],
+         "NS.objects": [U(99), U(4)]},
+        "a",
+        {"$class": U(6), "NS.objects": []},
+        {"$class": U(7), "NS.time": "not a number"},
+        {"$classname": "NSDictionary"},
+        {"$classname": "NSArray"},
+        {"$classname": "NSDate"},
+    ]))
+    self.assertEqual({"a": binplist.CorruptReference,
+                      "corrupt:3": binplist.CorruptReference},
+                     archive.top["root"])
+    self.assertTrue(archive.is_corrupt)
+    # An object that is its own class description
+    archive = keyedarchive.KeyedArchive(BuildArchive([{"$class": U(1)}]))
+    self.assertEqual(binplist.CorruptReference, archive.top["root"])
+    self.assertTrue(archive.is_corrupt)
+    self.assertRaises(binplist.FormatError, keyedarchive.KeyedArchive, [1])
+    self.assertRaises(binplist.FormatError, keyedarchive.KeyedArchive,
+                      {"$objects": []})
+
+  def testClassDecoders(self):
+    def DecodeThing(archive, fields):
+      return (archive.Resolve(fields["name"]), fields["count"])
+    archive = keyedarchive.KeyedArchive(
+        self.archive, class_decoders={"MyThing": DecodeThing})
+    self.assertEqual(("items", 7), archive.top["root"]["shared"])
+
+
+if __name__ == "__main__":
+  unittest.main()
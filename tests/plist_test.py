@@ -0,0 +1,150 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright 2013 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the scripts/plist.py command line tool."""
+
+import os
+import plistlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from binplist import binplist
+
+# plistlib.writePlistToString is gone in python 3
+_WriteXmlPlist = getattr(plistlib, "dumps", None) or plistlib.writePlistToString
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SCRIPT = os.path.join(_ROOT, "scripts", "plist.py")
+
+A_TEXT = b"{\n    'a': [1, 'x'],\n    'b': 2.5\n}\n"
+B_TEXT = b"['b']\n"
+
+
+class PlistScriptTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(self.directory, "dir"))
+    for name, data in [
+        ("dir/a.plist", binplist.writePlistToString({"a": [1, "x"], "b": 2.5})),
+        ("dir/b.plist", _WriteXmlPlist(["b"])),
+        ("bad.plist", b"not a plist"),
+        ("list.txt", b"dir/b.plist\n\ndir/a.plist\n")]:
+      with open(os.path.join(self.directory, name), "wb") as fd:
+        fd.write(data)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def _Run(self, *arguments):
+    """Runs the script in the fixture directory.
+
+    Returns:
+      A tuple with the exit code, the output and the error output.
+    """
+    environment = dict(os.environ, PYTHONPATH=_ROOT)
+    process = subprocess.Popen(
+        [sys.executable, _SCRIPT] + list(arguments), cwd=self.directory,
+        env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error_output = process.communicate()
+    return process.returncode, output, error_output.decode("utf-8")
+
+  def testSinglePlist(self):
+    # A single plist is written without its path
+    self.assertEqual((0, A_TEXT, ""), self._Run("dir/a.plist"))
+    self.assertEqual((0, B_TEXT, ""), self._Run("dir/b.plist"))
+
+  def testBatch(self):
+    tagged = (b"==> dir/a.plist <==\n" + A_TEXT +
+              b"==> dir/b.plist <==\n" + B_TEXT)
+    for arguments in [["dir/a.plist", "dir/b.plist"], ["dir"],
+                      ["-j", "2", "dir/a.plist", "dir/b.plist"],
+                      ["-j", "2", "-o", "input", "dir"]]:
+      self.assertEqual((0, tagged, ""), self._Run(*arguments))
+    # Paths listed in a file, in their order
+    self.assertEqual(
+        (0, b"==> dir/b.plist <==\n" + B_TEXT +
+         b"==> dir/a.plist <==\n" + A_TEXT, ""),
+        self._Run("@list.txt"))
+    # In completion order, only the order of the plists may change
+    code, output, error_output = self._Run("-j", "2", "-o", "completion",
+                                           "dir")
+    self.assertEqual((0, ""), (code, error_output))
+    self.assertEqual(sorted(tagged.split(b"==> ")),
+                     sorted(output.split(b"==> ")))
+
+  def testBatchErrors(self):
+    for jobs in ["1", "2"]:
+      code, output, error_output = self._Run(
+          "-j", jobs, "dir/a.plist", "bad.plist", "missing.plist",
+          "dir/b.plist")
+      # Plists that can't be parsed don't stop the batch
+      self.assertEqual(1, code)
+      self.assertEqual(b"==> dir/a.plist <==\n" + A_TEXT +
+                       b"==> dir/b.plist <==\n" + B_TEXT, output)
+      self.assertTrue("ERROR:root:bad.plist: ExpatError" in error_output)
+      self.assertTrue("ERROR:root:missing.plist: " in error_output)
+      self.assertTrue("2 plists could not be parsed." in error_output)
+
+  def testJsonFormats(self):
+    a_json = b'{"a": [1, "x"], "b": 2.5}'
+    self.assertEqual((0, a_json + b"\n", ""),
+                     self._Run("-f", "json", "dir/a.plist"))
+    # ndjson writes each element of a top level array in its own line
+    self.assertEqual((0, b'"b"\n', ""),
+                     self._Run("-f", "ndjson", "dir/b.plist"))
+    for jobs in ["1", "2"]:
+      self.assertEqual(
+          (0, b'{"path": "dir/a.plist", "plist": ' + a_json + b'}\n'
+              b'{"path": "dir/b.plist", "plist": ["b"]}\n', ""),
+          self._Run("-f", "json", "-j", jobs, "dir"))
+      code, output, error_output = self._Run(
+          "-f", "ndjson", "-j", jobs, "dir/b.plist", "bad.plist",
+          "dir/a.plist")
+      self.assertEqual(1, code)
+      self.assertEqual(b'{"path": "dir/b.plist", "plist": "b"}\n'
+                       b'{"path": "dir/a.plist", "plist": ' + a_json + b'}\n',
+                       output)
+      self.assertTrue("ERROR:root:bad.plist: ExpatError" in error_output)
+
+  def testStats(self):
+    for jobs in ["1", "2"]:
+      code, output, error_output = self._Run("-s", "-j", jobs, "dir/a.plist",
+                                             "bad.plist")
+      # Statistics go to stderr, so the output is unchanged
+      self.assertEqual(1, code)
+      self.assertEqual(b"==> dir/a.plist <==\n" + A_TEXT, output)
+      lines = error_output.splitlines()
+      stats = lines[lines.index("==> dir/a.plist stats <==") + 1:]
+      for phase in ["_ReadHeader", "_ReadTrailer", "_ReadOffsetTable",
+                    "_ParseObjects", "render"]:
+        self.assertTrue(any(line.startswith(phase) for line in stats))
+      for counter in ["ARRAY 1", "DICT 1", "INT 1", "REAL 1", "STRING 3",
+                      "cache hits/misses 7/7"]:
+        self.assertTrue(counter in [" ".join(line.split()) for line in stats])
+      self.assertTrue(any(line.startswith("reads/seeks/bytes")
+                          for line in stats))
+      # Plists that can't be parsed report the phases they went through
+      self.assertTrue("==> bad.plist stats <==" in error_output)
+    # Without --stats nothing is reported
+    self.assertEqual((0, A_TEXT, ""), self._Run("dir/a.plist"))
+
+
+if __name__ == "__main__":
+  unittest.main()